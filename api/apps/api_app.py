@@ -37,7 +37,7 @@ from api.utils import get_uuid, current_timestamp, datetime_format
 from api.utils.api_utils import server_error_response, get_data_error_result, get_json_result, validate_request, \
     generate_confirmation_token
 
-from api.utils.file_utils import filename_type, thumbnail
+from api.utils.file_utils import filename_type, page_row_number, thumbnail
 from rag.app.tag import label_question
 from rag.prompts.generator import keyword_extraction
 from rag.utils.storage_factory import STORAGE_IMPL
@@ -442,6 +442,7 @@ def upload():
             "size": len(blob),
             "thumbnail": thumbnail(filename, blob),
             "suffix": Path(filename).suffix.lstrip("."),
+            **page_row_number(filename, blob),
         }
 
         form_data = request.form
@@ -19,7 +19,6 @@ import pathlib
 import re
 from pathlib import Path
 
-import flask
 from flask import request
 from flask_login import current_user, login_required
 
@@ -39,10 +38,11 @@ from api.utils import get_uuid
 from api.utils.api_utils import (
     get_data_error_result,
     get_json_result,
+    send_storage_object,
     server_error_response,
     validate_request,
 )
-from api.utils.file_utils import filename_type, get_project_base_directory, thumbnail
+from api.utils.file_utils import filename_type, get_project_base_directory, page_row_number, thumbnail
 from api.utils.web_utils import CONTENT_TYPE_MAP, html2pdf, is_valid_url
 from deepdoc.parser.html_parser import RAGFlowHtmlParser
 from rag.nlp import search, rag_tokenizer
@@ -132,6 +132,7 @@ def web_crawl():
             "size": len(blob),
             "thumbnail": thumbnail(filename, blob),
             "suffix": Path(filename).suffix.lstrip("."),
+            **page_row_number(filename, blob),
         }
         if doc["type"] == FileType.VISUAL:
             doc["parser_id"] = ParserType.PICTURE.value
@@ -562,17 +563,19 @@ def get(doc_id):
         if not e:
             return get_data_error_result(message="Document not found!")
 
-        b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
-        response = flask.make_response(STORAGE_IMPL.get(b, n))
-
         ext = re.search(r"\.([^.]+)$", doc.name.lower())
         ext = ext.group(1) if ext else None
+        content_type = "application/octet-stream"
         if ext:
             if doc.type == FileType.VISUAL.value:
                 content_type = CONTENT_TYPE_MAP.get(ext, f"image/{ext}")
             else:
                 content_type = CONTENT_TYPE_MAP.get(ext, f"application/{ext}")
-            response.headers.set("Content-Type", content_type)
+
+        b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
+        response = send_storage_object(b, n, content_type)
+        if response is None:
+            return get_data_error_result(message="Document not found!")
         return response
     except Exception as e:
         return server_error_response(e)
@@ -638,8 +641,9 @@ def get_image(image_id):
         if len(arr) != 2:
             return get_data_error_result(message="Image not found.")
         bkt, nm = image_id.split("-")
-        response = flask.make_response(STORAGE_IMPL.get(bkt, nm))
-        response.headers.set("Content-Type", "image/JPEG")
+        response = send_storage_object(bkt, nm, "image/JPEG")
+        if response is None:
+            return get_data_error_result(message="Image not found.")
         return response
     except Exception as e:
         return server_error_response(e)
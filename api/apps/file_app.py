@@ -18,14 +18,13 @@ import os
 import pathlib
 import re
 
-import flask
 from flask import request
 from flask_login import login_required, current_user
 
 from api.common.check_team_permission import check_file_team_permission
 from api.db.services.document_service import DocumentService
 from api.db.services.file2document_service import File2DocumentService
-from api.utils.api_utils import server_error_response, get_data_error_result, validate_request
+from api.utils.api_utils import server_error_response, get_data_error_result, send_storage_object, validate_request
 from api.utils import get_uuid
 from api.db import FileType, FileSource
 from api.db.services import duplicate_name
@@ -346,20 +345,21 @@ def get(file_id):
         if not check_file_team_permission(file, current_user.id):
             return get_json_result(data=False, message='No authorization.', code=settings.RetCode.AUTHENTICATION_ERROR)
 
-        blob = STORAGE_IMPL.get(file.parent_id, file.location)
-        if not blob:
-            b, n = File2DocumentService.get_storage_address(file_id=file_id)
-            blob = STORAGE_IMPL.get(b, n)
-
-        response = flask.make_response(blob)
         ext = re.search(r"\.([^.]+)$", file.name.lower())
         ext = ext.group(1) if ext else None
+        content_type = "application/octet-stream"
         if ext:
             if file.type == FileType.VISUAL.value:
                 content_type = CONTENT_TYPE_MAP.get(ext, f"image/{ext}")
             else:
                 content_type = CONTENT_TYPE_MAP.get(ext, f"application/{ext}")
-            response.headers.set("Content-Type", content_type)
+
+        response = send_storage_object(file.parent_id, file.location, content_type)
+        if response is None:
+            b, n = File2DocumentService.get_storage_address(file_id=file_id)
+            response = send_storage_object(b, n, content_type)
+        if response is None:
+            return get_data_error_result(message="Document not found!")
         return response
     except Exception as e:
         return server_error_response(e)
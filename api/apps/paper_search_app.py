@@ -89,6 +89,9 @@ def paper_search_with_keywords():
             "result_count": 0,  # 将在服务中更新
         }
 
+        # 保存检索记录，检索结果与各阶段耗时由服务更新
+        PaperSearchRecord.create(**search_record)
+
         # 基于用户选择的关键词构建搜索查询
         search_query_parts = []
 
@@ -144,6 +147,9 @@ def paper_search():
             "result_count": 0,  # 将在服务中更新
         }
 
+        # 保存检索记录，检索结果与各阶段耗时由服务更新
+        PaperSearchRecord.create(**search_record)
+
         # 执行检索
         result = PaperSearchService.search_papers(
             search_record_id=search_record["id"],
@@ -17,10 +17,9 @@ import datetime
 import logging
 import pathlib
 import re
-from io import BytesIO
 
 import xxhash
-from flask import request, send_file
+from flask import request
 from peewee import OperationalError
 from pydantic import BaseModel, Field, validator
 
@@ -36,7 +35,7 @@ from api.db.services.llm_service import LLMBundle
 from api.db.services.tenant_llm_service import TenantLLMService
 from api.db.services.task_service import TaskService, queue_tasks
 from api.db.services.dialog_service import meta_filter, convert_conditions
-from api.utils.api_utils import check_duplicate_ids, construct_json_result, get_error_data_result, get_parser_config, get_result, server_error_response, token_required
+from api.utils.api_utils import check_duplicate_ids, construct_json_result, get_error_data_result, get_parser_config, get_result, send_storage_object, server_error_response, token_required
 from rag.app.qa import beAdoc, rmPrefix
 from rag.app.tag import label_question
 from rag.nlp import rag_tokenizer, search
@@ -400,17 +399,10 @@ def download(tenant_id, dataset_id, document_id):
         return get_error_data_result(message=f"The dataset not own the document {document_id}.")
     # The process of downloading
     doc_id, doc_location = File2DocumentService.get_storage_address(doc_id=document_id)  # minio address
-    file_stream = STORAGE_IMPL.get(doc_id, doc_location)
-    if not file_stream:
+    response = send_storage_object(doc_id, doc_location, "application/octet-stream", download_name=doc[0].name, allow_empty=False)
+    if response is None:
         return construct_json_result(message="This file is empty.", code=settings.RetCode.DATA_ERROR)
-    file = BytesIO(file_stream)
-    # Use send_file with a proper filename and MIME type
-    return send_file(
-        file,
-        as_attachment=True,
-        download_name=doc[0].name,
-        mimetype="application/octet-stream",  # Set a default MIME type
-    )
+    return response
 
 
 @manager.route("/datasets/<dataset_id>/documents", methods=["GET"])  # noqa: F821
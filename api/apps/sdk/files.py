@@ -18,14 +18,13 @@
 import pathlib
 import re
 
-import flask
 from flask import request
 from pathlib import Path
 
 from api.db.services.document_service import DocumentService
 from api.db.services.file2document_service import File2DocumentService
 from api.db.services.knowledgebase_service import KnowledgebaseService
-from api.utils.api_utils import server_error_response, token_required
+from api.utils.api_utils import send_storage_object, server_error_response, token_required
 from api.utils import get_uuid
 from api.db import FileType
 from api.db.services import duplicate_name
@@ -614,18 +613,20 @@ def get(tenant_id, file_id):
         if not e:
             return get_json_result(message="Document not found!", code=404)
 
-        blob = STORAGE_IMPL.get(file.parent_id, file.location)
-        if not blob:
-            b, n = File2DocumentService.get_storage_address(file_id=file_id)
-            blob = STORAGE_IMPL.get(b, n)
-
-        response = flask.make_response(blob)
         ext = re.search(r"\.([^.]+)$", file.name)
+        content_type = 'application/octet-stream'
         if ext:
             if file.type == FileType.VISUAL.value:
-                response.headers.set('Content-Type', 'image/%s' % ext.group(1))
+                content_type = 'image/%s' % ext.group(1)
             else:
-                response.headers.set('Content-Type', 'application/%s' % ext.group(1))
+                content_type = 'application/%s' % ext.group(1)
+
+        response = send_storage_object(file.parent_id, file.location, content_type)
+        if response is None:
+            b, n = File2DocumentService.get_storage_address(file_id=file_id)
+            response = send_storage_object(b, n, content_type)
+        if response is None:
+            return get_json_result(message="Document not found!", code=404)
         return response
     except Exception as e:
         return server_error_response(e)
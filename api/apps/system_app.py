@@ -39,6 +39,7 @@ from rag.utils.storage_factory import STORAGE_IMPL, STORAGE_IMPL_TYPE
 from timeit import default_timer as timer
 
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.query_embed_cache import QUERY_EMBED_CACHE
 from flask import jsonify
 from api.utils.health_utils import run_health_checks
 
@@ -160,6 +161,8 @@ def status():
             "error": str(e),
         }
 
+    res["query_embed_cache"] = QUERY_EMBED_CACHE.stats()
+
     task_executor_heartbeats = {}
     try:
         task_executors = REDIS_CONN.smembers("TASKEXE")
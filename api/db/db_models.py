@@ -771,6 +771,8 @@ class Document(DataBaseModel):
     process_duration = FloatField(default=0)
     meta_fields = JSONField(null=True, default={})
     suffix = CharField(max_length=32, null=False, help_text="The real file extension suffix", index=True)
+    page_num = IntegerField(null=True, help_text="pages of a PDF, counted at upload")
+    row_num = IntegerField(null=True, help_text="rows of a spreadsheet, counted at upload")
 
     run = CharField(max_length=1, null=True, help_text="start to run processing or cancel.(1: run it; 2: cancel)", default="0", index=True)
     status = CharField(max_length=1, null=True, help_text="is it validate(0: wasted, 1: validate)", default="1", index=True)
@@ -1026,6 +1028,7 @@ class PaperSearchRecord(DataBaseModel):
     keywords = LongTextField()  # 提取的关键词（JSON格式）
     search_results = LongTextField()  # 检索结果（JSON格式）
     result_count = IntegerField(default=0)  # 结果数量
+    stage_timings = LongTextField(null=True)  # 各检索阶段耗时，单位毫秒（JSON格式）
     created_at = BigIntegerField(default=utils.current_timestamp)
     updated_at = BigIntegerField(default=utils.current_timestamp)
 
@@ -1231,6 +1234,14 @@ def migrate_db():
         migrate(migrator.add_column("document", "pipeline_id", CharField(max_length=32, null=True, help_text="Pipeline ID", index=True)))
     except Exception:
         pass
+    try:
+        migrate(migrator.add_column("document", "page_num", IntegerField(null=True, help_text="pages of a PDF, counted at upload")))
+    except Exception:
+        pass
+    try:
+        migrate(migrator.add_column("document", "row_num", IntegerField(null=True, help_text="rows of a spreadsheet, counted at upload")))
+    except Exception:
+        pass
     try:
         migrate(migrator.add_column("knowledgebase", "graphrag_task_id", CharField(max_length=32, null=True, help_text="Gragh RAG task ID", index=True)))
     except Exception:
@@ -1280,4 +1291,9 @@ def migrate_db():
         migrate(migrator.add_column("paper_survey_record", "process_duration", FloatField(default=0)))
     except Exception:
         pass
+    # 为 PaperSearchRecord 表添加阶段耗时字段
+    try:
+        migrate(migrator.add_column("paper_search_record", "stage_timings", LongTextField(null=True)))
+    except Exception:
+        pass
     logging.disable(logging.NOTSET)
@@ -544,8 +544,7 @@ def chat(dialog, messages, stream=True, **kwargs):
 
             refs = deepcopy(kbinfos)
             for c in refs["chunks"]:
-                if c.get("vector"):
-                    del c["vector"]
+                c.pop("vector", None)
 
         if answer.lower().find("invalid key") >= 0 or answer.lower().find("invalid api") >= 0:
             answer += " Please set LLM API-Key in 'User Setting -> Model providers -> API-Key'"
@@ -809,8 +808,7 @@ def ask(question, kb_ids, tenant_id, chat_llm_name=None, search_config={}):
         kbinfos["doc_aggs"] = recall_docs
         refs = deepcopy(kbinfos)
         for c in refs["chunks"]:
-            if c.get("vector"):
-                del c["vector"]
+            c.pop("vector", None)
 
         if answer.lower().find("invalid key") >= 0 or answer.lower().find("invalid api") >= 0:
             answer += " Please set LLM API-Key in 'User Setting -> Model Providers -> API-Key'"
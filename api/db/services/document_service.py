@@ -36,10 +36,11 @@ from api.db.services.common_service import CommonService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.utils import current_timestamp, get_format_time, get_uuid
 from rag.nlp import rag_tokenizer, search
-from rag.settings import get_svr_queue_name, SVR_CONSUMER_GROUP_NAME
-from rag.utils.redis_conn import REDIS_CONN
+from rag.settings import get_svr_queue_name
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.task_scheduler import svr_queue_stats
 
 
 class DocumentService(CommonService):
@@ -372,7 +373,7 @@ class DocumentService(CommonService):
     @DB.connection_context()
     def get_unfinished_docs(cls):
         fields = [cls.model.id, cls.model.process_begin_at, cls.model.parser_config, cls.model.progress_msg,
-                  cls.model.run, cls.model.parser_id]
+                  cls.model.run, cls.model.parser_id, cls.model.progress, cls.model.update_time]
         docs = cls.model.select(*fields) \
             .where(
             cls.model.status == StatusEnum.VALID.value,
@@ -671,39 +672,90 @@ class DocumentService(CommonService):
     @classmethod
     @DB.connection_context()
     def _sync_progress(cls, docs:list[dict]):
-        from api.db.services.task_service import TaskService
+        """
+        Fold the progress of the tasks of every document into the document, for all of them at once:
+        one grouped query over Task, the messages of the documents that changed only, one Redis
+        round trip for the queue lengths and a single transaction updating the rows that differ.
+        """
+        docs = {d["id"]: d for d in docs}
+        if not docs:
+            return
 
-        for d in docs:
+        def flag(cond):
+            return fn.SUM(Case(None, [(cond, 1)], 0))
+
+        stats = {}
+        doc_ids = list(docs.keys())
+        for i in range(0, len(doc_ids), 1000):
+            rows = Task.select(
+                Task.doc_id,
+                fn.COUNT(Task.id).alias("tasks"),
+                fn.SUM(Case(None, [(Task.progress >= 0, Task.progress)], 0)).alias("progress"),
+                flag(Task.progress == -1).alias("bad"),
+                flag((Task.progress >= 0) & (Task.progress < 1)).alias("unfinished"),
+                flag(Task.task_type == "").alias("parse_tasks"),
+                flag(Task.task_type == "toc").alias("toc_tasks"),
+                fn.MAX(Task.priority).alias("priority"),
+                fn.MAX(Task.update_time).alias("update_time"),
+            ).where(Task.doc_id.in_(doc_ids[i: i + 1000])).group_by(Task.doc_id)
+            for r in rows.dicts():
+                stats[r["doc_id"]] = r
+
+        changed = {}
+        for doc_id, st in stats.items():
+            d = docs[doc_id]
             try:
-                tsks = TaskService.query(doc_id=d["id"], order_by=Task.create_time)
-                if not tsks:
-                    continue
-                msg = []
-                prg = 0
-                finished = True
-                bad = 0
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
-                priority = 0
-                for t in tsks:
-                    if 0 <= t.progress < 1:
-                        finished = False
-                    if t.progress == -1:
-                        bad += 1
-                    prg += t.progress if t.progress >= 0 else 0
-                    if t.progress_msg.strip():
-                        msg.append(t.progress_msg)
-                    priority = max(priority, t.priority)
-                prg /= len(tsks)
+                prg = float(st["progress"] or 0) / st["tasks"]
+                bad = int(st["bad"] or 0)
+                finished = not int(st["unfinished"] or 0)
+                priority = int(st["priority"] or 0)
+                if finished and not bad and int(st["parse_tasks"] or 0) > 1 \
+                        and d["parser_id"] == "naive" and (d["parser_config"] or {}).get("toc_extraction", False) \
+                        and not int(st["toc_tasks"] or 0):
+                    # The document was parsed by several tasks, its TOC is built over all their chunks.
+                    queue_toc_task(doc_id, priority)
+                    finished = False
+                status = d["run"]
                 if finished and bad:
                     prg = -1
                     status = TaskStatus.FAIL.value
                 elif finished:
                     prg = 1
                     status = TaskStatus.DONE.value
+                waiting = not prg and not bad
+                if not waiting and prg == d.get("progress") and status == d["run"] \
+                        and (st["update_time"] or 0) <= (d.get("update_time") or 0):
+                    continue
+                changed[doc_id] = (prg, status, priority, waiting)
+            except Exception as e:
+                if str(e).find("'0'") < 0:
+                    logging.exception("fetch task exception")
+        if not changed:
+            return
 
-                msg = "\n".join(sorted(msg))
+        msgs = {}
+        changed_ids = list(changed.keys())
+        for i in range(0, len(changed_ids), 1000):
+            rows = Task.select(Task.doc_id, Task.progress_msg).where(Task.doc_id.in_(changed_ids[i: i + 1000])).order_by(Task.create_time)
+            for r in rows.dicts():
+                if r["progress_msg"] and r["progress_msg"].strip():
+                    msgs.setdefault(r["doc_id"], []).append(r["progress_msg"])
+
+        queue_lengths = None
+
+        def queue_length(priority):
+            nonlocal queue_lengths
+            if queue_lengths is None:
+                queue_lengths = {p: v["lag"] for p, v in svr_queue_stats()["priorities"].items()}
+            return queue_lengths.get(priority, 0)
+
+        updates = []
+        for doc_id, (prg, status, priority, waiting) in changed.items():
+            d = docs[doc_id]
+            try:
+                msg = "\n".join(sorted(msgs.get(doc_id, [])))
                 info = {
+                    "id": doc_id,
                     "process_duration": datetime.timestamp(
                         datetime.now()) -
                                        d["process_begin_at"].timestamp(),
@@ -712,14 +764,19 @@ class DocumentService(CommonService):
                     info["progress"] = prg
                 if msg:
                     info["progress_msg"] = msg
-                    if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
-                        info["progress_msg"] += "\n%d tasks are ahead in the queue..."%get_queue_length(priority)
+                    if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap") or msg.endswith("created task toc"):
+                        info["progress_msg"] += "\n%d tasks are ahead in the queue..." % queue_length(priority)
                 else:
-                    info["progress_msg"] = "%d tasks are ahead in the queue..."%get_queue_length(priority)
-                cls.update_by_id(d["id"], info)
+                    info["progress_msg"] = "%d tasks are ahead in the queue..." % queue_length(priority)
+                # Waiting documents are looked at every time, they only change with the queue.
+                if waiting and info["run"] == d["run"] and info["progress_msg"] == d.get("progress_msg"):
+                    continue
+                updates.append(info)
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
+        if updates:
+            cls.update_many_by_id(updates)
 
     @classmethod
     @DB.connection_context()
@@ -827,15 +884,39 @@ def queue_raptor_o_graphrag_tasks(sample_doc_id, ty, priority, fake_doc_id="", d
     task["doc_id"] = fake_doc_id
     task["doc_ids"] = doc_ids
     DocumentService.begin2parse(sample_doc_id["id"])
-    assert REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task), "Can't access Redis. Please check the Redis' status."
+    assert REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task, sub_queue=chunking_config["tenant_id"]), "Can't access Redis. Please check the Redis' status."
     return task["id"]
 
 
+def queue_toc_task(doc_id, priority):
+    """Queue the task building the TOC of a document over the chunks of all its parsing tasks."""
+    # Progress is synced by the server and by every executor finishing a task, only one of them may queue it.
+    lock = RedisDistributedLock("queue_toc_task_" + doc_id, timeout=60)
+    if not lock.acquire():
+        return None
+    try:
+        if Task.select().where((Task.doc_id == doc_id) & (Task.task_type == "toc")).exists():
+            return None
+        task = {
+            "id": get_uuid(),
+            "doc_id": doc_id,
+            "from_page": 100000000,
+            "to_page": 100000000,
+            "task_type": "toc",
+            "progress_msg": datetime.now().strftime("%H:%M:%S") + " created task toc",
+            "begin_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "priority": priority,
+        }
+        task["digest"] = xxhash.xxh64((doc_id + "toc").encode("utf-8")).hexdigest()
+        bulk_insert_into_db(Task, [task], True)
+        assert REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task, sub_queue=DocumentService.get_tenant_id(doc_id)), "Can't access Redis. Please check the Redis' status."
+        return task["id"]
+    finally:
+        lock.release()
+
+
 def get_queue_length(priority):
-    group_info = REDIS_CONN.queue_info(get_svr_queue_name(priority), SVR_CONSUMER_GROUP_NAME)
-    if not group_info:
-        return 0
-    return int(group_info.get("lag", 0) or 0)
+    return svr_queue_stats(priorities=(priority,))["lag"]
 
 
 def doc_upload_and_parse(conversation_id, file_objs, user_id):
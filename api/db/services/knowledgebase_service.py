@@ -13,6 +13,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
 from datetime import datetime
 
 from peewee import fn, JOIN
@@ -21,6 +22,12 @@ from api.db import StatusEnum, TenantPermission
 from api.db.db_models import DB, Document, Knowledgebase, User, UserTenant, UserCanvas
 from api.db.services.common_service import CommonService
 from api.utils import current_timestamp, datetime_format
+from rag.utils.redis_conn import REDIS_CONN
+
+SEARCHABLE_KBS_CACHE_PREFIX = "kb_searchable"
+SEARCHABLE_KBS_CACHE_EXPIRE = 600
+# Fields whose change alters which knowledge bases a tenant can search, or how.
+SEARCHABLE_KBS_FIELDS = {"tenant_id", "permission", "status", "embd_id"}
 
 
 class KnowledgebaseService(CommonService):
@@ -242,6 +249,83 @@ class KnowledgebaseService(CommonService):
         kb_ids = [kb.id for kb in kbs]
         return kb_ids
 
+    @classmethod
+    @DB.connection_context()
+    def get_searchable_kbs(cls, tenant_id):
+        # Get the knowledge bases a tenant searches across: its own ones first, then all public ones.
+        # Both lists are cached in Redis and dropped whenever a knowledge base is created,
+        # deleted or has its permission changed, see invalidate_searchable_kbs().
+        # Args:
+        #     tenant_id: Tenant ID
+        # Returns:
+        #     List of dicts with id, tenant_id and embd_id, without duplicates
+        fields = [cls.model.id, cls.model.tenant_id, cls.model.embd_id]
+
+        def load(key, *filters):
+            cached = REDIS_CONN.get(key)
+            if cached:
+                try:
+                    return json.loads(cached)
+                except Exception:
+                    pass
+            kbs = list(cls.model.select(*fields).where(cls.model.status == StatusEnum.VALID.value, *filters).order_by(cls.model.create_time.asc()).dicts())
+            REDIS_CONN.set_obj(key, kbs, SEARCHABLE_KBS_CACHE_EXPIRE)
+            return kbs
+
+        own_kbs = load(f"{SEARCHABLE_KBS_CACHE_PREFIX}:tenant:{tenant_id}", cls.model.tenant_id == tenant_id)
+        public_kbs = load(f"{SEARCHABLE_KBS_CACHE_PREFIX}:public", cls.model.permission == TenantPermission.PUBLIC.value)
+
+        res, seen = [], set()
+        for kb in own_kbs + public_kbs:
+            if kb["id"] in seen:
+                continue
+            seen.add(kb["id"])
+            res.append(kb)
+        return res
+
+    @classmethod
+    def invalidate_searchable_kbs(cls, tenant_ids):
+        # Drop the cached searchable knowledge bases of the given tenants together with the public list.
+        # Args:
+        #     tenant_ids: Iterable of tenant IDs
+        for tenant_id in set(tenant_ids):
+            REDIS_CONN.delete(f"{SEARCHABLE_KBS_CACHE_PREFIX}:tenant:{tenant_id}")
+        REDIS_CONN.delete(f"{SEARCHABLE_KBS_CACHE_PREFIX}:public")
+
+    @classmethod
+    @DB.connection_context()
+    def _tenant_ids_of(cls, kb_ids):
+        return [kb.tenant_id for kb in cls.model.select(cls.model.tenant_id).where(cls.model.id.in_(kb_ids))]
+
+    @classmethod
+    def save(cls, **kwargs):
+        res = super().save(**kwargs)
+        cls.invalidate_searchable_kbs([kwargs.get("tenant_id", "")])
+        return res
+
+    @classmethod
+    def update_by_id(cls, pid, data):
+        if not SEARCHABLE_KBS_FIELDS.intersection(data.keys()):
+            return super().update_by_id(pid, data)
+        tenant_ids = cls._tenant_ids_of([pid])
+        num = super().update_by_id(pid, data)
+        cls.invalidate_searchable_kbs(tenant_ids + cls._tenant_ids_of([pid]))
+        return num
+
+    @classmethod
+    def delete_by_id(cls, pid):
+        tenant_ids = cls._tenant_ids_of([pid])
+        num = super().delete_by_id(pid)
+        cls.invalidate_searchable_kbs(tenant_ids)
+        return num
+
+    @classmethod
+    def delete_by_ids(cls, pids):
+        tenant_ids = cls._tenant_ids_of(pids)
+        num = super().delete_by_ids(pids)
+        cls.invalidate_searchable_kbs(tenant_ids)
+        return num
+
     @classmethod
     @DB.connection_context()
     def get_detail(cls, kb_id):
@@ -14,16 +14,22 @@
 #  limitations under the License.
 #
 import json
+import re
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from timeit import default_timer as timer
+from typing import Callable, List, Dict, Any, Optional
 from io import BytesIO
 
+import numpy as np
+import trio
+import xxhash
+
 from docx import Document
 from docx.shared import RGBColor
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from flask import Response
 
-from api.db.db_models import PaperSearchRecord, PaperSurveyRecord, PaperSurveyDownloadRecord, Task
+from api.db.db_models import Document as DocumentModel, PaperSearchRecord, PaperSurveyRecord, PaperSurveyDownloadRecord, Task
 from api.db.services.common_service import CommonService
 from api.db.services.llm_service import LLMBundle
 from api.db.services.knowledgebase_service import KnowledgebaseService
@@ -31,11 +37,13 @@ from api.db.services.document_service import DocumentService
 from api.db.db_utils import bulk_insert_into_db
 from api import settings
 from api.utils import get_uuid
+from graphrag.utils import get_llm_cache, set_llm_cache
 from rag.nlp import search
 from rag.utils.redis_conn import REDIS_CONN
-from rag.settings import get_svr_queue_name
+from rag.settings import EMBEDDING_BATCH_SIZE, MAX_CONCURRENT_SURVEY_SUMMARIES, SURVEY_MAP_REDUCE_MIN_PAPERS, SURVEY_PAPER_CONTENT_TOKENS, SURVEY_SECTION_MAX_PAPERS, get_svr_queue_name
+from rag.utils import truncate
 
-from api.db import LLMType, TenantPermission
+from api.db import LLMType
 from loguru import logger
 
 
@@ -53,8 +61,12 @@ class PaperSearchService(CommonService):
         use_fuzzy: bool = True,
     ) -> Dict[str, Any]:
         """执行论文检索"""
+        search_start = timer()
+        stage_timings = {}
+
         # 1. 提取关键词 (独立的LLM调用，不依赖RAG)
         keywords_response = cls.extract_keywords(query, tenant_id, keywords_num, query_num)
+        stage_timings["keywords"] = round((timer() - search_start) * 1000, 2)
 
         # 2. 更新检索记录
         search_record = {
@@ -72,120 +84,118 @@ class PaperSearchService(CommonService):
 
         search_query = " ".join(all_keywords)
 
-        # 4. 执行RAGFlow检索 - 获取用户所有知识库以及所有公开知识库
+        # 4. 执行RAGFlow检索 - 在用户所有知识库以及所有公开知识库中检索
         #    如果没有知识库，则返回空结果但关键词提取成功
-        user_kbs = KnowledgebaseService.query(tenant_id=tenant_id)
-        public_kbs = KnowledgebaseService.query(permission=TenantPermission.PUBLIC.value)
+        papers = cls._retrieve_papers(search_query, tenant_id, stage_timings)
 
-        # 合并用户知识库和公开知识库
-        all_kbs = user_kbs + public_kbs
-        kb_ids = [kb.id for kb in all_kbs]
+        # 5. 更新检索记录
+        stage_timings["total"] = round((timer() - search_start) * 1000, 2)
+        cls._save_search_results(search_record_id, papers, stage_timings)
 
-        papers = []
-        if kb_ids:
-            # 如果有可用知识库，则执行检索
-            try:
-                # 获取知识库信息 - use the first kb's tenant_id to get embedding model
-                first_kb = all_kbs[0] if all_kbs else None
-                if not first_kb:
-                    # 没有有效的知识库
-                    pass
-                else:
-                    # 获取嵌入模型
-                    embd_mdl = LLMBundle(first_kb.tenant_id, LLMType.EMBEDDING, llm_name=first_kb.embd_id)
-
-                    # 执行检索使用RAGFlow原生检索能力
-                    retriever = search.Dealer(settings.docStoreConn)
-
-                    # 检索参数
-                    page = 1
-                    page_size = 30
-                    similarity_threshold = 0.2
-                    vector_similarity_weight = 0.3
-                    top_k = 1024
-
-                    # 执行RAGFlow检索
-                    ranks = retriever.retrieval(
-                        search_query,
-                        embd_mdl,
-                        first_kb.tenant_id,
-                        kb_ids,
-                        page=page,
-                        page_size=page_size,
-                        similarity_threshold=similarity_threshold,
-                        vector_similarity_weight=vector_similarity_weight,
-                        top=top_k,
-                        doc_ids=None,
-                        aggs=True,
-                    )
-
-                    # 5. 处理检索结果 - 将文档块信息转换为论文格式
-                    processed_docs = set()
-
-                    for chunk in ranks.get("chunks", []):
-                        doc_id = chunk.get("doc_id", "")
-
-                        # 避免重复处理同一文档
-                        if doc_id in processed_docs:
-                            continue
-                        processed_docs.add(doc_id)
-
-                        # 从数据库获取文档详细信息
-                        doc_info = DocumentService.get_by_id(doc_id)
-                        if doc_info and doc_info[0] and doc_info[1]:
-                            doc = doc_info[1]
-
-                            paper = {
-                                "uid": doc.id,
-                                "title": doc.name,  # 使用文档名称作为标题
-                                "abstract": chunk.get("content_with_weight", "")[:500],  # 使用内容前500字符作为摘要
-                                "source": "RAGFlow知识库",
-                                "selected": True,
-                                "similarity": chunk.get("similarity", 0.0),
-                                "doc_id": doc_id,
-                                "kb_id": chunk.get("kb_id", ""),
-                            }
-
-                            papers.append(paper)
-            except Exception as e:
-                # 如果RAG检索出错，仍然返回关键词但papers为空
-                logger.error(f"RAG检索失败: {str(e)}")
-                papers = []
-        else:
+        # 6. 返回结果
+        return {"search_record_id": search_record_id, "papers": papers, "keywords": keywords_response}
+
+    @classmethod
+    def _retrieve_papers(cls, search_query: str, tenant_id: str, stage_timings: Dict[str, float]) -> List[Dict[str, Any]]:
+        """在租户知识库及公开知识库中检索，并把命中的文档块解析为论文列表
+
+        各阶段耗时（毫秒）写入 stage_timings，便于统计 /paper_search 的延迟分布。
+        """
+        st = timer()
+        kbs = KnowledgebaseService.get_searchable_kbs(tenant_id)
+        stage_timings["kb_scope"] = round((timer() - st) * 1000, 2)
+        if not kbs:
             # 没有可用知识库，返回空结果
             logger.warning("未找到可用的知识库，返回空检索结果")
-            papers = []
+            return []
 
-        # 6. 更新检索记录
-        search_record_update = {"search_results": json.dumps(papers, ensure_ascii=False), "result_count": len(papers)}
+        kb_ids = [kb["id"] for kb in kbs]
+        # 使用第一个知识库的租户和嵌入模型
+        first_kb = kbs[0]
+        try:
+            st = timer()
+            embd_mdl = LLMBundle(first_kb["tenant_id"], LLMType.EMBEDDING, llm_name=first_kb["embd_id"])
+
+            # 执行检索使用RAGFlow原生检索能力
+            retriever = search.Dealer(settings.docStoreConn)
+            ranks = retriever.retrieval(
+                search_query,
+                embd_mdl,
+                first_kb["tenant_id"],
+                kb_ids,
+                page=1,
+                page_size=30,
+                similarity_threshold=0.2,
+                vector_similarity_weight=0.3,
+                top=1024,
+                doc_ids=None,
+                aggs=True,
+            )
+            stage_timings["retrieval"] = round((timer() - st) * 1000, 2)
 
-        cls.model.update(search_record_update).where(cls.model.id == search_record_id).execute()
+            st = timer()
+            papers = cls._resolve_papers(ranks.get("chunks", []))
+            stage_timings["resolve"] = round((timer() - st) * 1000, 2)
+            return papers
+        except Exception as e:
+            # 如果RAG检索出错，仍然返回关键词但papers为空
+            logger.error(f"RAG检索失败: {str(e)}")
+            return []
 
-        # 7. 返回结果
-        return {"search_record_id": search_record_id, "papers": papers, "keywords": keywords_response}
+    @classmethod
+    def _resolve_papers(cls, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """将检索结果中的文档块转换为论文格式，每篇文档只取排名最高的块
+
+        文档信息通过一次 get_by_ids 批量查询获得，避免逐个文档查询数据库。
+        """
+        top_chunks = {}
+        for chunk in chunks:
+            doc_id = chunk.get("doc_id", "")
+            if doc_id and doc_id not in top_chunks:
+                top_chunks[doc_id] = chunk
+        if not top_chunks:
+            return []
+
+        docs = {doc.id: doc for doc in DocumentService.get_by_ids(list(top_chunks.keys()), cols=[DocumentModel.id, DocumentModel.name])}
+
+        papers = []
+        for doc_id, chunk in top_chunks.items():
+            doc = docs.get(doc_id)
+            if not doc:
+                continue
+            papers.append(
+                {
+                    "uid": doc.id,
+                    "title": doc.name,  # 使用文档名称作为标题
+                    "abstract": chunk.get("content_with_weight", "")[:500],  # 使用内容前500字符作为摘要
+                    "source": "RAGFlow知识库",
+                    "selected": True,
+                    "similarity": chunk.get("similarity", 0.0),
+                    "doc_id": doc_id,
+                    "kb_id": chunk.get("kb_id", ""),
+                }
+            )
+        return papers
 
     @classmethod
-    def _get_full_document_content(cls, doc_id: str, tenant_id: str, kb_ids: list) -> str:
-        """获取文档的完整内容"""
+    def _save_search_results(cls, search_record_id: str, papers: List[Dict[str, Any]], stage_timings: Dict[str, float]):
+        """保存检索结果及各阶段耗时"""
+        logger.info(f"论文检索完成: search_record_id={search_record_id}, papers={len(papers)}, stage_timings={stage_timings}")
+        search_record_update = {
+            "search_results": json.dumps(papers, ensure_ascii=False),
+            "result_count": len(papers),
+            "stage_timings": json.dumps(stage_timings),
+        }
+        cls.model.update(search_record_update).where(cls.model.id == search_record_id).execute()
+
+    @classmethod
+    def _get_full_document_content(cls, doc_id: str, tenant_id: str, kb_ids: list, max_tokens: Optional[int] = SURVEY_PAPER_CONTENT_TOKENS) -> str:
+        """按位置顺序流式拼接文档内容，达到 max_tokens 后不再读取后续块"""
         try:
-            from rag.nlp.search import Dealer
-            from api import settings
-            
-            # 使用检索器获取文档的所有块
-            retriever = Dealer(settings.docStoreConn)
-            all_chunks = retriever.chunk_list(doc_id, tenant_id, kb_ids)
-            
-            # 按位置排序并组合完整的文档内容
-            sorted_chunks = sorted(all_chunks, key=lambda x: x.get("position_int", 0))
-            
-            # 组合所有块的内容
-            full_content_parts = []
-            for chunk in sorted_chunks:
-                content = chunk.get("content_with_weight", "")
-                if content:
-                    full_content_parts.append(content)
-            
-            return "\n".join(full_content_parts)
+            # 排序由文档存储完成，逐页读取，超出令牌预算即停止
+            chunks = settings.retriever.iter_chunks(doc_id, tenant_id, kb_ids, fields=["content_with_weight"],
+                                                    sort_by_position=True, max_tokens=max_tokens)
+            return "\n".join(c["content_with_weight"] for c in chunks if c.get("content_with_weight"))
         except Exception as e:
             logger.error(f"获取文档完整内容失败: {str(e)}")
             return ""
@@ -200,6 +210,8 @@ class PaperSearchService(CommonService):
         use_fuzzy: bool = True,
     ) -> Dict[str, Any]:
         """使用已确认的关键词执行论文检索"""
+        search_start = timer()
+        stage_timings = {}
 
         # 1. 更新检索记录 - 先保存查询和关键词
         search_record = {
@@ -208,100 +220,15 @@ class PaperSearchService(CommonService):
         }
         cls.model.update(search_record).where(cls.model.id == search_record_id).execute()
 
-        # 2. 执行RAGFlow检索 - 获取用户所有知识库以及所有公开知识库
+        # 2. 执行RAGFlow检索 - 在用户所有知识库以及所有公开知识库中检索
         #    如果没有知识库，则返回空结果但关键词提取成功
-        user_kbs = KnowledgebaseService.query(tenant_id=tenant_id)
-        public_kbs = KnowledgebaseService.query(permission=TenantPermission.PUBLIC.value)
-
-        # 确保我们处理的是知识库对象而不是布尔值
-        user_kbs = [kb for kb in (user_kbs.dicts() if hasattr(user_kbs, "dicts") else user_kbs) if hasattr(kb, "id")]
-        public_kbs = [kb for kb in (public_kbs.dicts() if hasattr(public_kbs, "dicts") else public_kbs) if hasattr(kb, "id")]
+        papers = cls._retrieve_papers(search_query, tenant_id, stage_timings)
 
-        # 合并用户知识库和公开知识库
-        all_kbs = user_kbs + public_kbs
-        kb_ids = [kb.id for kb in all_kbs]
+        # 3. 更新检索记录
+        stage_timings["total"] = round((timer() - search_start) * 1000, 2)
+        cls._save_search_results(search_record_id, papers, stage_timings)
 
-        papers = []
-        if kb_ids:
-            # 如果有可用知识库，则执行检索
-            try:
-                # 获取知识库信息 - use the first kb's tenant_id to get embedding model
-                first_kb = all_kbs[0] if all_kbs else None
-                if not first_kb:
-                    # 没有有效的知识库
-                    pass
-                else:
-                    # 获取嵌入模型
-                    embd_mdl = LLMBundle(first_kb.tenant_id, LLMType.EMBEDDING, llm_name=first_kb.embd_id)
-
-                    # 执行检索使用RAGFlow原生检索能力
-                    retriever = search.Dealer(settings.docStoreConn)
-
-                    # 检索参数
-                    page = 1
-                    page_size = 30
-                    similarity_threshold = 0.2
-                    vector_similarity_weight = 0.3
-                    top_k = 1024
-
-                    # 执行RAGFlow检索
-                    ranks = retriever.retrieval(
-                        search_query,
-                        embd_mdl,
-                        first_kb.tenant_id,
-                        kb_ids,
-                        page=page,
-                        page_size=page_size,
-                        similarity_threshold=similarity_threshold,
-                        vector_similarity_weight=vector_similarity_weight,
-                        top=top_k,
-                        doc_ids=None,
-                        aggs=True,
-                    )
-
-                    # 5. 处理检索结果 - 将文档块信息转换为论文格式
-                    processed_docs = set()
-
-                    for chunk in ranks.get("chunks", []):
-                        doc_id = chunk.get("doc_id", "")
-
-                        # 避免重复处理同一文档
-                        if doc_id in processed_docs:
-                            continue
-                        processed_docs.add(doc_id)
-
-                        # 从数据库获取文档详细信息
-                        doc_info = DocumentService.get_by_id(doc_id)
-                        if doc_info and doc_info[0] and doc_info[1]:
-                            doc = doc_info[1]
-
-                            paper = {
-                                "uid": doc.id,
-                                "title": doc.name,  # 使用文档名称作为标题
-                                "abstract": chunk.get("content_with_weight", "")[:500],  # 使用内容前500字符作为摘要
-                                "source": "RAGFlow知识库",
-                                "selected": True,
-                                "similarity": chunk.get("similarity", 0.0),
-                                "doc_id": doc_id,
-                                "kb_id": chunk.get("kb_id", ""),
-                            }
-
-                            papers.append(paper)
-            except Exception as e:
-                # 如果RAG检索出错，仍然返回关键词但papers为空
-                logger.error(f"RAG检索失败: {str(e)}")
-                papers = []
-        else:
-            # 没有可用知识库，返回空结果
-            logger.warning("未找到可用的知识库，返回空检索结果")
-            papers = []
-
-        # 6. 更新检索记录
-        search_record_update = {"search_results": json.dumps(papers, ensure_ascii=False), "result_count": len(papers)}
-
-        cls.model.update(search_record_update).where(cls.model.id == search_record_id).execute()
-
-        # 7. 返回结果
+        # 4. 返回结果
         return {
             "search_record_id": search_record_id,
             "papers": papers,
@@ -311,26 +238,33 @@ class PaperSearchService(CommonService):
         }
 
     @classmethod
-    def generate_paper_summary(cls, paper: Dict[str, Any], tenant_id: str) -> str:
-        """生成单篇文献简报"""
+    def generate_paper_summary(cls, paper: Dict[str, Any], tenant_id: str, chat_mdl=None) -> str:
+        """生成单篇文献简报
+
+        简报按 (doc_id, 内容摘要, 模型) 缓存，重复生成覆盖相同论文的综述时直接复用。
+        """
         try:
             # 获取聊天模型
-            from api.db.services.llm_service import LLMBundle
-            from api.db import LLMType
-
-            chat_mdl = LLMBundle(tenant_id, LLMType.CHAT)
+            if chat_mdl is None:
+                chat_mdl = LLMBundle(tenant_id, LLMType.CHAT)
 
             # 构建简报生成提示词
             title = paper.get("title", "未知标题")
-            content = paper.get("full_content", "") or paper.get("abstract", "")
-            
+            content = (paper.get("full_content", "") or paper.get("abstract", ""))[:4000]  # 限制内容长度避免超限
+
+            model_name = getattr(chat_mdl.mdl, "model_name", None) or chat_mdl.llm_name
+            digest = xxhash.xxh64((title + "\n" + content).encode("utf-8", "surrogatepass")).hexdigest()
+            cached = get_llm_cache(model_name, digest, "paper_summary", {"doc_id": paper.get("doc_id", "")})
+            if cached:
+                return cached
+
             summary_prompt = f"""
 请对以下学术论文生成一份200字左右的简报：
 
 论文标题: {title}
 
 论文内容:
-{content[:4000]}  # 限制内容长度避免超限
+{content}
 
 请按照以下结构生成简报，确保内容准确反映原文：
 1. **研究主题**：概括论文的核心研究主题
@@ -359,7 +293,9 @@ class PaperSearchService(CommonService):
             chat_params["extra_body"] = extra_body
 
             summary_content = chat_mdl.chat("", history, chat_params)
-            
+            if summary_content and summary_content.find("**ERROR**") < 0:
+                set_llm_cache(model_name, digest, summary_content, "paper_summary", {"doc_id": paper.get("doc_id", "")})
+
             return summary_content
         except Exception as e:
             logger.error(f"生成单篇文献简报失败: {str(e)}")
@@ -368,6 +304,54 @@ class PaperSearchService(CommonService):
             abstract = paper.get("abstract", "")
             return f"标题: {title}\n摘要: {abstract}"
 
+    @classmethod
+    async def summarize_papers(
+        cls,
+        papers: List[Dict[str, Any]],
+        tenant_id: str,
+        limiter: trio.CapacityLimiter,
+        callback: Optional[Callable[[int, int], None]] = None,
+        is_canceled: Optional[Callable[[], bool]] = None,
+    ) -> List[Dict[str, str]]:
+        """并发获取全文并生成每篇文献的简报
+
+        Args:
+            papers: 论文列表，缺少 full_content 的论文会先获取全文
+            tenant_id: 租户ID
+            limiter: 限制同时处理的论文数量（全文获取与LLM调用）
+            callback: 每完成一篇调用一次，参数为 (已完成数量, 总数量)
+            is_canceled: 返回 True 时停止启动新的论文并取消剩余工作
+
+        Returns:
+            与 papers 顺序一致的简报列表 [{"title", "summary"}]；被取消时未完成的项为 None
+        """
+        chat_mdl = LLMBundle(tenant_id, LLMType.CHAT)
+        paper_summaries = [None] * len(papers)
+        finished = 0
+
+        async def summarize(i, paper, cancel_scope):
+            nonlocal finished
+            async with limiter:
+                if is_canceled and is_canceled():
+                    cancel_scope.cancel()
+                    return
+                paper = paper.copy()
+                if not paper.get("full_content"):
+                    # 获取文档完整内容
+                    full_content = await trio.to_thread.run_sync(lambda: cls._get_full_document_content(paper.get("doc_id", ""), tenant_id, [paper.get("kb_id", "")]))
+                    if full_content:
+                        paper["full_content"] = full_content
+                summary = await trio.to_thread.run_sync(lambda: cls.generate_paper_summary(paper, tenant_id, chat_mdl))
+            paper_summaries[i] = {"title": paper.get("title", "未知标题"), "summary": summary}
+            finished += 1
+            if callback:
+                callback(finished, len(papers))
+
+        async with trio.open_nursery() as nursery:
+            for i, paper in enumerate(papers):
+                nursery.start_soon(summarize, i, paper, nursery.cancel_scope)
+        return paper_summaries
+
     @classmethod
     def generate_survey(cls, survey_record: Dict[str, Any], papers: List[Dict[str, Any]]) -> Dict[str, Any]:
         """生成论文综述"""
@@ -378,57 +362,14 @@ class PaperSearchService(CommonService):
             # 获取租户信息
             tenant_id = survey_record["tenant_id"]
 
-            # 1. 如果论文没有full_content，获取完整内容
-            updated_papers = []
-            for paper in papers:
-                updated_paper = paper.copy()
-                if not updated_paper.get("full_content"):
-                    # 获取文档完整内容
-                    full_content = cls._get_full_document_content(updated_paper.get("doc_id", ""), tenant_id, [updated_paper.get("kb_id", "")])
-                    if full_content:
-                        updated_paper["full_content"] = full_content
-                updated_papers.append(updated_paper)
-
-            # 2. 生成每篇文献的简报
-            paper_summaries = []
-            for i, paper in enumerate(updated_papers):
-                logger.info(f"正在生成第 {i+1}/{len(updated_papers)} 篇文献的简报")
-                summary = cls.generate_paper_summary(paper, tenant_id)
-                paper_summaries.append({
-                    "title": paper.get("title", "未知标题"),
-                    "summary": summary
-                })
-
-            # 3. 构建综述生成提示词（使用简报而非原文档）
-            survey_prompt = cls._build_survey_prompt_from_summaries(paper_summaries)
-
-            # 获取聊天模型
-            from api.db.services.llm_service import LLMBundle
-            from api.db import LLMType
-
-            chat_mdl = LLMBundle(tenant_id, LLMType.CHAT)
-
-            # 准备消息历史
-            history = [
-                {
-                    "role": "user",
-                    "content": survey_prompt,
-                }
-            ]
-
-            # 生成综述
-            # 添加兼容DashScope等API的参数
-            chat_params = {"temperature": 0.7, "max_tokens": 2048}
+            # 1. 并发获取完整内容并生成每篇文献的简报
+            def log_progress(finished, total):
+                logger.info(f"已生成 {finished}/{total} 篇文献的简报")
 
-            # 设置extra_body参数以支持DashScope
-            extra_body = {"enable_thinking": False}
-            chat_params["extra_body"] = extra_body
+            paper_summaries = trio.run(cls.summarize_papers, papers, tenant_id, trio.CapacityLimiter(MAX_CONCURRENT_SURVEY_SUMMARIES), log_progress)
 
-            survey_content = chat_mdl.chat(
-                "",  # 系统提示词已经包含在用户输入中
-                history,
-                chat_params,
-            )
+            # 2. 基于简报生成综述，论文较多时按主题聚类分章节生成后再合并
+            survey_content = trio.run(cls.compose_survey, paper_summaries, tenant_id)
 
             # 更新综述记录
             PaperSurveyRecord.update(survey_content=survey_content, status="completed").where(PaperSurveyRecord.id == survey_record["id"]).execute()
@@ -441,6 +382,167 @@ class PaperSearchService(CommonService):
             logger.error(f"生成综述失败: {str(e)}")
             raise e
 
+    @classmethod
+    async def compose_survey(
+        cls,
+        paper_summaries: List[Dict[str, str]],
+        tenant_id: str,
+        limiter: Optional[trio.CapacityLimiter] = None,
+        callback: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """基于简报生成综述
+
+        论文数量不超过 SURVEY_MAP_REDUCE_MIN_PAPERS 时，所有简报放入一个提示词一次生成；
+        否则采用 map-reduce 方式：按简报的嵌入向量聚类，并行为每个簇撰写章节草稿，
+        再由最后一次调用补充研究背景、挑战与展望。引用编号始终对应简报在 paper_summaries 中的位置。
+        """
+        chat_mdl = LLMBundle(tenant_id, LLMType.CHAT)
+        if limiter is None:
+            limiter = trio.CapacityLimiter(MAX_CONCURRENT_SURVEY_SUMMARIES)
+
+        if len(paper_summaries) <= SURVEY_MAP_REDUCE_MIN_PAPERS:
+            survey_prompt = cls._build_survey_prompt_from_summaries(paper_summaries)
+            history = [{"role": "user", "content": survey_prompt}]
+            chat_params = {"temperature": 0.7, "max_tokens": 2048, "extra_body": {"enable_thinking": False}}
+            async with limiter:
+                return await trio.to_thread.run_sync(lambda: chat_mdl.chat("", history, chat_params))
+
+        # 1. 按主题聚类
+        if callback:
+            callback(f"正在按主题对 {len(paper_summaries)} 份简报聚类...")
+        embd_mdl = LLMBundle(tenant_id, LLMType.EMBEDDING)
+        texts = [truncate(f"{ps.get('title', '')}\n{ps.get('summary', '')}", embd_mdl.max_length - 10) for ps in paper_summaries]
+        embeddings = []
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            vts, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode(texts[i : i + EMBEDDING_BATCH_SIZE]))
+            embeddings.extend(vts)
+        clusters = await trio.to_thread.run_sync(lambda: cls._cluster_paper_summaries(np.array(embeddings), SURVEY_SECTION_MAX_PAPERS))
+
+        # 2. map: 并行为每个簇撰写章节草稿
+        if callback:
+            callback(f"正在并行撰写 {len(clusters)} 个章节草稿...")
+        section_drafts = [""] * len(clusters)
+        chat_params = {"temperature": 0.7, "max_tokens": 2048, "extra_body": {"enable_thinking": False}}
+        max_prompt_tokens = chat_mdl.max_length - chat_params["max_tokens"]
+
+        async def write_section(i, idxs):
+            prompt = cls._build_survey_section_prompt(paper_summaries, idxs, max_prompt_tokens)
+            async with limiter:
+                # 部分模型会修改生成参数，每次调用使用独立的副本
+                draft = await trio.to_thread.run_sync(lambda: chat_mdl.chat("", [{"role": "user", "content": prompt}], dict(chat_params)))
+            section_drafts[i] = cls._filter_citations(draft, {idx + 1 for idx in idxs})
+
+        async with trio.open_nursery() as nursery:
+            for i, idxs in enumerate(clusters):
+                nursery.start_soon(write_section, i, idxs)
+
+        # 3. reduce: 基于章节草稿撰写研究背景、技术挑战与未来方向，章节草稿原样保留
+        if callback:
+            callback("正在合并章节草稿...")
+        prompt = cls._build_survey_merge_prompt(section_drafts, len(paper_summaries), max_prompt_tokens)
+        async with limiter:
+            framing = await trio.to_thread.run_sync(lambda: chat_mdl.chat("", [{"role": "user", "content": prompt}], dict(chat_params)))
+        framing = cls._filter_citations(framing, set(range(1, len(paper_summaries) + 1)))
+
+        pos = framing.find("## 技术挑战与局限")
+        head, tail = (framing[:pos], framing[pos:]) if pos >= 0 else (framing, "")
+        return "\n\n".join([head.strip(), "## 核心技术进展分析", *[d.strip() for d in section_drafts], tail.strip()]).strip()
+
+    @classmethod
+    def _cluster_paper_summaries(cls, embeddings: np.ndarray, max_papers: int, random_state: int = 0) -> List[List[int]]:
+        """与 RAPTOR 相同，先用 UMAP 降维再用高斯混合模型聚类
+
+        返回每个簇包含的简报下标，单个簇不超过 max_papers 篇，簇按其中排名最靠前的论文排序。
+        """
+        import umap
+        from sklearn.mixture import GaussianMixture
+
+        n = len(embeddings)
+        if n <= max_papers:
+            return [list(range(n))]
+
+        reduced = umap.UMAP(
+            n_neighbors=max(2, int((n - 1) ** 0.8)),
+            n_components=min(12, n - 2),
+            metric="cosine",
+            random_state=random_state,
+        ).fit_transform(embeddings)
+
+        min_clusters = -(-n // max_papers)
+        best_gm, best_bic = None, None
+        for n_clusters in range(min_clusters, min(n - 1, min_clusters * 3) + 1):
+            gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
+            gm.fit(reduced)
+            bic = gm.bic(reduced)
+            if best_bic is None or bic < best_bic:
+                best_gm, best_bic = gm, bic
+        labels = best_gm.predict(reduced)
+
+        clusters = []
+        for c in sorted(set(labels.tolist())):
+            idxs = [i for i in range(n) if labels[i] == c]
+            # 超出上限的簇按排名顺序拆分，保证每次调用的输入规模有界
+            clusters.extend(idxs[i : i + max_papers] for i in range(0, len(idxs), max_papers))
+        return sorted(clusters, key=lambda idxs: idxs[0])
+
+    @classmethod
+    def _build_survey_section_prompt(cls, paper_summaries: List[Dict[str, str]], idxs: List[int], max_prompt_tokens: int) -> str:
+        """构建单个章节草稿的提示词，简报使用其在全部简报中的编号"""
+        len_per_summary = max(1, int((max_prompt_tokens - 1024) / len(idxs)))
+        summaries_detail = "\n".join(
+            [f"简报 ##{i + 1}$$:\n- 标题: {paper_summaries[i].get('title', '未知标题')}\n- 简报: {truncate(paper_summaries[i].get('summary', ''), len_per_summary)}\n" for i in idxs]
+        )
+        allowed = "、".join([f"##{i + 1}$$" for i in idxs])
+
+        return f"""
+###目标###
+你是文献综述专家。以下{len(idxs)}份简报对应的论文研究主题相近，请为一篇中文文献综述撰写其中一个章节的草稿。
+
+###文献简报###
+{summaries_detail}
+
+###写作要求###
+1. 第一行是概括这组论文共同主题的三级标题，以 "### " 开头
+2. 深入对比各论文的技术方法、实验结果、创新点与局限性，包含具体的技术细节和数据
+3. 每个技术点、观点或数据都必须标注引用，格式为 ##编号$$，编号只能是：{allowed}
+4. 不要撰写引言、总结、展望或参考文献列表
+5. 严格禁止使用[1]、（1）、文献[1]等其他引用格式
+"""
+
+    @classmethod
+    def _build_survey_merge_prompt(cls, section_drafts: List[str], paper_count: int, max_prompt_tokens: int) -> str:
+        """构建合并章节草稿的提示词，只生成研究背景、技术挑战与未来方向"""
+        len_per_draft = max(1, int((max_prompt_tokens - 1024) / len(section_drafts)))
+        drafts_detail = "\n\n".join([f"章节 {i + 1}:\n{truncate(draft, len_per_draft)}" for i, draft in enumerate(section_drafts)])
+
+        return f"""
+###目标###
+你是文献综述专家。以下是一篇围绕{paper_count}篇论文的中文文献综述中"核心技术进展分析"部分的{len(section_drafts)}个章节草稿，草稿中已使用 ##编号$$ 标注引用。
+请在通读这些章节的基础上，撰写综述的其余部分。
+
+###章节草稿###
+{drafts_detail}
+
+###输出结构###
+严格按以下三个二级标题依次输出，不要输出其他二级标题，也不要复述章节草稿：
+## 研究背景
+（融合各章节的研究动机与问题定义，并概述各章节的主题脉络）
+## 技术挑战与局限
+（结合各章节指出的问题和瓶颈）
+## 未来研究方向
+（综合各章节的建议和展望）
+
+###引用规范###
+1. 只能引用章节草稿中已出现的 ##编号$$，不得修改或重新编号
+2. 严格禁止添加参考文献列表或References章节
+3. 严格禁止使用[1]、（1）、文献[1]等其他引用格式
+"""
+
+    @classmethod
+    def _filter_citations(cls, content: str, allowed: set) -> str:
+        """删除不在允许范围内的 ##编号$$ 引用，避免模型臆造的编号指向错误的文献"""
+        return re.sub(r"##(\d+)\$\$", lambda m: m.group(0) if int(m.group(1)) in allowed else "", content or "")
+
     @classmethod
     def queue_survey_task(cls, survey_record: Dict[str, Any], papers: List[Dict[str, Any]], priority: int = 0) -> str:
         """将综述生成任务加入队列
@@ -483,7 +585,7 @@ class PaperSearchService(CommonService):
         }
 
         # 5. 推送到 Redis 队列
-        success = REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task_message)
+        success = REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task_message, sub_queue=survey_record["tenant_id"])
 
         if not success:
             logger.error(f"综述任务入队失败: task_id={task['id']}, survey_id={survey_record['id']}")
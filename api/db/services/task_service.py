@@ -14,6 +14,7 @@
 #  limitations under the License.
 #
 import logging
+import math
 import os
 import random
 import xxhash
@@ -29,14 +30,17 @@ from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.utils import current_timestamp, get_uuid
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
-from rag.settings import get_svr_queue_name
+from rag.settings import PDF_TASK_MIN_PAGES, get_svr_queue_name
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_scheduler import svr_queue_stats
 from api import settings
 from rag.nlp import search
 
 CANVAS_DEBUG_DOC_ID = "dataflow_x"
 GRAPH_RAPTOR_FAKE_DOC_ID = "graph_raptor_x"
+# Tasks each executor runs at once, as configured for rag/svr/task_executor.py.
+TASK_SLOTS_PER_EXECUTOR = int(os.environ.get("MAX_CONCURRENT_TASKS", "5"))
 
 def trim_header_by_lines(text: str, max_length) -> str:
     # Trim header text to maximum length while preserving line breaks
@@ -323,6 +327,56 @@ class TaskService(CommonService):
         return cls.model.delete().where(cls.model.doc_id.in_(doc_ids)).execute()
 
 
+def idle_task_slots() -> int:
+    """Estimate how many more tasks the live task executors could start right now."""
+    try:
+        slots = len(REDIS_CONN.smembers("TASKEXE") or []) * TASK_SLOTS_PER_EXECUTOR
+        queue_stats = svr_queue_stats()
+        slots -= queue_stats["pending"] + queue_stats["lag"]
+        return max(0, slots)
+    except Exception:
+        logging.exception("idle_task_slots")
+        return 0
+
+
+def pdf_task_page_size(doc: dict, pages: int) -> int:
+    """Decide how many pages of a PDF each parsing task covers.
+
+    An explicit `task_page_size` of the parser config is kept as is. Otherwise the size
+    starts from what a task of this parser and layout model should hold when every
+    executor is busy, and shrinks to spread the document over the idle executors, down
+    to PDF_TASK_MIN_PAGES pages a task so each keeps amortizing its fixed cost.
+
+    Args:
+        doc (dict): Document dictionary with its parser_id and parser_config.
+        pages (int): Number of pages of the PDF.
+
+    Returns:
+        int: Pages per task, 10^9 when the document has to be parsed by a single task.
+    """
+    parser_config = doc["parser_config"]
+    if parser_config.get("task_page_size"):
+        return parser_config["task_page_size"]
+
+    layout = parser_config.get("layout_recognize", "DeepDOC")
+    if isinstance(layout, bool):
+        layout = "DeepDOC" if layout else "Plain Text"
+    # These parse the whole file at once, or are fast enough not to be worth splitting.
+    if doc["parser_id"] in ["one", "knowledge_graph"] or layout in ["Plain Text", "MinerU"]:
+        return 10 ** 9
+
+    page_size = 22 if doc["parser_id"] == "paper" else 12
+    min_pages = PDF_TASK_MIN_PAGES
+    if layout != "DeepDOC":
+        # A vision model describes the pages one by one, each one costs several DeepDOC pages.
+        page_size, min_pages = max(1, page_size // 4), 1
+
+    idle = idle_task_slots()
+    if idle > 1 and pages > 0:
+        page_size = min(page_size, max(min_pages, math.ceil(pages / idle)))
+    return page_size
+
+
 def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     """Create and queue document processing tasks.
 
@@ -338,7 +392,8 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         priority (int, optional): Priority level for task queueing (default is 0).
 
     Note:
-        - For PDF documents, tasks are created per page range based on configuration
+        - For PDF documents, tasks are created per page range sized by `pdf_task_page_size`
+        - A document split into several tasks has its TOC built by a separate merge task
         - For Excel documents, tasks are created per row range
         - Task digests are calculated for optimization and reuse
         - Previous task chunks may be reused if available
@@ -357,16 +412,15 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     parse_task_array = []
 
     if doc["type"] == FileType.PDF.value:
-        file_bin = STORAGE_IMPL.get(bucket, name)
-        do_layout = doc["parser_config"].get("layout_recognize", "DeepDOC")
-        pages = PdfParser.total_page_number(doc["name"], file_bin)
+        # Counted at upload; documents uploaded before that get it counted once here.
+        pages = doc.get("page_num")
+        if pages is None:
+            pages = PdfParser.total_page_number(doc["name"], STORAGE_IMPL.get(bucket, name))
+            if pages is not None:
+                DocumentService.update_by_id(doc["id"], {"page_num": pages})
         if pages is None:
             pages = 0
-        page_size = doc["parser_config"].get("task_page_size") or 12
-        if doc["parser_id"] == "paper":
-            page_size = doc["parser_config"].get("task_page_size") or 22
-        if doc["parser_id"] in ["one", "knowledge_graph"] or do_layout != "DeepDOC" or doc["parser_config"].get("toc", True):
-            page_size = 10 ** 9
+        page_size = pdf_task_page_size(doc, pages)
         page_ranges = doc["parser_config"].get("pages") or [(1, 10 ** 5)]
         for s, e in page_ranges:
             s -= 1
@@ -379,8 +433,11 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
                 parse_task_array.append(task)
 
     elif doc["parser_id"] == "table":
-        file_bin = STORAGE_IMPL.get(bucket, name)
-        rn = RAGFlowExcelParser.row_number(doc["name"], file_bin)
+        rn = doc.get("row_num")
+        if rn is None:
+            rn = RAGFlowExcelParser.row_number(doc["name"], STORAGE_IMPL.get(bucket, name))
+            if rn is not None:
+                DocumentService.update_by_id(doc["id"], {"row_num": rn})
         for i in range(0, rn, 3000):
             task = new_task()
             task["from_page"] = i
@@ -424,9 +481,13 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     DocumentService.begin2parse(doc["id"])
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
+    # A document parsed by several tasks gets its TOC from a merge task once they are all done.
+    toc_merge = len(parse_task_array) > 1 and doc["parser_id"] == "naive" and doc["parser_config"].get("toc_extraction", False)
     for unfinished_task in unfinished_task_array:
+        if toc_merge:
+            unfinished_task["toc_merge"] = True
         assert REDIS_CONN.queue_product(
-            get_svr_queue_name(priority), message=unfinished_task
+            get_svr_queue_name(priority), message=unfinished_task, sub_queue=doc.get("tenant_id", "")
         ), "Can't access Redis. Please check the Redis' status."
 
 
@@ -516,7 +577,7 @@ def queue_dataflow(tenant_id:str, flow_id:str, task_id:str, doc_id:str=CANVAS_DE
     task["file"] = file
 
     if not REDIS_CONN.queue_product(
-            get_svr_queue_name(priority), message=task
+            get_svr_queue_name(priority), message=task, sub_queue=tenant_id
     ):
         return False, "Can't access Redis. Please check the Redis' status."
 
@@ -290,6 +290,9 @@ class LLM4Tenant:
         assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         self.max_length = model_config.get("max_tokens", 8192)
+        self.llm_factory = model_config.get("llm_factory", "")
+        self.base_url = model_config.get("api_base") or ""
+        self.model_key = "{}@{}".format(model_config.get("llm_name") or llm_name, self.llm_factory)
 
         self.is_tools = model_config.get("is_tools", False)
         self.verbose_tool_use = kwargs.get("verbose_tool_use")
@@ -266,6 +266,50 @@ def send_file_in_mem(data, filename):
     return send_file(f, as_attachment=True, attachment_filename=filename)
 
 
+STORAGE_RANGE_CHUNK = 4 * 1024 * 1024
+
+
+def send_storage_object(bucket, name, content_type="application/octet-stream", download_name=None, allow_empty=True):
+    """
+    Stream an object of the storage backend as the response, honoring a single-range `Range` header.
+    Returns None when the object can't be found, or is empty and `allow_empty` is off, so callers can
+    try another location or report it.
+    """
+    from rag.utils.storage_factory import STORAGE_IMPL
+
+    size = STORAGE_IMPL.size(bucket, name)
+    if size is None or (not size and not allow_empty):
+        return None
+    headers = {"Accept-Ranges": "bytes", "Content-Type": content_type}
+    if download_name:
+        headers["Content-Disposition"] = "attachment; filename*=UTF-8''{}".format(quote(download_name))
+
+    rng = flask_request.range
+    if rng is not None and rng.units == "bytes" and len(rng.ranges) == 1:
+        span = rng.range_for_length(size)
+        if span is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+        start, stop = span
+
+        def ranged():
+            # Fetched window by window, a range may be most of a large file.
+            for b in range(start, stop, STORAGE_RANGE_CHUNK):
+                data = STORAGE_IMPL.get_range(bucket, name, b, min(stop, b + STORAGE_RANGE_CHUNK))
+                if data is None:
+                    raise IOError(f"Fail to read {bucket}/{name} [{b}, {stop})")
+                yield data
+
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        headers["Content-Length"] = str(stop - start)
+        return Response(ranged(), status=206, headers=headers, direct_passthrough=True)
+
+    chunks = STORAGE_IMPL.open_stream(bucket, name)
+    if chunks is None:
+        return None
+    headers["Content-Length"] = str(size)
+    return Response(chunks, status=200, headers=headers, direct_passthrough=True)
+
+
 def get_json_result(code: settings.RetCode = settings.RetCode.SUCCESS, message="success", data=None):
     response = {"code": code, "message": message, "data": data}
     return jsonify(response)
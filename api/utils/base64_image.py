@@ -9,35 +9,65 @@ test_image_base64 = "iVBORw0KGgoAAAANSUhEUgAAAGQAAABkCAIAAAD/gAIDAAAA6ElEQVR4nO3
 test_image = base64.b64decode(test_image_base64)
 
 
+def _image_bytes(d: dict) -> bytes:
+    """The image of a chunk as JPEG bytes."""
+    if isinstance(d["image"], bytes):
+        return d["image"]
+    with BytesIO() as output_buffer:
+        # If the image is in RGBA mode, convert it to RGB mode before saving it in JPEG format.
+        if d["image"].mode in ("RGBA", "P"):
+            converted_image = d["image"].convert("RGB")
+            d["image"] = converted_image
+        try:
+            d["image"].save(output_buffer, format='JPEG')
+        except OSError as e:
+            logging.warning(
+                "Saving image exception, ignore: {}".format(str(e)))
+        return output_buffer.getvalue()
+
+
+def _release_image(d: dict, bucket: str, objname: str):
+    d["img_id"] = f"{bucket}-{objname}"
+    if not isinstance(d["image"], bytes):
+        d["image"].close()
+    del d["image"]  # Remove image reference
+
+
 async def image2id(d: dict, storage_put_func: partial, objname:str, bucket:str="imagetemps"):
-    import logging
-    from io import BytesIO
     import trio
     from rag.svr.task_executor import minio_limiter
     if not d.get("image"):
         return
 
-    with BytesIO() as output_buffer:
-        if isinstance(d["image"], bytes):
-            output_buffer.write(d["image"])
-            output_buffer.seek(0)
-        else:
-            # If the image is in RGBA mode, convert it to RGB mode before saving it in JPEG format.
-            if d["image"].mode in ("RGBA", "P"):
-                converted_image = d["image"].convert("RGB")
-                d["image"] = converted_image
-            try:
-                d["image"].save(output_buffer, format='JPEG')
-            except OSError as e:
-                logging.warning(
-                    "Saving image exception, ignore: {}".format(str(e)))
-
-        async with minio_limiter:
-            await trio.to_thread.run_sync(lambda: storage_put_func(bucket=bucket, fnm=objname, binary=output_buffer.getvalue()))
-        d["img_id"] = f"{bucket}-{objname}"
-        if not isinstance(d["image"], bytes):
-            d["image"].close()
-        del d["image"]  # Remove image reference
+    binary = _image_bytes(d)
+    async with minio_limiter:
+        await trio.to_thread.run_sync(lambda: storage_put_func(bucket=bucket, fnm=objname, binary=binary))
+    _release_image(d, bucket, objname)
+
+
+async def images2ids(ds: list[dict], storage, objnames: list[str], bucket: str, tenant_id=None):
+    """
+    Upload the images of several chunks at once, through `storage.put_many` where the
+    backend has one, and set their img_id like image2id does.
+    """
+    import trio
+    from rag.svr.task_executor import minio_limiter
+    todo = [(d, nm) for d, nm in zip(ds, objnames) if d.get("image")]
+    if not todo:
+        return
+
+    items = await trio.to_thread.run_sync(lambda: [(nm, _image_bytes(d)) for d, nm in todo])
+    if hasattr(storage, "put_many"):
+        await trio.to_thread.run_sync(lambda: storage.put_many(bucket, items, tenant_id=tenant_id))
+    else:
+        async with trio.open_nursery() as nursery:
+            for nm, binary in items:
+                async def put(nm=nm, binary=binary):
+                    async with minio_limiter:
+                        await trio.to_thread.run_sync(lambda: storage.put(bucket, nm, binary, tenant_id=tenant_id))
+                nursery.start_soon(put)
+    for d, nm in todo:
+        _release_image(d, bucket, nm)
 
 
 def id2image(image_id:str|None, storage_get_func: partial):
@@ -20,6 +20,7 @@ import base64
 import hashlib
 import io
 import json
+import logging
 import os
 import re
 import shutil
@@ -242,6 +243,25 @@ def thumbnail(filename, blob):
         return ""
 
 
+def page_row_number(filename, blob):
+    """
+    Pages of a PDF or rows of a spreadsheet, counted once at upload and kept on the
+    document, so queueing its parsing tasks doesn't fetch and open the file again.
+    """
+    from deepdoc.parser import PdfParser
+    from deepdoc.parser.excel_parser import RAGFlowExcelParser
+
+    filename = filename.lower()
+    try:
+        if re.match(r".*\.pdf$", filename):
+            return {"page_num": PdfParser.total_page_number(filename, blob)}
+        if re.match(r".*\.(xls[a-z]?|csv)$", filename):
+            return {"row_num": RAGFlowExcelParser.row_number(filename, blob)}
+    except Exception:
+        logging.exception("page_row_number")
+    return {}
+
+
 def traversal_files(base):
     for root, ds, fs in os.walk(base):
         for f in fs:
@@ -188,9 +188,34 @@ class RAGFlowExcelParser:
                 res.append(line)
         return res
 
+    @staticmethod
+    def _sized_row_number(binary):
+        """Rows of an xlsx workbook from the dimension of its sheets, without loading their cells."""
+        try:
+            wb = load_workbook(BytesIO(binary), read_only=True)
+        except Exception:
+            return None
+        try:
+            total = 0
+            for ws in wb.worksheets:
+                # Some writers leave the dimension at "A1" or omit it, those sheets are streamed row by row.
+                if ws.max_row and ws.max_row > 1:
+                    total += ws.max_row
+                else:
+                    total += sum(1 for _ in ws.iter_rows(values_only=True))
+            return total
+        except Exception:
+            logging.exception("RAGFlowExcelParser._sized_row_number")
+            return None
+        finally:
+            wb.close()
+
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
+            total = RAGFlowExcelParser._sized_row_number(binary)
+            if total is not None:
+                return total
             wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
             total = 0
             for sheetname in wb.sheetnames:
@@ -36,11 +36,12 @@ from pypdf import PdfReader as pdf2_read
 
 from api import settings
 from api.utils.file_utils import get_project_base_directory
+from deepdoc.parser.utils import PageImages
 from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, TableStructureRecognizer
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts.generator import vision_llm_describe_prompt
-from rag.settings import PARALLEL_DEVICES
+from rag.settings import OCR_CROSS_PAGE_BOXES, PARALLEL_DEVICES, PDF_PAGE_IMAGE_WINDOW
 
 LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
@@ -279,14 +280,42 @@ class RAGFlowPdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+        bxs, boxes_to_reg = self.__ocr_detect(pagenum, img, chars, ZM, device_id)
+        if bxs is None:
+            self.boxes.append([])
+            return
+        start = timer()
+        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        self.__ocr_finish(pagenum, bxs, boxes_to_reg, texts)
+        logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
+
+    def __ocr_pages(self, pages, device_id: int | None = None):
+        """
+        Recognize the boxes left without text on several detected pages with one call,
+        the recognizer sorts them by width and batches them regardless of their page.
+        `pages` holds the (pagenum, bxs, boxes_to_reg) of `__ocr_detect`, in page order.
+        """
+        start = timer()
+        boxes_to_reg = [b for _, bxs, reg in pages if bxs is not None for b in reg]
+        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        pos = 0
+        for pagenum, bxs, reg in pages:
+            if bxs is None:
+                self.boxes.append([])
+                continue
+            self.__ocr_finish(pagenum, bxs, reg, texts[pos: pos + len(reg)])
+            pos += len(reg)
+        logging.info(f"__ocr recognize {len(boxes_to_reg)} boxes of {len(pages)} pages cost {timer() - start}s")
+
+    def __ocr_detect(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+        """Detect the text boxes of a page and fill them from its chars. Boxes still without text are returned with their crop."""
         start = timer()
         bxs = self.ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
-            return
+            return None, []
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [
@@ -324,7 +353,6 @@ class RAGFlowPdfParser:
             del b["chars"]
 
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
-        start = timer()
         boxes_to_reg = []
         img_np = np.array(img)
         for b in bxs:
@@ -333,11 +361,12 @@ class RAGFlowPdfParser:
                 b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
                 boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        return bxs, boxes_to_reg
+
+    def __ocr_finish(self, pagenum, bxs, boxes_to_reg, texts):
         for i in range(len(boxes_to_reg)):
             boxes_to_reg[i]["text"] = texts[i]
             del boxes_to_reg[i]["box_image"]
-        logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
         bxs = [b for b in bxs if b["text"]]
         if self.mean_height[pagenum - 1] == 0:
             self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
@@ -372,7 +401,7 @@ class RAGFlowPdfParser:
                 continue
 
             if hasattr(self, "page_images") and self.page_images and len(self.page_images) >= pg:
-                page_w = self.page_images[pg - 1].size[0] / max(1, zoomin)
+                page_w = self._page_size(pg - 1)[0] / max(1, zoomin)
                 left_edge = 0.0
             else:
                 xs0 = [box["x0"] for box in bxs]
@@ -934,6 +963,12 @@ class RAGFlowPdfParser:
                 return j
         return
 
+    def _page_size(self, i):
+        # PageImages reads the size of a page without decoding it, VisionParser keeps a plain list.
+        if isinstance(self.page_images, PageImages):
+            return self.page_images.page_size(i)
+        return self.page_images[i].size
+
     def _line_tag(self, bx, ZM):
         pn = [bx["page_number"]]
         top = bx["top"] - self.page_cum_height[pn[0] - 1]
@@ -941,8 +976,8 @@ class RAGFlowPdfParser:
         page_images_cnt = len(self.page_images)
         if pn[-1] - 1 >= page_images_cnt:
             return ""
-        while bott * ZM > self.page_images[pn[-1] - 1].size[1]:
-            bott -= self.page_images[pn[-1] - 1].size[1] / ZM
+        while bott * ZM > self._page_size(pn[-1] - 1)[1]:
+            bott -= self._page_size(pn[-1] - 1)[1] / ZM
             pn.append(pn[-1] + 1)
             if pn[-1] - 1 >= page_images_cnt:
                 return ""
@@ -959,7 +994,7 @@ class RAGFlowPdfParser:
         def usefull(b):
             if b.get("layout_type"):
                 return True
-            if width(b) > self.page_images[b["page_number"] - 1].size[0] / ZM / 3:
+            if width(b) > self._page_size(b["page_number"] - 1)[0] / ZM / 3:
                 return True
             if b["bottom"] - b["top"] > self.mean_height[b["page_number"] - 1]:
                 return True
@@ -969,7 +1004,7 @@ class RAGFlowPdfParser:
         while boxes:
             lines = []
             widths = []
-            pw = self.page_images[boxes[0]["page_number"] - 1].size[0] / ZM
+            pw = self._page_size(boxes[0]["page_number"] - 1)[0] / ZM
             mh = self.mean_height[boxes[0]["page_number"] - 1]
             mj = self.proj_match(boxes[0]["text"]) or boxes[0].get("layout_type", "") == "title"
 
@@ -1011,6 +1046,14 @@ class RAGFlowPdfParser:
 
     @staticmethod
     def total_page_number(fnm, binary=None):
+        # pypdf only reads the xref, the trailer and the root of the page tree for this, without pdfium or its lock.
+        try:
+            pdf = pdf2_read(fnm if not binary else BytesIO(binary))
+            if pdf.is_encrypted:
+                pdf.decrypt("")
+            return len(pdf.pages)
+        except Exception:
+            logging.warning(f"total_page_number can't read the page tree of {fnm}, opens it with pdfplumber")
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
                 pdf = pdfplumber.open(fnm) if not binary else pdfplumber.open(BytesIO(binary))
@@ -1029,23 +1072,22 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self.page_images = PageImages()
         start = timer()
+        # The handle belongs to this parse, only pdfium rendering below has to hold the process-wide lock.
+        plumber = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+        pages = []
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-
-                    self.total_page = len(self.pdf.pages)
-
+            pages = plumber.pages[page_from:page_to]
+            try:
+                self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in pages]
+            except Exception as e:
+                logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                self.page_chars = [[] for _ in range(len(pages))]  # If failed to extract, using empty list instead.
+            self.total_page = len(plumber.pages)
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
+            self.page_chars = [[] for _ in range(len(pages))]
         logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
 
         self.outlines = []
@@ -1075,12 +1117,12 @@ class RAGFlowPdfParser:
             re.search(r"[a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i])))))
             for i in range(len(self.page_chars))
         ]
-        if sum([1 if e else 0 for e in self.is_english]) > len(self.page_images) / 2:
+        if sum([1 if e else 0 for e in self.is_english]) > len(self.page_chars) / 2:
             self.is_english = True
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
+        def __space_chars(chars):
             j = 0
             while j + 1 < len(chars):
                 if (
@@ -1092,14 +1134,32 @@ class RAGFlowPdfParser:
                     chars[j]["text"] += " "
                 j += 1
 
-            if limiter:
-                async with limiter:
+        async def __img_ocr(i, id, img, chars, limiter, window=None):
+            try:
+                __space_chars(chars)
+                if limiter:
+                    async with limiter:
+                        await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                else:
                     await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
-            else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+            finally:
+                if window:
+                    window.release()
 
             if callback and i % 6 == 5:
-                callback((i + 1) * 0.6 / len(self.page_images))
+                callback((i + 1) * 0.6 / len(pages))
+
+        def __render(i):
+            # pdfium is not thread safe, even across documents. Holding the lock per page lets
+            # concurrent parses interleave instead of one of them rendering all its pages first.
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                return pages[i].to_image(resolution=72 * zoomin, antialias=True).annotated
+
+        async def __page_producer(send):
+            async with send:
+                for i in range(len(pages)):
+                    img = await trio.to_thread.run_sync(lambda: __render(i))
+                    await send.send((i, img))
 
         async def __img_ocr_launcher():
             def __ocr_preprocess():
@@ -1109,21 +1169,48 @@ class RAGFlowPdfParser:
                 self.page_cum_height.append(img.size[1] / zoomin)
                 return chars
 
-            if self.parallel_limiter:
-                async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
+            # On a single device, the boxes detected on consecutive pages are recognized together
+            # once OCR_CROSS_PAGE_BOXES of them are pending, in batches of similar widths.
+            detected = []
 
-                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % PARALLEL_DEVICES])
-                        await trio.sleep(0.1)
-            else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+            async def __recognize_detected():
+                nonlocal detected
+                if not detected:
+                    return
+                done, detected = detected, []
+                await trio.to_thread.run_sync(lambda: self.__ocr_pages(done, 0))
+                if callback:
+                    callback(done[-1][0] * 0.6 / len(pages))
+
+            # Pages are rendered ahead of OCR in a bounded window, so at most a few bitmaps are decoded at once.
+            # On several devices a page holds a window slot until its OCR is done, which keeps the consumer
+            # from draining the channel into tasks that all wait on a device.
+            window = trio.Semaphore(max(1, PDF_PAGE_IMAGE_WINDOW - PDF_PAGE_IMAGE_WINDOW // 2))
+            async with trio.open_nursery() as nursery:
+                send, recv = trio.open_memory_channel(max(1, PDF_PAGE_IMAGE_WINDOW // 2))
+                nursery.start_soon(__page_producer, send)
+                async with recv:
+                    async for i, img in recv:
+                        # Compressing a page takes a while, keep it off the event loop.
+                        await trio.to_thread.run_sync(lambda: self.page_images.append(img))
+                        chars = __ocr_preprocess()
+                        if self.parallel_limiter:
+                            await window.acquire()
+                            nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % PARALLEL_DEVICES], window)
+                            continue
+                        __space_chars(chars)
+                        bxs, boxes_to_reg = await trio.to_thread.run_sync(lambda: self.__ocr_detect(i + 1, img, chars, zoomin, 0))
+                        detected.append((i + 1, bxs, boxes_to_reg))
+                        if sum(len(d[2]) for d in detected) >= OCR_CROSS_PAGE_BOXES:
+                            await __recognize_detected()
+                await __recognize_detected()
 
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        try:
+            trio.run(__img_ocr_launcher)
+        finally:
+            plumber.close()
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
@@ -1258,23 +1345,23 @@ class RAGFlowPdfParser:
         pos = poss[0]
         poss.insert(0, ([pos[0][0]], pos[1], pos[2], max(0, pos[3] - 120), max(pos[3] - GAP, 0)))
         pos = poss[-1]
-        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + GAP), min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + 120)))
+        poss.append(([pos[0][-1]], pos[1], pos[2], min(self._page_size(pos[0][-1])[1] / ZM, pos[4] + GAP), min(self._page_size(pos[0][-1])[1] / ZM, pos[4] + 120)))
 
         positions = []
         for ii, (pns, left, right, top, bottom) in enumerate(poss):
             right = left + max_width
             bottom *= ZM
             for pn in pns[1:]:
-                bottom += self.page_images[pn - 1].size[1]
-            imgs.append(self.page_images[pns[0]].crop((left * ZM, top * ZM, right * ZM, min(bottom, self.page_images[pns[0]].size[1]))))
+                bottom += self._page_size(pn - 1)[1]
+            imgs.append(self.page_images[pns[0]].crop((left * ZM, top * ZM, right * ZM, min(bottom, self._page_size(pns[0])[1]))))
             if 0 < ii < len(poss) - 1:
-                positions.append((pns[0] + self.page_from, left, right, top, min(bottom, self.page_images[pns[0]].size[1]) / ZM))
-            bottom -= self.page_images[pns[0]].size[1]
+                positions.append((pns[0] + self.page_from, left, right, top, min(bottom, self._page_size(pns[0])[1]) / ZM))
+            bottom -= self._page_size(pns[0])[1]
             for pn in pns[1:]:
-                imgs.append(self.page_images[pn].crop((left * ZM, 0, right * ZM, min(bottom, self.page_images[pn].size[1]))))
+                imgs.append(self.page_images[pn].crop((left * ZM, 0, right * ZM, min(bottom, self._page_size(pn)[1]))))
                 if 0 < ii < len(poss) - 1:
-                    positions.append((pn + self.page_from, left, right, 0, min(bottom, self.page_images[pn].size[1]) / ZM))
-                bottom -= self.page_images[pn].size[1]
+                    positions.append((pn + self.page_from, left, right, 0, min(bottom, self._page_size(pn)[1]) / ZM))
+                bottom -= self._page_size(pn)[1]
 
         if not imgs:
             if need_position:
@@ -1305,12 +1392,12 @@ class RAGFlowPdfParser:
         pn = bx["page_number"]
         top = bx["top"] - self.page_cum_height[pn - 1]
         bott = bx["bottom"] - self.page_cum_height[pn - 1]
-        poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images[pn - 1].size[1] / ZM)))
-        while bott * ZM > self.page_images[pn - 1].size[1]:
-            bott -= self.page_images[pn - 1].size[1] / ZM
+        poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self._page_size(pn - 1)[1] / ZM)))
+        while bott * ZM > self._page_size(pn - 1)[1]:
+            bott -= self._page_size(pn - 1)[1] / ZM
             top = 0
             pn += 1
-            poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images[pn - 1].size[1] / ZM)))
+            poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self._page_size(pn - 1)[1] / ZM)))
         return poss
 
 
@@ -1354,6 +1441,7 @@ class VisionParser(RAGFlowPdfParser):
         self.vision_model = vision_model
 
     def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None):
+        self.page_from = page_from
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
                 self.pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
@@ -1377,7 +1465,9 @@ class VisionParser(RAGFlowPdfParser):
         all_docs = []
 
         for idx, img_binary in enumerate(self.page_images or []):
-            pdf_page_num = idx  # 0-based
+            pdf_page_num = from_page + idx  # 0-based, page_images starts at from_page
+            # The position tag stays relative to the range, as crop() looks pages up in page_images
+            # and adds page_from back.
             if pdf_page_num < start_page or pdf_page_num >= end_page:
                 continue
 
@@ -1392,10 +1482,10 @@ class VisionParser(RAGFlowPdfParser):
                 kwargs["callback"](idx * 1.0 / len(self.page_images), f"Processed: {idx + 1}/{len(self.page_images)}")
 
             if text:
-                width, height = self.page_images[idx].size
+                width, height = self._page_size(idx)
                 all_docs.append((
                     text,
-                    f"@@{pdf_page_num + 1}\t{0.0:.1f}\t{width / zoomin:.1f}\t{0.0:.1f}\t{height / zoomin:.1f}##"
+                    f"@@{idx + 1}\t{0.0:.1f}\t{width / zoomin:.1f}\t{0.0:.1f}\t{height / zoomin:.1f}##"
                 ))
         return all_docs, []
 
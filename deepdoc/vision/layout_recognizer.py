@@ -76,8 +76,11 @@ class LayoutRecognizer(Recognizer):
         assert len(image_list) == len(layouts)
         garbages = {}
         page_layout = []
+        # PageImages reads the size of a page without decoding it.
+        page_size = getattr(image_list, "page_size", lambda i: image_list[i].size)
         for pn, lts in enumerate(layouts):
             bxs = ocr_res[pn]
+            page_height = page_size(pn)[1]
             lts = [
                 {
                     "type": b["type"],
@@ -114,8 +117,8 @@ class LayoutRecognizer(Recognizer):
                         continue
                     lts_[ii]["visited"] = True
                     keep_feats = [
-                        lts_[ii]["type"] == "footer" and bxs[i]["bottom"] < image_list[pn].size[1] * 0.9 / scale_factor,
-                        lts_[ii]["type"] == "header" and bxs[i]["top"] > image_list[pn].size[1] * 0.1 / scale_factor,
+                        lts_[ii]["type"] == "footer" and bxs[i]["bottom"] < page_height * 0.9 / scale_factor,
+                        lts_[ii]["type"] == "header" and bxs[i]["top"] > page_height * 0.1 / scale_factor,
                     ]
                     if drop and lts_[ii]["type"] in self.garbage_layouts and not any(keep_feats):
                         if lts_[ii]["type"] not in garbages:
@@ -341,16 +344,16 @@ class AscendLayoutRecognizer(Recognizer):
 
         assert len(image_list) == len(ocr_res)
 
-        images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list]
         layouts_all_pages = []  # list of list[{"type","score","bbox":[x1,y1,x2,y2]}]
 
         conf_thr = max(thr, 0.08)
 
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Pages are converted one batch at a time, so only a batch of bitmaps is held as arrays.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for bi in range(batch_loop_cnt):
             s = bi * batch_size
-            e = min((bi + 1) * batch_size, len(images))
-            batch_images = images[s:e]
+            e = min((bi + 1) * batch_size, len(image_list))
+            batch_images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list[s:e]]
 
             inputs_list = self.preprocess(batch_images)
             logging.debug("preprocess done")
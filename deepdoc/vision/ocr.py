@@ -16,13 +16,14 @@
 import gc
 import logging
 import copy
+import threading
 import time
 import os
 
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
-from rag.settings import PARALLEL_DEVICES
+from rag.settings import PARALLEL_DEVICES, OCR_REC_BATCH_NUM, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS, ONNX_GRAPH_OPT_LEVEL, ONNX_INT8_MODELS
 from .operators import *  # noqa: F403
 from . import operators
 import math
@@ -32,7 +33,17 @@ import onnxruntime as ort
 
 from .postprocess import build_post_process
 
+# Process-wide registry of ONNX sessions, every OCR, layout and table recognizer uses the same ones.
+# InferenceSession.run is thread safe, so parsers on different threads share them too.
 loaded_models = {}
+loaded_models_lock = threading.Lock()
+
+GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
 
 def transform(data, ops=None):
     """ transform """
@@ -67,6 +78,27 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
+def quantized_model(model_file_path):
+    """
+    Return the path of the dynamically quantized (int8) variant of a model, quantizing it once
+    next to the original. Returns the original path if it cannot be quantized.
+    """
+    int8_path = model_file_path[:-len(".onnx")] + ".int8.onnx"
+    if os.path.exists(int8_path):
+        return int8_path
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_path = int8_path + ".{}.tmp".format(os.getpid())
+        quantize_dynamic(model_file_path, tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, int8_path)
+        logging.info(f"load_model quantized {model_file_path} to {int8_path}")
+        return int8_path
+    except Exception:
+        logging.exception(f"load_model failed to quantize {model_file_path}, uses it as is")
+        return model_file_path
+
+
 def load_model(model_dir, nm, device_id: int | None = None):
     model_file_path = os.path.join(model_dir, nm + ".onnx")
     model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
@@ -77,6 +109,16 @@ def load_model(model_dir, nm, device_id: int | None = None):
         logging.info(f"load_model {model_file_path} reuses cached model")
         return loaded_model
 
+    # Parsers created on several threads at once must not load the same model twice.
+    with loaded_models_lock:
+        loaded_model = loaded_models.get(model_cached_tag)
+        if not loaded_model:
+            loaded_model = _load_model(model_file_path, nm, device_id)
+            loaded_models[model_cached_tag] = loaded_model
+    return loaded_model
+
+
+def _load_model(model_file_path, nm, device_id: int | None = None):
     if not os.path.exists(model_file_path):
         raise ValueError("not find model file path {}".format(
             model_file_path))
@@ -94,8 +136,9 @@ def load_model(model_dir, nm, device_id: int | None = None):
     options = ort.SessionOptions()
     options.enable_cpu_mem_arena = False
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = ONNX_INTER_OP_THREADS
+    options.graph_optimization_level = GRAPH_OPT_LEVELS.get(ONNX_GRAPH_OPT_LEVEL, ort.GraphOptimizationLevel.ORT_ENABLE_ALL)
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
@@ -118,21 +161,21 @@ def load_model(model_dir, nm, device_id: int | None = None):
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:" + str(provider_device_id))
         logging.info(f"load_model {model_file_path} uses GPU (device {provider_device_id}, gpu_mem_limit={cuda_provider_options['gpu_mem_limit']}, arena_strategy={arena_strategy})")
     else:
+        if nm in ONNX_INT8_MODELS or "all" in ONNX_INT8_MODELS:
+            model_file_path = quantized_model(model_file_path)
         sess = ort.InferenceSession(
             model_file_path,
             options=options,
             providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
-        logging.info(f"load_model {model_file_path} uses CPU")
-    loaded_model = (sess, run_options)
-    loaded_models[model_cached_tag] = loaded_model
-    return loaded_model
+        logging.info(f"load_model {model_file_path} uses CPU ({options.intra_op_num_threads} intra-op threads, graph optimization {ONNX_GRAPH_OPT_LEVEL})")
+    return sess, run_options
 
 
 class TextRecognizer:
     def __init__(self, model_dir, device_id: int | None = None):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = OCR_REC_BATCH_NUM
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -704,47 +747,77 @@ class OCR:
             texts.append(text)
         return texts
 
-    def __call__(self, img, device_id = 0, cls=True):
-        time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
+    def detect_crops(self, img, device_id: int | None = None):
+        """
+        Detect the text boxes of an image and cut them out.
+        Returns the sorted boxes with their crops, or (None, None) if there is no text.
+        """
         if device_id is None:
             device_id = 0
-
         if img is None:
-            return None, None, time_dict
-
-        start = time.time()
+            return None, None
         ori_im = img.copy()
         dt_boxes, elapse = self.text_detector[device_id](img)
-        time_dict['det'] = elapse
-
         if dt_boxes is None:
-            end = time.time()
-            time_dict['all'] = end - start
-            return None, None, time_dict
-
-        img_crop_list = []
+            return None, None
 
         dt_boxes = self.sorted_boxes(dt_boxes)
-
+        img_crop_list = []
         for bno in range(len(dt_boxes)):
             tmp_box = copy.deepcopy(dt_boxes[bno])
-            img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
-            img_crop_list.append(img_crop)
-
-        rec_res, elapse = self.text_recognizer[device_id](img_crop_list)
-
-        time_dict['rec'] = elapse
+            img_crop_list.append(self.get_rotate_crop_image(ori_im, tmp_box))
+        return dt_boxes, img_crop_list
 
+    def _filter(self, dt_boxes, rec_res):
         filter_boxes, filter_rec_res = [], []
         for box, rec_result in zip(dt_boxes, rec_res):
             text, score = rec_result
             if score >= self.drop_score:
                 filter_boxes.append(box)
                 filter_rec_res.append(rec_result)
-        end = time.time()
-        time_dict['all'] = end - start
+        return list(zip([a.tolist() for a in filter_boxes], filter_rec_res))
+
+    def ocr_pages(self, img_list, device_id: int | None = None):
+        """
+        OCR several images at once. Detection runs per image, but the crops of all of them
+        are recognized together, so the recognizer gets full batches of similar widths
+        instead of a few ragged ones per page. Returns one result per image, as `__call__`.
+        """
+        if device_id is None:
+            device_id = 0
+        detected = [self.detect_crops(img, device_id) for img in img_list]
+        crops = [c for _, cc in detected if cc for c in cc]
+        rec_res, elapse = self.text_recognizer[device_id](crops) if crops else ([], 0)
+
+        res, pos = [], 0
+        for dt_boxes, cc in detected:
+            if dt_boxes is None:
+                res.append(None)
+                continue
+            res.append(self._filter(dt_boxes, rec_res[pos: pos + len(cc)]))
+            pos += len(cc)
+        return res
 
-        # for bno in range(len(img_crop_list)):
-        #    print(f"{bno}, {rec_res[bno]}")
+    def __call__(self, img, device_id = 0, cls=True):
+        time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
+        if device_id is None:
+            device_id = 0
 
-        return list(zip([a.tolist() for a in filter_boxes], filter_rec_res))
+        if img is None:
+            return None, None, time_dict
+
+        start = time.time()
+        dt_boxes, img_crop_list = self.detect_crops(img, device_id)
+        time_dict['det'] = time.time() - start
+
+        if dt_boxes is None:
+            end = time.time()
+            time_dict['all'] = end - start
+            return None, None, time_dict
+
+        rec_res, elapse = self.text_recognizer[device_id](img_crop_list)
+
+        time_dict['rec'] = elapse
+        time_dict['all'] = time.time() - start
+
+        return self._filter(dt_boxes, rec_res)
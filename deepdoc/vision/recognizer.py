@@ -49,6 +49,8 @@ class Recognizer:
         self.input_names = [node.name for node in self.ort_sess.get_inputs()]
         self.output_names = [node.name for node in self.ort_sess.get_outputs()]
         self.input_shape = self.ort_sess.get_inputs()[0].shape[2:4]
+        # Models exported with a symbolic batch dimension can take the pages of a batch in one run.
+        self.dynamic_batch = len(self.input_names) == 1 and not isinstance(self.ort_sess.get_inputs()[0].shape[0], int)
         self.label_list = label_list
 
     @staticmethod
@@ -414,20 +416,20 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Pages are converted one batch at a time, so only a batch of bitmaps is held as arrays.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [im if isinstance(im, np.ndarray) else np.array(im) for im in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
+            name = self.input_names[0]
+            if self.dynamic_batch and len(inputs) > 1 and len({ins[name].shape for ins in inputs}) == 1:
+                outputs = self.ort_sess.run(None, {name: np.concatenate([ins[name] for ins in inputs])}, self.run_options)[0]
+                for k, ins in enumerate(inputs):
+                    res.append(self.postprocess(outputs[k: k + 1], ins, thr))
+                continue
             for ins in inputs:
                 bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
                 res.append(bb)
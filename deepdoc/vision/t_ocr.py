@@ -27,6 +27,8 @@ sys.path.insert(
 from deepdoc.vision.seeit import draw_box
 from deepdoc.vision import OCR, init_in_out
 import argparse
+from timeit import default_timer as timer
+
 import numpy as np
 import trio
 
@@ -43,10 +45,8 @@ def main(args):
     ocr = OCR()
     images, outputs = init_in_out(args)
 
-    def __ocr(i, id, img):
-        print("Task {} start".format(i))
-        bxs = ocr(np.array(img), id)
-        bxs = [(line[0], line[1][0]) for line in bxs]
+    def __save(i, bxs):
+        bxs = [(line[0], line[1][0]) for line in bxs or []]
         bxs = [{
             "text": t,
             "bbox": [b[0][0], b[0][1], b[1][0], b[-1][1]],
@@ -57,6 +57,9 @@ def main(args):
         with open(outputs[i] + ".txt", "w+", encoding='utf-8') as f:
             f.write("\n".join([o["text"] for o in bxs]))
 
+    def __ocr(i, id, img):
+        print("Task {} start".format(i))
+        __save(i, ocr(np.array(img), id))
         print("Task {} done".format(i))
 
     async def __ocr_thread(i, id, img, limiter = None):
@@ -73,13 +76,23 @@ def main(args):
                 for i, img in enumerate(images):
                     nursery.start_soon(__ocr_thread, i, i % cuda_devices, img, limiter[i % cuda_devices])
                     await trio.sleep(0.1)
+        elif args.batch_pages > 1:
+            # Text boxes of several pages are recognized together, as the PDF parser does.
+            for b in range(0, len(images), args.batch_pages):
+                print("Pages {}~{} start".format(b, min(b + args.batch_pages, len(images)) - 1))
+                res = ocr.ocr_pages([np.array(img) for img in images[b: b + args.batch_pages]], 0)
+                for i, bxs in enumerate(res):
+                    __save(b + i, bxs)
         else:
             for i, img in enumerate(images):
                 await __ocr_thread(i, 0, img)
 
+    st = timer()
     trio.run(__ocr_launcher)
+    elapsed = timer() - st
 
     print("OCR tasks are all done")
+    print("{} pages in {:.2f}s, {:.2f} pages/s".format(len(images), elapsed, len(images) / elapsed if elapsed else 0))
 
 
 if __name__ == "__main__":
@@ -89,5 +102,8 @@ if __name__ == "__main__":
                         required=True)
     parser.add_argument('--output_dir', help="Directory where to store the output images. Default: './ocr_outputs'",
                         default="./ocr_outputs")
+    parser.add_argument('--batch_pages', help="Pages whose text boxes are recognized together on a single device, 1 recognizes page by page. "
+                                              "Compare the pages/s of both to size OCR_CROSS_PAGE_BOXES.",
+                        type=int, default=8)
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,115 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+
+def synthetic_pages(n):
+    from PIL import Image, ImageDraw
+
+    pages = []
+    for p in range(n):
+        img = Image.new("RGB", (1785, 2526), "white")
+        draw = ImageDraw.Draw(img)
+        for line in range(60):
+            draw.text((120, 120 + line * 38), "Page {} line {}: the quick brown fox jumps over the lazy dog 0123456789".format(p, line), fill="black")
+        pages.append(img)
+    return pages
+
+
+def measure(args):
+    """Runs in a child process, so model loading is measured from a cold start with the environment's settings."""
+    import numpy as np
+    from deepdoc.vision import OCR, LayoutRecognizer
+
+    st = timer()
+    ocr = OCR()
+    layouter = LayoutRecognizer("layout")
+    cold = timer() - st
+
+    # Later parsers of the process only build their wrappers around the registered sessions.
+    st = timer()
+    OCR()
+    LayoutRecognizer("layout")
+    warm = timer() - st
+
+    if args.inputs:
+        from deepdoc.vision import init_in_out
+        args.output_dir = "./onnx_outputs"
+        pages, _ = init_in_out(args)
+    else:
+        pages = synthetic_pages(args.pages)
+    pages = [np.array(p) for p in pages]
+
+    def parse(img):
+        ocr(img)
+        layouter.forward([img])
+
+    parse(pages[0])
+    st = timer()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(parse, pages))
+    elapsed = timer() - st
+    print(json.dumps({"cold": cold, "warm": warm, "pages": len(pages), "elapsed": elapsed}))
+
+
+def main(args):
+    configs = []
+    for threads in args.threads.split(","):
+        for int8 in ([""] + ([args.int8] if args.int8 else [])):
+            configs.append({"ONNX_INTRA_OP_THREADS": threads.strip(), "ONNX_GRAPH_OPT_LEVEL": args.opt_level, "ONNX_INT8_MODELS": int8})
+
+    child = [sys.executable, os.path.abspath(__file__), "--child", "--pages", str(args.pages), "--workers", str(args.workers)]
+    if args.inputs:
+        child += ["--inputs", args.inputs]
+
+    print("{:>8} {:>10} {:>9} {:>9} {:>9}".format("threads", "int8", "load(s)", "reload(s)", "pages/s"))
+    for conf in configs:
+        out = subprocess.run(child, env=dict(os.environ, **conf), capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print("{:>8} {:>10} {:>9.2f} {:>9.3f} {:>9.2f}".format(conf["ONNX_INTRA_OP_THREADS"], conf["ONNX_INT8_MODELS"] or "-",
+                                                            r["cold"], r["warm"], r["pages"] / r["elapsed"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure model loading and OCR + layout throughput of the shared ONNX sessions "
+                                                 "for several ONNX Runtime settings, each in a fresh process.")
+    parser.add_argument('--inputs', help="Directory of images or PDFs, or a single file. Synthetic pages are used if omitted", default="")
+    parser.add_argument('--pages', help="number of synthetic pages", type=int, default=16)
+    parser.add_argument('--workers', help="parser threads sharing the sessions", type=int, default=os.cpu_count() // 2 or 1)
+    parser.add_argument('--threads', help="comma separated ONNX_INTRA_OP_THREADS values to compare", default="1,2,4,0")
+    parser.add_argument('--opt_level', help="ONNX_GRAPH_OPT_LEVEL", default="all")
+    parser.add_argument('--int8', help="ONNX_INT8_MODELS to compare against float models, e.g. 'rec,det,layout'", default="")
+    parser.add_argument('--child', action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        measure(args)
+    else:
+        main(args)
@@ -61,9 +61,9 @@ class Pdf(PdfParser):
         callback(0.75, "Text merged ({:.2f}s)".format(timer() - start))
 
         # clean mess
-        if column_width < self.page_images[0].size[0] / zoomin / 2:
+        if column_width < self._page_size(0)[0] / zoomin / 2:
             logging.debug("two_column................... {} {}".format(column_width,
-                  self.page_images[0].size[0] / zoomin / 2))
+                  self._page_size(0)[0] / zoomin / 2))
             self.boxes = self.sort_X_by_page(self.boxes, column_width / 2)
         for b in self.boxes:
             b["text"] = re.sub(r"([\t 　]|\u3000){2,}", " ", b["text"].strip())
@@ -35,6 +35,7 @@ from rag.flow.base import ProcessBase, ProcessParamBase
 from rag.flow.parser.schema import ParserFromUpstream
 from rag.llm.cv_model import Base as VLM
 from rag.utils.storage_factory import STORAGE_IMPL
+from rag.utils.file_cache import FILE_CACHE
 
 
 class ParserParam(ProcessParamBase):
@@ -494,7 +495,7 @@ class Parser(ProcessBase):
         name = from_upstream.name
         if self._canvas._doc_id:
             b, n = File2DocumentService.get_storage_address(doc_id=self._canvas._doc_id)
-            blob = STORAGE_IMPL.get(b, n)
+            blob = FILE_CACHE.get(b, n)
         else:
             blob = FileService.get_blob(from_upstream.file["created_by"], from_upstream.file["id"])
 
@@ -17,7 +17,6 @@ import random
 import re
 
 import numpy as np
-import trio
 
 from api.db import LLMType
 from api.db.services.knowledgebase_service import KnowledgebaseService
@@ -27,8 +26,7 @@ from api.utils.api_utils import timeout
 from rag.flow.base import ProcessBase, ProcessParamBase
 from rag.flow.tokenizer.schema import TokenizerFromUpstream
 from rag.nlp import rag_tokenizer
-from rag.settings import EMBEDDING_BATCH_SIZE
-from rag.svr.task_executor import embed_limiter
+from rag.svr.task_executor import embed_dispatcher
 from rag.utils import truncate
 
 
@@ -72,28 +70,30 @@ class Tokenizer(ProcessBase):
             texts.append(re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", txt))
         vts, c = embedding_model.encode([name])
         token_count += c
-        tts = np.concatenate([vts[0] for _ in range(len(texts))], axis=0)
+        title_vts = np.asarray(vts[0], dtype=np.float32)
 
         @timeout(60)
         def batch_encode(txts):
             nonlocal embedding_model
             return embedding_model.encode([truncate(c, embedding_model.max_length - 10) for c in txts])
 
-        cnts_ = np.array([])
-        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
-            async with embed_limiter:
-                vts, c = await trio.to_thread.run_sync(lambda: batch_encode(texts[i : i + EMBEDDING_BATCH_SIZE]))
-            if len(cnts_) == 0:
-                cnts_ = vts
-            else:
-                cnts_ = np.concatenate((cnts_, vts), axis=0)
-            token_count += c
-            if i % 33 == 32:
-                self.callback(i * 1.0 / len(texts) / parts / EMBEDDING_BATCH_SIZE + 0.5 * (parts - 1))
+        # Batches are written in place, growing the result with np.concatenate copied it on every batch.
+        vects = np.empty((len(texts), len(title_vts)), dtype=np.float32)
+        batches, done = 0, 0
+
+        def on_batch(idx, vts):
+            nonlocal batches, done
+            vects[idx] = vts
+            batches += 1
+            done += len(idx)
+            if batches % 33 == 32:
+                self.callback(done / len(texts) / parts + 0.5 * (parts - 1))
+
+        token_count += await embed_dispatcher.encode(embedding_model, texts, batch_encode, on_batch)
 
-        cnts = cnts_
         title_w = float(self._param.filename_embd_weight)
-        vects = (title_w * tts + (1 - title_w) * cnts) if len(tts) == len(cnts) else cnts
+        vects *= 1 - title_w
+        vects += title_w * title_vts
 
         assert len(vects) == len(chunks)
         for i, ck in enumerate(chunks):
@@ -271,8 +271,19 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_batch(ds, txts, eng):
+    # Same as calling `tokenize` for each pair, but lets the tokenizer batch the work.
+    for d, t in zip(ds, txts):
+        d["content_with_weight"] = t
+    txts = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in txts]
+    for d, (ltks, sm_ltks) in zip(ds, rag_tokenizer.tokenize_many(txts, fine_grained=True)):
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
     res = []
+    txts = []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -288,13 +299,15 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 pass
         else:
             add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        txts.append(ck)
         res.append(d)
+    tokenize_batch(res, txts, eng)
     return res
 
 
 def tokenize_chunks_with_images(chunks, doc, eng, images):
     res = []
+    txts = []
     # wrap up as es documents
     for ii, (ck, image) in enumerate(zip(chunks, images)):
         if len(ck.strip()) == 0:
@@ -303,8 +316,9 @@ def tokenize_chunks_with_images(chunks, doc, eng, images):
         d = copy.deepcopy(doc)
         d["image"] = image
         add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        txts.append(ck)
         res.append(d)
+    tokenize_batch(res, txts, eng)
     return res
 
 
@@ -227,18 +227,38 @@ class FulltextQueryer:
         return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
+        import numpy as np
+
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(int)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        q = 1e-9
+        for v in qtwt.values():
+            q += v
+        if not btkss:
+            return []
+
+        # Only the presence of a query term in a candidate contributes to the score
+        # (see `similarity`), so candidates are not weighted at all: they are reduced
+        # to a boolean (candidate x query term) matrix over integer term ids.
+        term_ids = {t: i for i, t in enumerate(qtwt.keys())}
+        rows, cols = [], []
+        for r, tks in enumerate(btkss):
             if isinstance(tks, str):
                 tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            ids = {term_ids[t] for t in tks if t in term_ids}
+            rows.extend([r] * len(ids))
+            cols.extend(ids)
+        hits = np.zeros((len(btkss), len(term_ids)), dtype=bool)
+        hits[np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)] = True
+
+        # Accumulate term by term in the same order as `similarity` so scores are bit-identical.
+        s = np.full(len(btkss), 1e-9)
+        for i, v in enumerate(qtwt.values()):
+            s += np.where(hits[:, i], v, 0.)
+        return list(s / q)
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
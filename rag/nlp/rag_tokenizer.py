@@ -15,27 +15,74 @@
 #
 
 import logging
-import copy
 import datrie
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from hanziconv import HanziConv
-from nltk import word_tokenize
-from nltk.stem import PorterStemmer, WordNetLemmatizer
 from api.utils.file_utils import get_project_base_directory
 
+try:
+    import marisa_trie
+except ImportError:
+    marisa_trie = None
+
+# Entries kept in each of the tokenizer's memo tables, 0 disables memoization.
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", 65536))
+# Processes used by `tokenize_many` for large batches, 0 or 1 keeps it in-process.
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", 0))
+
+
+class MmapTrie:
+    """
+    Read-only dictionary backed by a memory-mapped marisa-trie file, so the pages
+    are shared by every process on the host instead of each one loading its own
+    datrie copy. It implements the part of the `datrie.Trie` interface the
+    tokenizer uses: `in`, item lookup and `has_keys_with_prefix`.
+    """
+
+    def __init__(self, fnm):
+        self.trie = marisa_trie.BytesTrie().mmap(fnm)
+
+    @staticmethod
+    def build(trie, fnm):
+        # Word keys hold (F, tag), reversed keys only mark presence with 1.
+        items = [(k, b"" if v == 1 else "{}\t{}".format(v[0], v[1]).encode("utf-8")) for k, v in trie.items()]
+        tmp = "{}.{}.tmp".format(fnm, os.getpid())
+        marisa_trie.BytesTrie(items).save(tmp)
+        os.replace(tmp, fnm)
+
+    def __contains__(self, k):
+        return k in self.trie
+
+    def __getitem__(self, k):
+        v = self.trie[k][0]
+        if not v:
+            return 1
+        F, tag = v.decode("utf-8").split("\t", 1)
+        return int(F), tag
+
+    def has_keys_with_prefix(self, k):
+        return next(self.trie.iterkeys(k), None) is not None
+
 
 class RagTokenizer:
+    # Full-width forms and the ideographic space to their half-width counterparts.
+    Q2B_TABLE = {0x3000: 0x0020, **{c: c - 0xfee0 for c in range(0xff00, 0xff5f)}}
+
     def key_(self, line):
         return str(line.lower().encode("utf-8"))[2:-1]
 
     def rkey_(self, line):
         return str(("DD" + (line[::-1].lower())).encode("utf-8"))[2:-1]
 
-    def loadDict_(self, fnm):
+    def _build_trie(self, trie, fnm):
         logging.info(f"[HUQIE]:Build trie from {fnm}")
         try:
             of = open(fnm, "r", encoding='utf-8')
@@ -47,45 +94,108 @@ class RagTokenizer:
                 line = re.split(r"[ \t]", line)
                 k = self.key_(line[0])
                 F = int(math.log(float(line[1]) / self.DENOMINATOR) + .5)
-                if k not in self.trie_ or self.trie_[k][0] < F:
-                    self.trie_[self.key_(line[0])] = (F, line[2])
-                self.trie_[self.rkey_(line[0])] = 1
+                if k not in trie or trie[k][0] < F:
+                    trie[self.key_(line[0])] = (F, line[2])
+                trie[self.rkey_(line[0])] = 1
 
             dict_file_cache = fnm + ".trie"
             logging.info(f"[HUQIE]:Build trie cache to {dict_file_cache}")
-            self.trie_.save(dict_file_cache)
+            trie.save(dict_file_cache)
             of.close()
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
+        return trie
 
-    def __init__(self, debug=False):
-        self.DEBUG = debug
-        self.DENOMINATOR = 1000000
-        self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
-
-        self.stemmer = PorterStemmer()
-        self.lemmatizer = WordNetLemmatizer()
-
-        self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
+    def loadDict_(self, fnm):
+        trie = self.trie_
+        if not isinstance(trie, datrie.Trie):
+            # the memory-mapped dictionary is read-only, extend the datrie it was built from
+            trie = self._open_datrie()
+        self.trie_ = self._build_trie(trie, fnm)
 
+    def _open_datrie(self):
         trie_file_name = self.DIR_ + ".txt.trie"
         # check if trie file existence
         if os.path.exists(trie_file_name):
             try:
                 # load trie from file
-                self.trie_ = datrie.Trie.load(trie_file_name)
-                return
+                return datrie.Trie.load(trie_file_name)
             except Exception:
                 # fail to load trie from file, build default trie
                 logging.exception(f"[HUQIE]:Fail to load trie file {trie_file_name}, build the default trie file")
-                self.trie_ = datrie.Trie(string.printable)
         else:
             # file not exist, build default trie
             logging.info(f"[HUQIE]:Trie file {trie_file_name} not found, build the default trie file")
-            self.trie_ = datrie.Trie(string.printable)
 
         # load data from dict file and save to trie file
-        self.loadDict_(self.DIR_ + ".txt")
+        return self._build_trie(datrie.Trie(string.printable), self.DIR_ + ".txt")
+
+    def _open_trie(self):
+        if marisa_trie is None:
+            return self._open_datrie()
+
+        mmap_file_name = self.DIR_ + ".txt.marisa"
+        if not os.path.exists(mmap_file_name):
+            try:
+                logging.info(f"[HUQIE]:Build memory-mapped dictionary {mmap_file_name}")
+                MmapTrie.build(self._open_datrie(), mmap_file_name)
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to build {mmap_file_name}")
+        try:
+            return MmapTrie(mmap_file_name)
+        except Exception:
+            logging.exception(f"[HUQIE]:Fail to map {mmap_file_name}, load the trie file instead")
+            return self._open_datrie()
+
+    @property
+    def trie_(self):
+        # The dictionary is opened on first use so importing the tokenizer stays cheap.
+        if self._trie is None:
+            with self._trie_lock:
+                if self._trie is None:
+                    self._trie = self._open_trie()
+        return self._trie
+
+    @trie_.setter
+    def trie_(self, trie):
+        with self._trie_lock:
+            self._trie = trie
+            self._init_memo()
+
+    @property
+    def stemmer(self):
+        if self._stemmer is None:
+            from nltk.stem import PorterStemmer
+            self._stemmer = PorterStemmer()
+        return self._stemmer
+
+    @property
+    def lemmatizer(self):
+        if self._lemmatizer is None:
+            from nltk.stem import WordNetLemmatizer
+            self._lemmatizer = WordNetLemmatizer()
+        return self._lemmatizer
+
+    def _init_memo(self):
+        # Results only depend on the input and the dictionary, so they are reset whenever the trie changes.
+        self._tokenize_segment = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._tokenize_segment_)
+        self._fine_grained_token = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._fine_grained_token_)
+        self._english_normalize_word = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._english_normalize_word_)
+
+    def __init__(self, debug=False):
+        self.DEBUG = debug
+        self._init_memo()
+        self.DENOMINATOR = 1000000
+        self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
+
+        # NLTK is only imported once English text shows up, see `stemmer` and `lemmatizer`.
+        self._stemmer = None
+        self._lemmatizer = None
+
+        self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
+
+        self._trie = None
+        self._trie_lock = threading.RLock()
 
     def loadUserDict(self, fnm):
         try:
@@ -100,18 +210,7 @@ class RagTokenizer:
 
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xfee0
-            if inside_code < 0x0020 or inside_code > 0x7e:  # After the conversion, if it's not a half-width character, return the original character.
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(self.Q2B_TABLE)
 
     def _tradi2simp(self, line):
         return HanziConv.toSimplified(line)
@@ -122,10 +221,8 @@ class RagTokenizer:
         MAX_DEPTH = 10
         if _depth > MAX_DEPTH:
             if s < len(chars):
-                copy_pretks = copy.deepcopy(preTks)
                 remaining = "".join(chars[s:])
-                copy_pretks.append((remaining, (-12, '')))
-                tkslist.append(copy_pretks)
+                tkslist.append(preTks + [(remaining, (-12, ''))])
             return s
     
         state_key = (s, tuple(tk[0] for tk in preTks)) if preTks else (s, None)
@@ -151,11 +248,10 @@ class RagTokenizer:
                 mid = s + min(10, end - s)
                 t = "".join(chars[s:mid])
                 k = self.key_(t)
-                copy_pretks = copy.deepcopy(preTks)
                 if k in self.trie_:
-                    copy_pretks.append((t, self.trie_[k]))
+                    copy_pretks = preTks + [(t, self.trie_[k])]
                 else:
-                    copy_pretks.append((t, (-12, '')))
+                    copy_pretks = preTks + [(t, (-12, ''))]
                 next_res = self.dfs_(chars, mid, copy_pretks, tkslist, _depth + 1, _memo)
                 res = max(res, next_res)
                 _memo[state_key] = res
@@ -178,8 +274,7 @@ class RagTokenizer:
             if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
                 break
             if k in self.trie_:
-                pretks = copy.deepcopy(preTks)
-                pretks.append((t, self.trie_[k]))
+                pretks = preTks + [(t, self.trie_[k])]
                 res = max(res, self.dfs_(chars, e, pretks, tkslist, _depth + 1, _memo))
         
         if res > s:
@@ -188,11 +283,10 @@ class RagTokenizer:
     
         t = "".join(chars[s:s + 1])
         k = self.key_(t)
-        copy_pretks = copy.deepcopy(preTks)
         if k in self.trie_:
-            copy_pretks.append((t, self.trie_[k]))
+            copy_pretks = preTks + [(t, self.trie_[k])]
         else:
-            copy_pretks.append((t, (-12, '')))
+            copy_pretks = preTks + [(t, (-12, ''))]
         result = self.dfs_(chars, s + 1, copy_pretks, tkslist, _depth + 1, _memo)
         _memo[state_key] = result
         return result
@@ -293,8 +387,11 @@ class RagTokenizer:
 
         return self.score_(res[::-1])
 
+    def _english_normalize_word_(self, t):
+        return self.stemmer.stem(self.lemmatizer.lemmatize(t))
+
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self._english_normalize_word(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
 
     def _split_by_lang(self, line):
         txt_lang_pairs = []
@@ -319,77 +416,83 @@ class RagTokenizer:
             txt_lang_pairs.append((a[s: e], zh))
         return txt_lang_pairs
 
-    def tokenize(self, line):
-        line = re.sub(r"\W+", " ", line)
-        line = self._strQ2B(line).lower()
-        line = self._tradi2simp(line)
+    def _tokenize_segment_(self, L, lang):
+        """Tokens of one single-language piece of a line, memoized by `_tokenize_segment`"""
+        if not lang:
+            from nltk import word_tokenize
+            return tuple(self._english_normalize_word(t) for t in word_tokenize(L))
+        if len(L) < 2 or re.match(
+                r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
+            return (L,)
 
-        arr = self._split_by_lang(line)
         res = []
-        for L,lang in arr:
-            if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
-                continue
-            if len(L) < 2 or re.match(
-                    r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
-                res.append(L)
+
+        # use maxforward for the first time
+        tks, s = self.maxForward_(L)
+        tks1, s1 = self.maxBackward_(L)
+        if self.DEBUG:
+            logging.debug("[FW] {} {}".format(tks, s))
+            logging.debug("[BW] {} {}".format(tks1, s1))
+
+        i, j, _i, _j = 0, 0, 0, 0
+        same = 0
+        while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+            same += 1
+        if same > 0:
+            res.append(" ".join(tks[j: j + same]))
+        _i = i + same
+        _j = j + same
+        j = _j + 1
+        i = _i + 1
+
+        while i < len(tks1) and j < len(tks):
+            tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
+            if tk1 != tk:
+                if len(tk1) > len(tk):
+                    j += 1
+                else:
+                    i += 1
                 continue
 
-            # use maxforward for the first time
-            tks, s = self.maxForward_(L)
-            tks1, s1 = self.maxBackward_(L)
-            if self.DEBUG:
-                logging.debug("[FW] {} {}".format(tks, s))
-                logging.debug("[BW] {} {}".format(tks1, s1))
+            if tks1[i] != tks[j]:
+                i += 1
+                j += 1
+                continue
+            # backward tokens from_i to i are different from forward tokens from _j to j.
+            tkslist = []
+            self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
+            res.append(" ".join(self.sortTks_(tkslist)[0][0]))
 
-            i, j, _i, _j = 0, 0, 0, 0
-            same = 0
+            same = 1
             while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
                 same += 1
-            if same > 0:
-                res.append(" ".join(tks[j: j + same]))
+            res.append(" ".join(tks[j: j + same]))
             _i = i + same
             _j = j + same
             j = _j + 1
             i = _i + 1
 
-            while i < len(tks1) and j < len(tks):
-                tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
-                if tk1 != tk:
-                    if len(tk1) > len(tk):
-                        j += 1
-                    else:
-                        i += 1
-                    continue
+        if _i < len(tks1):
+            assert _j < len(tks)
+            assert "".join(tks1[_i:]) == "".join(tks[_j:])
+            tkslist = []
+            self.dfs_("".join(tks[_j:]), 0, [], tkslist)
+            res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+        return tuple(res)
 
-                if tks1[i] != tks[j]:
-                    i += 1
-                    j += 1
-                    continue
-                # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-                same = 1
-                while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                    same += 1
-                res.append(" ".join(tks[j: j + same]))
-                _i = i + same
-                _j = j + same
-                j = _j + 1
-                i = _i + 1
-
-            if _i < len(tks1):
-                assert _j < len(tks)
-                assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-        res = " ".join(res)
-        logging.debug("[TKS] {}".format(self.merge_(res)))
-        return self.merge_(res)
+    def tokenize(self, line):
+        line = re.sub(r"\W+", " ", line)
+        line = self._strQ2B(line).lower()
+        line = self._tradi2simp(line)
+
+        arr = self._split_by_lang(line)
+        res = []
+        for L, lang in arr:
+            res.extend(self._tokenize_segment(L, lang))
+
+        res = self.merge_(" ".join(res))
+        logging.debug("[TKS] {}".format(res))
+        return res
 
     def fine_grained_tokenize(self, tks):
         tks = tks.split()
@@ -400,37 +503,29 @@ class RagTokenizer:
                 res.extend(tk.split("/"))
             return " ".join(res)
 
-        res = []
-        for tk in tks:
-            if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
-                res.append(tk)
-                continue
-            tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
-            if len(tkslist) < 2:
-                res.append(tk)
-                continue
-            stk = self.sortTks_(tkslist)[1][0]
-            if len(stk) == len(tk):
-                stk = tk
-            else:
-                if re.match(r"[a-z\.-]+$", tk):
-                    for t in stk:
-                        if len(t) < 3:
-                            stk = tk
-                            break
-                    else:
-                        stk = " ".join(stk)
-                else:
-                    stk = " ".join(stk)
-
-            res.append(stk)
-
+        res = [self._fine_grained_token(tk) for tk in tks]
         return " ".join(self.english_normalize_(res))
 
+    def _fine_grained_token_(self, tk):
+        """Fine-grained split of one coarse token, memoized by `_fine_grained_token`"""
+        if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
+            return tk
+        tkslist = []
+        if len(tk) > 10:
+            tkslist.append(tk)
+        else:
+            self.dfs_(tk, 0, [], tkslist)
+        if len(tkslist) < 2:
+            return tk
+        stk = self.sortTks_(tkslist)[1][0]
+        if len(stk) == len(tk):
+            return tk
+        if re.match(r"[a-z\.-]+$", tk):
+            for t in stk:
+                if len(t) < 3:
+                    return tk
+        return " ".join(stk)
+
 
 def is_chinese(s):
     if s >= u'\u4e00' and s <= u'\u9fa5':
@@ -474,6 +569,36 @@ addUserDict = tokenizer.addUserDict
 tradi2simp = tokenizer._tradi2simp
 strQ2B = tokenizer._strQ2B
 
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _tokenize_one(line):
+    return tokenizer.tokenize(line)
+
+
+def _tokenize_pair(line):
+    tks = tokenizer.tokenize(line)
+    return tks, tokenizer.fine_grained_tokenize(tks)
+
+
+def tokenize_many(lines, fine_grained=False, workers=TOKENIZER_WORKERS):
+    """
+    Tokenize a batch of lines, the same as calling `tokenize` on each of them.
+    With `fine_grained`, (tokens, fine grained tokens) pairs are returned instead.
+    When `workers` > 1, large batches are spread over a process pool whose workers
+    each load their own tokenizer.
+    """
+    fn = _tokenize_pair if fine_grained else _tokenize_one
+    if workers <= 1 or len(lines) < 2 * workers:
+        return [fn(line) for line in lines]
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return list(_pool.map(fn, lines, chunksize=max(1, len(lines) // (workers * 4))))
+
 if __name__ == '__main__':
     tknzr = RagTokenizer(debug=True)
     # huqie.addUserDict("/tmp/tmp.new.tks.dict")
@@ -18,14 +18,14 @@ import logging
 import re
 import math
 import os
-from collections import OrderedDict
 from dataclasses import dataclass
 
 from rag.prompts.generator import relevant_chunks_with_toc
 from rag.settings import TAG_FLD, PAGERANK_FLD
-from rag.utils import rmSpace, get_float
+from rag.utils import rmSpace, get_float, num_tokens_from_string
 from rag.nlp import rag_tokenizer, query
 import numpy as np
+from rag.utils.query_embed_cache import QUERY_EMBED_CACHE
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
 
 
@@ -47,9 +47,12 @@ class Dealer:
         aggregation: list | dict | None = None
         keywords: list[str] | None = None
         group_docs: list[list] | None = None
+        # Chunk vectors as one float32 matrix, row i belongs to ids[i]. They are
+        # moved out of `field` so consumers take row views instead of lists.
+        vectors: np.ndarray | None = None
 
     def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
-        qv, _ = emb_mdl.encode_queries(txt)
+        qv, _ = QUERY_EMBED_CACHE.encode_queries(emb_mdl, txt)
         shape = np.array(qv).shape
         if len(shape) > 1:
             raise Exception(
@@ -153,16 +156,41 @@ class Dealer:
         keywords = list(kwds)
         highlight = self.dataStore.getHighlight(res, keywords, "content_with_weight")
         aggs = self.dataStore.getAggregation(res, "docnm_kwd")
+        field = self.dataStore.getFields(res, src + ["_score"])
+        vectors = None
+        if q_vec:
+            vectors = self.vector_matrix(ids, field, len(q_vec))
         return self.SearchResult(
             total=total,
             ids=ids,
             query_vector=q_vec,
             aggregation=aggs,
             highlight=highlight,
-            field=self.dataStore.getFields(res, src + ["_score"]),
-            keywords=keywords
+            field=field,
+            keywords=keywords,
+            vectors=vectors
         )
 
+    @staticmethod
+    def as_vector(v) -> np.ndarray:
+        if isinstance(v, str):
+            return np.fromiter((get_float(t) for t in v.split("\t")), dtype=np.float32)
+        return np.asarray(v, dtype=np.float32)
+
+    @staticmethod
+    def vector_matrix(ids, field, dim) -> np.ndarray:
+        """Pop the `q_<dim>_vec` column of every chunk into a float32 matrix, zero rows for missing vectors."""
+        vector_column = f"q_{dim}_vec"
+        vectors = np.zeros((len(ids), dim), dtype=np.float32)
+        for i, chunk_id in enumerate(ids):
+            v = field.get(chunk_id, {}).pop(vector_column, None)
+            if v is None:
+                continue
+            v = Dealer.as_vector(v)
+            if v.shape == (dim,):
+                vectors[i] = v
+        return vectors
+
     @staticmethod
     def trans2floats(txt):
         return [get_float(t) for t in txt.split("\t")]
@@ -210,10 +238,12 @@ class Dealer:
             return answer, set([])
 
         ans_v, _ = embd_mdl.encode(pieces_)
+        dim = len(ans_v[0])
         for i in range(len(chunk_v)):
-            if len(ans_v[0]) != len(chunk_v[i]):
-                chunk_v[i] = [0.0]*len(ans_v[0])
-                logging.warning("The dimension of query and chunk do not match: {} vs. {}".format(len(ans_v[0]), len(chunk_v[i])))
+            if dim != len(chunk_v[i]):
+                logging.warning("The dimension of query and chunk do not match: {} vs. {}".format(dim, len(chunk_v[i])))
+                chunk_v[i] = np.zeros(dim, dtype=np.float32)
+        chunk_v = np.vstack(chunk_v).astype(np.float32, copy=False)
 
         assert len(ans_v[0]) == len(chunk_v[0]), "The dimension of query and chunk do not match: {} vs. {}".format(
             len(ans_v[0]), len(chunk_v[0]))
@@ -288,28 +318,23 @@ class Dealer:
                rank_feature: dict | None = None
                ):
         _, keywords = self.qryr.question(query)
-        vector_size = len(sres.query_vector)
-        vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        ins_embd = sres.vectors
+        if ins_embd is None:
+            ins_embd = np.zeros((len(sres.ids), len(sres.query_vector)), dtype=np.float32)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # token_similarity only checks which query terms a chunk contains, so each
+        # chunk is reduced to its set of terms; repeating fields adds nothing.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            tks = set(sres.field[i][cfield].split())
+            tks.update(sres.field[i].get("title_tks", "").split())
+            tks.update(sres.field[i].get("question_tks", "").split())
+            tks.update(sres.field[i].get("important_kwd", []))
             ins_tw.append(tks)
 
         ## For rank feature(tag_fea) scores.
@@ -396,8 +421,7 @@ class Dealer:
         sim_np = np.array(sim)
         idx = np.argsort(sim_np * -1)
         dim = len(sres.query_vector)
-        vector_column = f"q_{dim}_vec"
-        zero_vector = [0.0] * dim
+        zero_vector = np.zeros(dim, dtype=np.float32)
         filtered_count = (sim_np >= similarity_threshold).sum()
         ranks["total"] = int(filtered_count) # Convert from np.int64 to Python int otherwise JSON serializable error
         for i in idx:
@@ -430,7 +454,7 @@ class Dealer:
                 "similarity": sim[i],
                 "vector_similarity": vsim[i],
                 "term_similarity": tsim[i],
-                "vector": chunk.get(vector_column, zero_vector),
+                "vector": sres.vectors[i] if sres.vectors is not None else zero_vector,
                 "positions": position_int,
                 "doc_type_kwd": chunk.get("doc_type_kwd", "")
             }
@@ -461,6 +485,21 @@ class Dealer:
                    offset=0,
                    fields=["docnm_kwd", "content_with_weight", "img_id"],
                    sort_by_position: bool = False):
+        return list(self.iter_chunks(doc_id, tenant_id, kb_ids, max_count, offset, fields, sort_by_position))
+
+    def iter_chunks(self, doc_id: str, tenant_id: str,
+                    kb_ids: list[str], max_count=1024,
+                    offset=0,
+                    fields=["docnm_kwd", "content_with_weight", "img_id"],
+                    sort_by_position: bool = False,
+                    max_tokens: int | None = None,
+                    page_size: int = 128):
+        """
+        Yield the chunks of a document page by page instead of collecting them all.
+        Ordering is done by the doc store when `sort_by_position` is set, and the
+        iteration stops once the `content_with_weight` of yielded chunks reaches
+        `max_tokens`, so no further pages are fetched.
+        """
         condition = {"doc_id": doc_id}
 
         fields_set = set(fields or [])
@@ -468,6 +507,8 @@ class Dealer:
             for need in ("page_num_int", "position_int", "top_int"):
                 if need not in fields_set:
                     fields_set.add(need)
+        if max_tokens is not None:
+            fields_set.add("content_with_weight")
         fields = list(fields_set)
 
         orderBy = OrderByExpr()
@@ -476,19 +517,20 @@ class Dealer:
             orderBy.asc("position_int")
             orderBy.asc("top_int")
 
-        res = []
-        bs = 128
-        for p in range(offset, max_count, bs):
-            es_res = self.dataStore.search(fields, [], condition, [], orderBy, p, bs, index_name(tenant_id),
+        tokens = 0
+        for p in range(offset, max_count, page_size):
+            es_res = self.dataStore.search(fields, [], condition, [], orderBy, p, page_size, index_name(tenant_id),
                                            kb_ids)
             dict_chunks = self.dataStore.getFields(es_res, fields)
             for id, doc in dict_chunks.items():
                 doc["id"] = id
-            if dict_chunks:
-                res.extend(dict_chunks.values())
-            if len(dict_chunks.values()) < bs:
+                yield doc
+                if max_tokens is not None:
+                    tokens += num_tokens_from_string(doc.get("content_with_weight") or "")
+                    if tokens >= max_tokens:
+                        return
+            if len(dict_chunks) < page_size:
                 break
-        return res
 
     def all_tags(self, tenant_id: str, kb_ids: list[str], S=1000):
         if not self.dataStore.indexExist(index_name(tenant_id), kb_ids[0]):
@@ -577,14 +619,14 @@ class Dealer:
                 "similarity": sim,
                 "vector_similarity": sim,
                 "term_similarity": sim,
-                "vector": [0.0] * vector_size,
+                "vector": np.zeros(vector_size, dtype=np.float32),
                 "positions": chunk.get("position_int", []),
                 "doc_type_kwd": chunk.get("doc_type_kwd", "")
             }
             for k in chunk.keys():
                 if k[-4:] == "_vec":
-                    d["vector"] = chunk[k]
-                    vector_size = len(chunk[k])
+                    d["vector"] = self.as_vector(chunk[k])
+                    vector_size = len(d["vector"])
                     break
             chunks.append(d)
 
@@ -19,7 +19,6 @@ import json
 import os
 import time
 import re
-from nltk.corpus import wordnet
 from api.utils.file_utils import get_project_base_directory
 
 
@@ -68,6 +67,7 @@ class Dealer:
 
     def lookup(self, tk, topn=8):
         if re.match(r"[a-z]+$", tk):
+            from nltk.corpus import wordnet
             res = list(set([re.sub("_", " ", syn.name().split(".")[0]) for syn in wordnet.synsets(tk)]) - set([tk]))
             return [t for t in res if t]
 
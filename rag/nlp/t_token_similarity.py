@@ -0,0 +1,94 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import random
+from collections import defaultdict
+from timeit import default_timer as timer
+
+from rag.nlp import query, rag_tokenizer
+
+SAMPLE = """
+检索增强生成通过在生成答案之前从知识库中召回相关片段来减少大模型的幻觉。
+混合检索同时使用全文检索和向量检索，并在重排阶段融合词项相似度与向量相似度。
+Retrieval augmented generation grounds large language models on documents retrieved from a knowledge base.
+Hybrid search combines BM25 full text matching with dense vector similarity, and a rerank stage fuses the scores.
+文档解析会把 PDF 拆分成带有页码和位置的分块，再为每个分块计算嵌入向量并写入文档存储。
+The tokenizer splits mixed Chinese and English text into terms weighted by inverse document frequency.
+"""
+
+
+def legacy_token_similarity(qryr, atks, btkss):
+    """The per-candidate dictionary implementation `token_similarity` replaced."""
+    def toDict(tks):
+        if isinstance(tks, str):
+            tks = tks.split()
+        d = defaultdict(int)
+        wts = qryr.tw.weights(tks, preprocess=False)
+        for i, (t, c) in enumerate(wts):
+            d[t] += c
+        return d
+
+    atks = toDict(atks)
+    btkss = [toDict(tks) for tks in btkss]
+    return [qryr.similarity(atks, btks) for btks in btkss]
+
+
+def main(args):
+    qryr = query.FulltextQueryer()
+    vocab = sorted(set(rag_tokenizer.tokenize(args.corpus or SAMPLE).split()))
+    rnd = random.Random(0)
+
+    _, keywords = qryr.question(args.question)
+    candidates = [rnd.choices(vocab, k=args.tokens) + rnd.sample(keywords, k=rnd.randint(0, len(keywords)))
+                  for _ in range(args.candidates)]
+
+    st = timer()
+    for _ in range(args.rounds):
+        expected = legacy_token_similarity(qryr, keywords, candidates)
+    legacy = (timer() - st) / args.rounds
+
+    st = timer()
+    for _ in range(args.rounds):
+        actual = qryr.token_similarity(keywords, candidates)
+    batched = (timer() - st) / args.rounds
+
+    assert expected == actual, "token_similarity scores differ from the legacy implementation"
+    print("candidates: {}, tokens/candidate: {}, keywords: {}".format(args.candidates, args.tokens, len(keywords)))
+    print("legacy:  {:.2f} ms".format(legacy * 1000))
+    print("batched: {:.2f} ms".format(batched * 1000))
+    print("speedup: {:.1f}x, scores identical".format(legacy / max(batched, 1e-9)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--question', help="query used for the keyword side", default="混合检索 rerank 向量相似度 knowledge base")
+    parser.add_argument('--corpus', help="text the candidate tokens are drawn from", default="")
+    parser.add_argument('--candidates', help="number of chunks to score, like RERANK_LIMIT", type=int, default=64)
+    parser.add_argument('--tokens', help="tokens per chunk", type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    main(args)
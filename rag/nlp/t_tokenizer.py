@@ -0,0 +1,110 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import json
+from timeit import default_timer as timer
+
+from rag.nlp import rag_tokenizer
+
+# Regression corpus: mixed scripts, full-width forms, traditional characters,
+# repetitive runs and long sentences that exercise the dfs_ path. EXPECTED holds
+# its output from the tokenizer before memoization, with the standard huqie dictionary.
+CORPUS = [
+    "哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈",
+    "公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。使用外汇投资的，可通过债券持有人在香港人民币业务清算行及香港地区经批准可进入境内银行间外汇市场进行交易的境外人民币业务参加行（以下统称香港结算行）办理外汇资金兑换。",
+    "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。目的是通过这种方式为学区房降温，把就近入学落到实处。南京市长江大桥",
+    "实际上当时他们已经将业务中心偏移到安全部门和针对政府企业的部门 Scripts are compiled and cached aaaaaaaaa",
+    "虽然我不怎么玩",
+    "蓝月亮如何在外资夹击中生存,那是全宇宙最有意思的",
+    "涡轮增压发动机num最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义,黄黄爱美食,不过，今天阿奇要讲到的这家农贸市场，说实话，还真蛮有特色的！不仅环境好，还打出了",
+    "这周日你去吗？这周日你有空吗？",
+    "ＡＢＣ１２３　全角字符测试，Ｈｅｌｌｏ　Ｗｏｒｌｄ！",
+    "繁體中文轉換為簡體中文的測試句子，資料庫與伺服器",
+    "RAGFlow 是一个基于深度文档理解的开源 RAG 引擎, version 0.20.1 released on 2025-08-01.",
+    "The quick brown foxes were jumping over lazy dogs while running studies on tokenization.",
+    "检索增强生成通过在生成答案之前从知识库中召回相关片段来减少大模型的幻觉。",
+    "混合检索同时使用全文检索和向量检索，并在重排阶段融合词项相似度与向量相似度。",
+    "文档解析会把PDF拆分成带有页码和位置的分块，再为每个分块计算嵌入向量并写入文档存储。",
+    "表格<table><tr><td>营业收入</td><td>1,234.56万元</td></tr></table>同比增长12.5%",
+    "",
+    "   \t\n  ",
+]
+
+
+EXPECTED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "t_tokenizer_expected.json")
+
+
+def run(lines):
+    return [(t, rag_tokenizer.fine_grained_tokenize(t)) for t in (rag_tokenizer.tokenize(line) for line in lines)]
+
+
+def main(args):
+    lines = CORPUS
+    if args.corpus:
+        if not args.expected:
+            sys.exit("--corpus needs the file of its recorded output")
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f]
+    expected_file = args.expected or EXPECTED
+
+    st = timer()
+    actual = run(lines)
+    print("tokenized {} lines in {:.2f}s".format(len(lines), timer() - st))
+
+    if args.record:
+        with open(expected_file, "w", encoding="utf-8") as f:
+            json.dump([list(r) for r in actual], f, ensure_ascii=False, indent=1)
+        print("recorded to {}".format(expected_file))
+        return
+
+    with open(expected_file, "r", encoding="utf-8") as f:
+        expected = [tuple(r) for r in json.load(f)]
+    batched = rag_tokenizer.tokenize_many(lines, fine_grained=True, workers=args.workers)
+    failed = 0
+    for name, output in (("tokenize", actual), ("tokenize_many", batched)):
+        diffs = [(line, e, a) for line, e, a in zip(lines, expected, output) if e != tuple(a)]
+        for line, e, a in diffs:
+            print("MISMATCH in {}: {}\n  expected: {}\n  actual:   {}".format(name, line, e, a))
+        if len(expected) != len(output):
+            print("{} gave {} lines, {} expected".format(name, len(output), len(expected)))
+            failed += 1
+        failed += len(diffs)
+    if failed:
+        sys.exit("{} difference(s) from {}".format(failed, expected_file))
+    print("all {} lines identical to {}".format(len(lines), expected_file))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the tokenizer output is identical to the recorded one, "
+                                                 "exits non-zero on any difference.")
+    parser.add_argument('expected', nargs="?", default="", help="JSON file with the recorded output, defaults to t_tokenizer_expected.json")
+    parser.add_argument('--record', action="store_true", help="write the current output instead of checking it, "
+                                                              "only on a known-good tree with the standard huqie dictionary")
+    parser.add_argument('--corpus', help="text file with one input per line, defaults to the built-in corpus", default="")
+    parser.add_argument('--workers', help="processes used to check tokenize_many", type=int, default=2)
+    args = parser.parse_args()
+    main(args)
@@ -14,6 +14,7 @@
 #  limitations under the License.
 #
 import os
+import json
 import logging
 from api.utils.configs import get_base_config, decrypt_database_config
 from api.utils.file_utils import get_project_base_directory
@@ -57,7 +58,59 @@ except Exception:
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
 DOC_BULK_SIZE = int(os.environ.get("DOC_BULK_SIZE", 4))
+DOC_BULK_BYTES = int(os.environ.get("DOC_BULK_BYTES", 4 * 1024 * 1024))
 EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+# Remote embedding providers get batches of about this many tokens, several of them in flight at once.
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", 8192))
+EMBEDDING_INITIAL_CONCURRENCY = int(os.environ.get("EMBEDDING_INITIAL_CONCURRENCY", 4))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 16))
+MAX_CONCURRENT_SURVEY_SUMMARIES = int(os.environ.get("MAX_CONCURRENT_SURVEY_SUMMARIES", 5))
+SURVEY_MAP_REDUCE_MIN_PAPERS = int(os.environ.get("SURVEY_MAP_REDUCE_MIN_PAPERS", 20))
+SURVEY_SECTION_MAX_PAPERS = int(os.environ.get("SURVEY_SECTION_MAX_PAPERS", 10))
+SURVEY_PAPER_CONTENT_TOKENS = int(os.environ.get("SURVEY_PAPER_CONTENT_TOKENS", 4096))
+QUERY_EMBED_CACHE_SIZE = int(os.environ.get("QUERY_EMBED_CACHE_SIZE", 4096))
+QUERY_EMBED_CACHE_TTL = int(os.environ.get("QUERY_EMBED_CACHE_TTL", 24 * 3600))
+# Per-tenant overrides, e.g. '{"<tenant_id>": 600}'; a TTL of 0 disables the cache for that tenant.
+try:
+    QUERY_EMBED_CACHE_TENANT_TTL = json.loads(os.environ.get("QUERY_EMBED_CACHE_TENANT_TTL", "{}"))
+except Exception:
+    logging.warning("QUERY_EMBED_CACHE_TENANT_TTL is not valid JSON, ignored.")
+    QUERY_EMBED_CACHE_TENANT_TTL = {}
+# Node-local cache of chunk embeddings, reused when a document is parsed again. A size of 0 disables it.
+CHUNK_EMBED_CACHE_PATH = os.environ.get("CHUNK_EMBED_CACHE_PATH", os.path.join(get_project_base_directory(), "cache", "chunk_embeddings.sqlite"))
+CHUNK_EMBED_CACHE_MAX_BYTES = int(os.environ.get("CHUNK_EMBED_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Connections kept open to MinIO, also the number of uploads `put_many` runs at once.
+MINIO_MAX_CONNECTIONS = int(os.environ.get("MINIO_MAX_CONNECTIONS", 32))
+# Connect and read timeouts of MinIO requests in seconds, minio's own defaults.
+MINIO_CONNECT_TIMEOUT = float(os.environ.get("MINIO_CONNECT_TIMEOUT", 300))
+MINIO_READ_TIMEOUT = float(os.environ.get("MINIO_READ_TIMEOUT", 300))
+# Blobs from this size on are uploaded as multipart, several parts at a time.
+MINIO_MULTIPART_THRESHOLD = int(os.environ.get("MINIO_MULTIPART_THRESHOLD", 64 * 1024 * 1024))
+MINIO_PART_SIZE = int(os.environ.get("MINIO_PART_SIZE", 16 * 1024 * 1024))
+MINIO_PARALLEL_PARTS = int(os.environ.get("MINIO_PARALLEL_PARTS", 4))
+# Node-local disk cache of the source files task executors fetch from the storage backend. A size of 0 disables it.
+FILE_CACHE_PATH = os.environ.get("FILE_CACHE_PATH", os.path.join(get_project_base_directory(), "cache", "files"))
+FILE_CACHE_MAX_BYTES = int(os.environ.get("FILE_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+# Rendered PDF pages kept decoded at once by a parser, the others are held compressed.
+PDF_PAGE_IMAGE_WINDOW = int(os.environ.get("PDF_PAGE_IMAGE_WINDOW", 16))
+# Text boxes gathered from consecutive pages before OCR recognition runs over them as one width-sorted set.
+OCR_CROSS_PAGE_BOXES = int(os.environ.get("OCR_CROSS_PAGE_BOXES", 256))
+OCR_REC_BATCH_NUM = int(os.environ.get("OCR_REC_BATCH_NUM", 16))
+# ONNX Runtime sessions of the deepdoc models, loaded once per process and shared by every parser.
+# A thread count of 0 lets ONNX Runtime use every core.
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", 2))
+ONNX_INTER_OP_THREADS = int(os.environ.get("ONNX_INTER_OP_THREADS", 2))
+# One of disable, basic, extended, all.
+ONNX_GRAPH_OPT_LEVEL = os.environ.get("ONNX_GRAPH_OPT_LEVEL", "all").lower()
+# Comma separated models (e.g. "rec,layout") run as dynamically quantized int8 on CPU, "all" for every model.
+ONNX_INT8_MODELS = {m.strip() for m in os.environ.get("ONNX_INT8_MODELS", "").split(",") if m.strip()}
+# PDFs are split into parsing tasks sized by the executors left idle, never below this many pages a task.
+PDF_TASK_MIN_PAGES = int(os.environ.get("PDF_TASK_MIN_PAGES", 4))
+# Tasks of each tenant are queued in their own sub-stream of a priority queue and taken in weighted fair turns,
+# a task of priority 1 counts for 1/4 of a turn. Sub-streams idle for longer than the TTL are no longer polled
+# once they hold no unread or unacked task.
+TASK_PRIORITY_WEIGHTS = {1: int(os.environ.get("TASK_PRIORITY_WEIGHT", 4)), 0: 1}
+TASK_QUEUE_TENANT_TTL = int(os.environ.get("TASK_QUEUE_TENANT_TTL", 24 * 3600))
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
 PAGERANK_FLD = "pagerank_fea"
@@ -0,0 +1,103 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+import trio
+
+from rag.settings import EMBEDDING_BATCH_SIZE
+from rag.svr.task_executor import embedding, CHUNK_EMBED_CACHE
+
+
+class RandomEmbedding:
+    """Stands in for an embedding model so only the executor's own work is measured."""
+    max_length = 8192
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.rnd = np.random.default_rng(0)
+
+    def encode(self, texts):
+        return self.rnd.random((len(texts), self.dim)), sum(len(t) for t in texts)
+
+
+def legacy_embedding(docs, mdl, title_w=0.1):
+    """The accumulation `embedding` replaced: the result grew with np.concatenate on every batch."""
+    cnts = [d["content_with_weight"] for d in docs]
+    vts, _ = mdl.encode([docs[0]["docnm_kwd"]])
+    tts = np.concatenate([vts for _ in range(len(docs))], axis=0)
+    cnts_ = np.array([])
+    for i in range(0, len(cnts), EMBEDDING_BATCH_SIZE):
+        vts, _ = mdl.encode(cnts[i: i + EMBEDDING_BATCH_SIZE])
+        if len(cnts_) == 0:
+            cnts_ = vts
+        else:
+            cnts_ = np.concatenate((cnts_, vts), axis=0)
+    vects = title_w * tts + (1 - title_w) * cnts_
+    for i, d in enumerate(docs):
+        v = vects[i].tolist()
+        d["q_%d_vec" % len(v)] = v
+
+
+def measure(run, make_docs):
+    # Timed and traced in separate runs, tracing slows allocation heavy code down too much to time it.
+    docs = make_docs()
+    st = timer()
+    run(docs)
+    elapsed = timer() - st
+    del docs
+    docs = make_docs()
+    tracemalloc.start()
+    run(docs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(args):
+    # Every chunk has to reach the model, as on a first parse.
+    CHUNK_EMBED_CACHE.max_bytes = 0
+
+    def make_docs():
+        return [{"docnm_kwd": "benchmark.pdf", "content_with_weight": "chunk {} ".format(i) * 20} for i in range(args.chunks)]
+
+    legacy = measure(lambda docs: legacy_embedding(docs, RandomEmbedding(args.dim)), make_docs)
+    current = measure(lambda docs: trio.run(embedding, docs, RandomEmbedding(args.dim)), make_docs)
+
+    print("chunks: {}, dim: {}, batch: {}".format(args.chunks, args.dim, EMBEDDING_BATCH_SIZE))
+    print("concatenate:  {:.2f}s, peak {:.1f} MiB".format(legacy[0], legacy[1] / 1024 / 1024))
+    print("preallocated: {:.2f}s, peak {:.1f} MiB".format(current[0], current[1] / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the executor's embedding accumulation against the old np.concatenate one.")
+    parser.add_argument('--chunks', help="number of chunks of the document", type=int, default=10000)
+    parser.add_argument('--dim', help="vector size of the embedding model", type=int, default=1024)
+    args = parser.parse_args()
+    main(args)
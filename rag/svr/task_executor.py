@@ -28,7 +28,7 @@ from api.db.services.canvas_service import UserCanvasService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.pipeline_operation_log_service import PipelineOperationLogService
 from api.utils.api_utils import timeout
-from api.utils.base64_image import image2id
+from api.utils.base64_image import images2ids
 from api.utils.log_utils import init_root_logger, get_project_base_directory
 from graphrag.general.index import run_graphrag_for_kb
 from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
@@ -63,10 +63,15 @@ from api.db.db_models import close_connection
 from rag.app import laws, paper, presentation, manual, qa, table, book, resume, picture, naive, one, audio, email, tag
 from rag.nlp import search, rag_tokenizer, add_positions
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
-from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, EMBEDDING_BATCH_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
+from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, DOC_BULK_BYTES, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CONCURRENCY, MAX_CONCURRENT_SURVEY_SUMMARIES, SVR_CONSUMER_GROUP_NAME, print_rag_settings, TAG_FLD, PAGERANK_FLD
 from rag.utils import num_tokens_from_string, truncate
+from rag.utils.chunk_embed_cache import CHUNK_EMBED_CACHE
+from rag.utils.embedding_dispatcher import EmbeddingDispatcher
+from rag.utils.file_cache import FILE_CACHE
+from rag.utils.query_embed_cache import QueryEmbeddingCache
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 from rag.utils.storage_factory import STORAGE_IMPL
+from rag.utils.task_scheduler import FairTaskScheduler, svr_queue_flows, svr_queue_stats
 from graphrag.utils import chat_limiter
 
 BATCH_SIZE = 64
@@ -101,6 +106,7 @@ UNACKED_ITERATOR = None
 
 CONSUMER_NO = "0" if len(sys.argv) < 2 else sys.argv[1]
 CONSUMER_NAME = "task_executor_" + CONSUMER_NO
+TASK_SCHEDULER = FairTaskScheduler(CONSUMER_NAME)
 BOOT_AT = datetime.now().astimezone().isoformat(timespec="milliseconds")
 PENDING_TASKS = 0
 LAG_TASKS = 0
@@ -108,15 +114,24 @@ DONE_TASKS = 0
 FAILED_TASKS = 0
 
 CURRENT_TASKS = {}
+EMBEDDING_VECTOR_SIZES = {}
 
 MAX_CONCURRENT_TASKS = int(os.environ.get("MAX_CONCURRENT_TASKS", "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get("MAX_CONCURRENT_CHUNK_BUILDERS", "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get("MAX_CONCURRENT_MINIO", "10"))
+MAX_CONCURRENT_DOC_BULKS = int(os.environ.get("MAX_CONCURRENT_DOC_BULKS", "4"))
 task_limiter = trio.Semaphore(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
+bulk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_DOC_BULKS)
+embed_dispatcher = EmbeddingDispatcher(embed_limiter)
+CHUNK_PIPELINE_BUFFER = int(os.environ.get("CHUNK_PIPELINE_BUFFER", "64"))
+IMAGE_PUT_BATCH = int(os.environ.get("IMAGE_PUT_BATCH", "32"))
+IMAGE_PUT_WORKERS = int(os.environ.get("IMAGE_PUT_WORKERS", "2"))
+CHUNK_PIPELINE_REPORT_INTERVAL = int(os.environ.get("CHUNK_PIPELINE_REPORT_INTERVAL", "10"))
 kg_limiter = trio.CapacityLimiter(2)
+survey_limiter = trio.CapacityLimiter(MAX_CONCURRENT_SURVEY_SUMMARIES)
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", "120"))
 stop_event = threading.Event()
 
@@ -205,17 +220,15 @@ async def collect():
     global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
     global UNACKED_ITERATOR
 
-    svr_queue_names = get_svr_queue_names()
     try:
         if not UNACKED_ITERATOR:
+            svr_queue_names = [q for _, _, q in svr_queue_flows()]
             UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(svr_queue_names, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
         try:
             redis_msg = next(UNACKED_ITERATOR)
         except StopIteration:
-            for svr_queue_name in svr_queue_names:
-                redis_msg = REDIS_CONN.queue_consumer(svr_queue_name, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
-                if redis_msg:
-                    break
+            # The slot of this task is taken already.
+            redis_msg = TASK_SCHEDULER.next(task_limiter.value + 1)
     except Exception:
         logging.exception("collect got exception")
         return None, None
@@ -253,6 +266,8 @@ async def collect():
         return None, None
 
     task["task_type"] = task_type
+    # Set on the page ranges of a split document, whose TOC is built by a separate merge task.
+    task["toc_merge"] = msg.get("toc_merge", False)
     if task_type[:8] == "dataflow":
         task["tenant_id"] = msg["tenant_id"]
         task["dataflow_id"] = msg["dataflow_id"]
@@ -261,11 +276,11 @@ async def collect():
 
 
 async def get_storage_binary(bucket, name):
-    return await trio.to_thread.run_sync(lambda: STORAGE_IMPL.get(bucket, name))
+    return await trio.to_thread.run_sync(lambda: FILE_CACHE.get(bucket, name))
 
 
 @timeout(60 * 80, 1)
-async def build_chunks(task, progress_callback):
+async def chunk_document(task, progress_callback):
     if task["size"] > DOC_MAXIMUM_SIZE:
         set_progress(task["id"], prog=-1, msg="File size exceeds( <= %dMb )" % (int(DOC_MAXIMUM_SIZE / 1024 / 1024)))
         return []
@@ -310,128 +325,279 @@ async def build_chunks(task, progress_callback):
         progress_callback(-1, "Internal server error while chunking: %s" % str(e).replace("'", ""))
         logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
         raise
+    return cks
 
-    docs = []
-    doc = {"doc_id": task["doc_id"], "kb_id": str(task["kb_id"])}
-    if task["pagerank"]:
-        doc[PAGERANK_FLD] = int(task["pagerank"])
-    st = timer()
 
-    @timeout(60)
-    async def upload_to_minio(document, chunk):
-        try:
-            d = copy.deepcopy(document)
-            d.update(chunk)
-            d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
-            d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
-            d["create_timestamp_flt"] = datetime.now().timestamp()
-            if not d.get("image"):
-                _ = d.pop("image", None)
-                d["img_id"] = ""
-                docs.append(d)
-                return
-            await image2id(d, partial(STORAGE_IMPL.put, tenant_id=task["tenant_id"]), d["id"], task["kb_id"])
-            docs.append(d)
-        except Exception:
-            logging.exception("Saving image of chunk {}/{}/{} got exception".format(task["location"], task["name"], d["id"]))
-            raise
+@timeout(60 * 3)
+async def build_chunk_docs(task, chunks):
+    docs = []
+    for chunk in chunks:
+        d = {"doc_id": task["doc_id"], "kb_id": str(task["kb_id"])}
+        if task["pagerank"]:
+            d[PAGERANK_FLD] = int(task["pagerank"])
+        d.update(chunk)
+        d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
+        d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
+        d["create_timestamp_flt"] = datetime.now().timestamp()
+        if not d.get("image"):
+            _ = d.pop("image", None)
+            d["img_id"] = ""
+        docs.append(d)
+    images = sum(1 for d in docs if d.get("image"))
+    if not images:
+        return docs
+    try:
+        st = timer()
+        # The images of the batch go up together, see RAGFlowMinio.put_many.
+        await images2ids(docs, STORAGE_IMPL, [d["id"] for d in docs], task["kb_id"], tenant_id=task["tenant_id"])
+        logging.info("MINIO PUT({:.2f}s) {} images of {}".format(timer() - st, images, task["name"]))
+    except Exception:
+        logging.exception("Saving images of chunks {}/{} got exception".format(task["location"], task["name"]))
+        raise
+    return docs
 
-    async with trio.open_nursery() as nursery:
-        for ck in cks:
-            nursery.start_soon(upload_to_minio, doc, ck)
 
-    el = timer() - st
-    logging.info("MINIO PUT({}) cost {:.3f} s".format(task["name"], el))
+async def chunk_enricher(task, progress_callback):
+    """
+    Prepare keyword, question and tag generation for the task and return an async function
+    that enriches one chunk in place, or None if the parser config asks for none of them.
+    """
+    topn_keywords = task["parser_config"].get("auto_keywords", 0)
+    topn_questions = task["parser_config"].get("auto_questions", 0)
+    tag_kb_ids = task["kb_parser_config"].get("tag_kb_ids", [])
+    if not topn_keywords and not topn_questions and not tag_kb_ids:
+        return None
 
-    if task["parser_config"].get("auto_keywords", 0):
-        st = timer()
+    chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+    if topn_keywords:
         progress_callback(msg="Start to generate keywords for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def doc_keyword_extraction(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
-            if not cached:
-                async with chat_limiter:
-                    cached = await trio.to_thread.run_sync(lambda: keyword_extraction(chat_mdl, d["content_with_weight"], topn))
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords", {"topn": topn})
-            if cached:
-                d["important_kwd"] = cached.split(",")
-                d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
-            return
-
-        async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_keyword_extraction, chat_mdl, d, task["parser_config"]["auto_keywords"])
-        progress_callback(msg="Keywords generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
-
-    if task["parser_config"].get("auto_questions", 0):
-        st = timer()
+    if topn_questions:
         progress_callback(msg="Start to generate questions for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def doc_question_proposal(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
-            if not cached:
-                async with chat_limiter:
-                    cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, d["content_with_weight"], topn))
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question", {"topn": topn})
-            if cached:
-                d["question_kwd"] = cached.split("\n")
-                d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
 
-        async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_question_proposal, chat_mdl, d, task["parser_config"]["auto_questions"])
-        progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
-
-    if task["kb_parser_config"].get("tag_kb_ids", []):
+    tenant_id = task["tenant_id"]
+    topn_tags = task["kb_parser_config"].get("topn_tags", 3)
+    S = 1000
+    examples = []
+    all_tags = None
+    if tag_kb_ids:
         progress_callback(msg="Start to tag for every chunk ...")
-        kb_ids = task["kb_parser_config"]["tag_kb_ids"]
-        tenant_id = task["tenant_id"]
-        topn_tags = task["kb_parser_config"].get("topn_tags", 3)
-        S = 1000
-        st = timer()
-        examples = []
-        all_tags = get_tags_from_cache(kb_ids)
+        all_tags = get_tags_from_cache(tag_kb_ids)
         if not all_tags:
-            all_tags = settings.retriever.all_tags_in_portion(tenant_id, kb_ids, S)
-            set_tags_to_cache(kb_ids, all_tags)
+            all_tags = settings.retriever.all_tags_in_portion(tenant_id, tag_kb_ids, S)
+            set_tags_to_cache(tag_kb_ids, all_tags)
         else:
             all_tags = json.loads(all_tags)
 
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        docs_to_tag = []
-        for d in docs:
-            task_canceled = has_canceled(task["id"])
-            if task_canceled:
-                progress_callback(-1, msg="Task has been canceled.")
-                return
-            if settings.retriever.tag_content(tenant_id, kb_ids, d, all_tags, topn_tags=topn_tags, S=S) and len(d[TAG_FLD]) > 0:
-                examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
-            else:
-                docs_to_tag.append(d)
-
-        async def doc_content_tagging(chat_mdl, d, topn_tags):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
-            if not cached:
-                picked_examples = random.choices(examples, k=2) if len(examples) > 2 else examples
-                if not picked_examples:
-                    picked_examples.append({"content": "This is an example", TAG_FLD: {"example": 1}})
-                async with chat_limiter:
-                    cached = await trio.to_thread.run_sync(lambda: content_tagging(chat_mdl, d["content_with_weight"], all_tags, picked_examples, topn=topn_tags))
-                if cached:
-                    cached = json.dumps(cached)
+    async def doc_keyword_extraction(d, topn):
+        cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
+        if not cached:
+            async with chat_limiter:
+                cached = await trio.to_thread.run_sync(lambda: keyword_extraction(chat_mdl, d["content_with_weight"], topn))
+            set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords", {"topn": topn})
+        if cached:
+            d["important_kwd"] = cached.split(",")
+            d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
+
+    async def doc_question_proposal(d, topn):
+        cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
+        if not cached:
+            async with chat_limiter:
+                cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, d["content_with_weight"], topn))
+            set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question", {"topn": topn})
+        if cached:
+            d["question_kwd"] = cached.split("\n")
+            d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
+
+    async def doc_content_tagging(d, topn_tags):
+        tagged = await trio.to_thread.run_sync(lambda: settings.retriever.tag_content(tenant_id, tag_kb_ids, d, all_tags, topn_tags=topn_tags, S=S))
+        if tagged and len(d[TAG_FLD]) > 0:
+            examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
+            return
+        cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
+        if not cached:
+            picked_examples = random.choices(examples, k=2) if len(examples) > 2 else examples[:]
+            if not picked_examples:
+                picked_examples.append({"content": "This is an example", TAG_FLD: {"example": 1}})
+            async with chat_limiter:
+                cached = await trio.to_thread.run_sync(lambda: content_tagging(chat_mdl, d["content_with_weight"], all_tags, picked_examples, topn=topn_tags))
             if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
-                d[TAG_FLD] = json.loads(cached)
+                cached = json.dumps(cached)
+        if cached:
+            set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
+            d[TAG_FLD] = json.loads(cached)
+
+    async def enrich(d):
+        if topn_keywords:
+            await doc_keyword_extraction(d, topn_keywords)
+        if topn_questions:
+            await doc_question_proposal(d, topn_questions)
+        if tag_kb_ids:
+            await doc_content_tagging(d, topn_tags)
+        return d
 
-        async with trio.open_nursery() as nursery:
-            for d in docs_to_tag:
-                nursery.start_soon(doc_content_tagging, chat_mdl, d, topn_tags)
-        progress_callback(msg="Tagging {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+    return enrich
 
-    return docs
+
+async def run_chunk_pipeline(task, cks, embedding_model, progress_callback):
+    """
+    Stream the chunks of a task through build -> enrich -> embed -> index stages.
+
+    Stages are connected by bounded memory channels, so they overlap and a slow stage
+    holds back the ones feeding it instead of letting every chunk, image and vector of
+    the document pile up. Chunks are consumed from `cks` as they enter the pipeline.
+    Returns (chunk_ids, token_count, docs kept for the TOC), or None if indexing stopped
+    because the task was canceled or is gone.
+    """
+    task_id = task["id"]
+    total = len(cks)
+    enrich = await chunk_enricher(task, progress_callback)
+    keep_for_toc = task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False) and not task.get("toc_merge")
+    toc_docs = []
+    chunk_ids = []
+    token_count = 0
+    stopped = False
+    counters = {"build": 0, "enrich": 0, "embed": 0, "index": 0}
+    cache_stats = {"hits": 0, "lookups": 0}
+    start_ts = timer()
+    last_report = start_ts
+
+    def report(force=False):
+        nonlocal last_report
+        now = timer()
+        if not force and now - last_report < CHUNK_PIPELINE_REPORT_INTERVAL:
+            return
+        last_report = now
+        elapsed = max(now - start_ts, 1e-6)
+        stages = ", ".join("{} {} ({:.1f}/s)".format(stage, n, n / elapsed) for stage, n in counters.items() if stage != "enrich" or enrich)
+        if cache_stats["lookups"]:
+            stages += ", embedding cache hits {:.1%}".format(cache_stats["hits"] / cache_stats["lookups"])
+        progress_callback(prog=0.7 + 0.2 * counters["index"] / total, msg="Streaming {} chunks: {}".format(total, stages))
+
+    def index_callback(prog=None, msg=""):
+        # Overall progress is reported by the pipeline, only pass failures through.
+        if prog is not None and prog < 0:
+            progress_callback(prog, msg=msg)
+
+    async def feed(send):
+        async with send:
+            cks.reverse()
+            while cks:
+                await send.send(cks.pop())
+
+    async def map_stage(stage, fn, recv, send):
+        async with recv, send:
+            async for item in recv:
+                item = await fn(item)
+                counters[stage] += 1
+                await send.send(item)
+
+    async def build_stage(recv, send):
+        async with recv, send:
+            async for ck in recv:
+                # Whatever else is already queued joins the batch, a lone chunk is not held back.
+                batch = [ck]
+                while len(batch) < IMAGE_PUT_BATCH:
+                    try:
+                        batch.append(recv.receive_nowait())
+                    except (trio.WouldBlock, trio.EndOfChannel):
+                        break
+                for d in await build_chunk_docs(task, batch):
+                    counters["build"] += 1
+                    await send.send(d)
+
+    # Remote providers are fed larger groups, embed_dispatcher keeps several requests of a group in flight.
+    embed_workers, embed_group = 1, EMBEDDING_BATCH_SIZE
+    if not embed_dispatcher.is_local(embedding_model):
+        embed_workers, embed_group = 2, EMBEDDING_BATCH_SIZE * EMBEDDING_MAX_CONCURRENCY
+
+    async def embed_stage(recv, send, cancel_scope):
+        nonlocal stopped
+        async with recv, send:
+            batch = []
+            async for d in recv:
+                batch.append(d)
+                if len(batch) < embed_group:
+                    continue
+                if has_canceled(task_id):
+                    progress_callback(-1, msg="Task has been canceled.")
+                    stopped = True
+                    cancel_scope.cancel()
+                    return
+                await embed_batch(batch, send)
+                batch = []
+            if batch:
+                await embed_batch(batch, send)
+
+    async def embed_batch(batch, send):
+        nonlocal token_count
+        try:
+            c, _ = await embedding(batch, embedding_model, task["parser_config"], title_vts=title_vts, cache_stats=cache_stats)
+        except Exception as e:
+            error_message = "Generate embedding error:{}".format(str(e))
+            progress_callback(-1, error_message)
+            logging.exception(error_message)
+            raise
+        token_count += c
+        counters["embed"] += len(batch)
+        for d in batch:
+            await send.send(d)
+
+    async def index_stage(recv, cancel_scope):
+        nonlocal stopped
+        async with recv:
+            batch, size = [], 0
+            async for d in recv:
+                if keep_for_toc:
+                    toc_docs.append(d)
+                batch.append(d)
+                size += _payload_size(d)
+                if len(batch) < DOC_BULK_SIZE or size < DOC_BULK_BYTES:
+                    continue
+                if not await index_batch(batch):
+                    stopped = True
+                    cancel_scope.cancel()
+                    return
+                batch, size = [], 0
+            if batch and not await index_batch(batch):
+                stopped = True
+
+    async def index_batch(batch):
+        if not await insert_es(task_id, task["tenant_id"], task["kb_id"], batch, index_callback, chunk_ids=chunk_ids):
+            return False
+        counters["index"] += len(batch)
+        report()
+        return True
+
+    # The file name is the same for every chunk, its vector is encoded once.
+    title_vts, c = await trio.to_thread.run_sync(lambda: embedding_model.encode([cks[0].get("docnm_kwd", "Title")]))
+    token_count += c
+
+    async with trio.open_nursery() as nursery:
+        raw_send, raw_recv = trio.open_memory_channel(CHUNK_PIPELINE_BUFFER)
+        built_send, built_recv = trio.open_memory_channel(CHUNK_PIPELINE_BUFFER)
+        index_send, index_recv = trio.open_memory_channel(CHUNK_PIPELINE_BUFFER)
+
+        nursery.start_soon(feed, raw_send)
+        # Images are uploaded in batches, each runs its uploads concurrently. LLM calls are bounded by chat_limiter,
+        # enough workers to fill it.
+        async with raw_recv, built_send:
+            for _ in range(IMAGE_PUT_WORKERS):
+                nursery.start_soon(build_stage, raw_recv.clone(), built_send.clone())
+        embed_recv = built_recv
+        if enrich:
+            embed_send, embed_recv = trio.open_memory_channel(CHUNK_PIPELINE_BUFFER)
+            async with built_recv, embed_send:
+                for _ in range(int(chat_limiter.total_tokens)):
+                    nursery.start_soon(map_stage, "enrich", enrich, built_recv.clone(), embed_send.clone())
+        async with embed_recv, index_send:
+            for _ in range(embed_workers):
+                nursery.start_soon(embed_stage, embed_recv.clone(), index_send.clone(), nursery.cancel_scope)
+        nursery.start_soon(index_stage, index_recv, nursery.cancel_scope)
+
+    if stopped:
+        return None
+    report(force=True)
+    return chunk_ids, token_count, toc_docs
 
 
 def build_TOC(task, docs, progress_callback):
@@ -461,21 +627,40 @@ def build_TOC(task, docs, progress_callback):
         ii += 1
 
     if toc:
-        d = copy.deepcopy(docs[-1])
+        # Built field by field: in a separate TOC task the docs are loaded back from the doc store with only a few fields.
+        d = {"doc_id": task["doc_id"], "kb_id": str(task["kb_id"]), "docnm_kwd": task["name"], "img_id": ""}
+        if task["pagerank"]:
+            d[PAGERANK_FLD] = int(task["pagerank"])
+        for k, v in docs[-1].items():
+            if k in ("title_tks", "title_sm_tks", "position_int", "top_int") or re.match(r"q_[0-9]+_vec$", k):
+                d[k] = copy.deepcopy(v)
         d["content_with_weight"] = json.dumps(toc, ensure_ascii=False)
+        d["content_ltks"] = rag_tokenizer.tokenize(" ".join(str(t.get("title", "")) for t in toc))
+        d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
         d["toc_kwd"] = "toc"
         d["available_int"] = 0
         d["page_num_int"] = [100000000]
         d["id"] = xxhash.xxh64((d["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
+        d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
+        d["create_timestamp_flt"] = datetime.now().timestamp()
         return d
 
 
+def embedding_vector_size(mdl) -> int:
+    """Vector size of an embedding model, probed once per model in this process."""
+    model_id = QueryEmbeddingCache.model_id(mdl)
+    if model_id not in EMBEDDING_VECTOR_SIZES:
+        vts, _ = mdl.encode(["ok"])
+        EMBEDDING_VECTOR_SIZES[model_id] = len(vts[0])
+    return EMBEDDING_VECTOR_SIZES[model_id]
+
+
 def init_kb(row, vector_size: int):
     idxnm = search.index_name(row["tenant_id"])
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
+async def embedding(docs, mdl, parser_config=None, callback=None, title_vts=None, cache_stats=None):
     if parser_config is None:
         parser_config = {}
     tts, cnts = [], []
@@ -490,32 +675,50 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
-    if len(tts) == len(cnts):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0:1]))
-        tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
+    if title_vts is None:
+        title_vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0:1]))
         tk_count += c
+    title_vts = np.asarray(title_vts, dtype=np.float32)
 
     @timeout(60)
     def batch_encode(txts):
         nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length - 10) for c in txts])
-
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i : i + EMBEDDING_BATCH_SIZE]))
-        if len(cnts_) == 0:
-            cnts_ = vts
+        return mdl.encode(txts)
+
+    # Only the chunks whose text was never embedded by this model before go to the model.
+    cnts = [truncate(c, mdl.max_length - 10) for c in cnts]
+    cached = await trio.to_thread.run_sync(lambda: CHUNK_EMBED_CACHE.get_many(mdl, cnts))
+    # Batches are written in place, growing the result with np.concatenate copied it on every batch.
+    vects = np.empty((len(cnts), title_vts.shape[-1]), dtype=np.float32)
+    missed = []
+    for i, v in enumerate(cached):
+        if v is None:
+            missed.append(i)
         else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+            vects[i] = v
+    del cached
+    if cache_stats is not None:
+        cache_stats["hits"] += len(cnts) - len(missed)
+        cache_stats["lookups"] += len(cnts)
+    done = 0
+
+    def on_batch(idx, vts):
+        nonlocal done
+        vects[[missed[i] for i in idx]] = vts
+        done += len(idx)
+        if callback:
+            callback(prog=0.7 + 0.2 * done / len(missed), msg="")
+
+    if missed:
+        texts = [cnts[i] for i in missed]
+        tk_count += await embed_dispatcher.encode(mdl, texts, batch_encode, on_batch)
+        await trio.to_thread.run_sync(lambda: CHUNK_EMBED_CACHE.put_many(mdl, texts, vects[missed]))
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1)  # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
     title_w = float(filename_embd_weight)
-    vects = (title_w * tts + (1 - title_w) * cnts) if len(tts) == len(cnts) else cnts
+    vects *= 1 - title_w
+    vects += title_w * title_vts[0]
 
     assert len(vects) == len(docs)
     vector_size = 0
@@ -738,31 +941,105 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
-    for b in range(0, len(chunks), DOC_BULK_SIZE):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
+def _payload_size(chunk):
+    # Rough size of the chunk once serialized into a bulk request.
+    size = 0
+    for k, v in chunk.items():
+        size += len(k) + 8
+        if isinstance(v, str):
+            size += len(v.encode("utf-8"))
+        elif isinstance(v, (list, tuple, np.ndarray)):
+            size += 20 * len(v)
+        else:
+            size += 16
+    return size
+
+
+def bulk_batches(chunks):
+    """Split chunks into bulk requests of at least DOC_BULK_SIZE chunks and about DOC_BULK_BYTES each."""
+    batch, size = [], 0
+    for ck in chunks:
+        batch.append(ck)
+        size += _payload_size(ck)
+        if len(batch) >= DOC_BULK_SIZE and size >= DOC_BULK_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, chunk_ids=None):
+    """
+    Index chunks into the doc store and record their ids on the task. `chunk_ids` holds the ids
+    indexed by earlier calls for the same task, it is extended in place so that the task always
+    lists every chunk stored so far.
+    """
+    if chunk_ids is None:
+        chunk_ids = []
+    batches = list(bulk_batches(chunks))
+    inserted_count = 0
+    error_message = None
+    task_canceled = False
+    task_unknown = False
+    # How many of chunk_ids are already stored on the task, earlier calls recorded theirs.
+    recorded = len(chunk_ids)
+
+    async def insert_batch(i, cancel_scope):
+        nonlocal inserted_count, error_message, task_canceled, task_unknown, recorded
+        async with bulk_limiter:
+            if cancel_scope.cancel_called:
+                return
+            # Shielded so a batch that reached the doc store is always recorded, even if a sibling failed meanwhile.
+            with trio.CancelScope(shield=True):
+                doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(batches[i], search.index_name(task_tenant_id), task_dataset_id))
         if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[: b + DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
+            error_message = error_message or f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+            cancel_scope.cancel()
+            return
+        chunk_ids.extend(ck["id"] for ck in batches[i])
+        if cancel_scope.cancel_called:
+            return
+        if has_canceled(task_id):
+            task_canceled = True
+            cancel_scope.cancel()
+            return
+        inserted_count += len(batches[i])
+        progress_callback(prog=0.8 + 0.1 * inserted_count / len(chunks), msg="")
         try:
-            TaskService.update_chunk_ids(task_id, chunk_ids_str)
+            TaskService.update_chunk_ids(task_id, " ".join(chunk_ids))
+            recorded = len(chunk_ids)
         except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
-                    nursery.start_soon(delete_image, task_dataset_id, chunk_id)
-            progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
-            return
+            task_unknown = True
+            cancel_scope.cancel()
+
+    # Several bulk requests are in flight at once, bulk_limiter bounds them across all tasks.
+    try:
+        async with trio.open_nursery() as nursery:
+            for i in range(len(batches)):
+                nursery.start_soon(insert_batch, i, nursery.cancel_scope)
+    finally:
+        # Batches that completed after a sibling failed or the task was canceled are in the doc store too,
+        # record them on the task so re-runs and chunk reuse don't leave them orphaned.
+        if len(chunk_ids) > recorded and not task_unknown:
+            try:
+                TaskService.update_chunk_ids(task_id, " ".join(chunk_ids))
+            except DoesNotExist:
+                task_unknown = True
+
+    if error_message:
+        progress_callback(-1, msg=error_message)
+        raise Exception(error_message)
+    if task_canceled:
+        progress_callback(-1, msg="Task has been canceled.")
+        return
+    if task_unknown:
+        logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
+        async with trio.open_nursery() as nursery:
+            for chunk_id in chunk_ids:
+                nursery.start_soon(delete_image, task_dataset_id, chunk_id)
+        progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
+        return
     return True
 
 
@@ -791,73 +1068,26 @@ async def handle_survey_task(task):
         if has_canceled(task_id):
             raise TaskCanceledException("任务已取消")
 
-        # 阶段2: 获取每篇文献的完整内容 (10%)
-        set_progress(task_id, prog=0.10, msg="正在获取每篇文献的完整内容...")
-        PaperSurveyRecord.update(progress=0.10, progress_msg="正在获取完整内容").where(PaperSurveyRecord.id == survey_id).execute()
-
-        # 如果论文没有full_content，获取完整内容
-        updated_papers = []
-        for i, paper in enumerate(papers):
-            updated_paper = paper.copy()
-            if not updated_paper.get("full_content"):
-                # 获取文档完整内容
-                full_content = PaperSearchService._get_full_document_content(updated_paper.get("doc_id", ""), tenant_id, [updated_paper.get("kb_id", "")])
-                if full_content:
-                    updated_paper["full_content"] = full_content
-            updated_papers.append(updated_paper)
+        # 阶段2: 并发获取每篇文献的完整内容并生成简报 (10% - 60%)
+        set_progress(task_id, prog=0.10, msg="正在获取完整内容并生成每篇文献的简报...")
+        PaperSurveyRecord.update(progress=0.10, progress_msg="正在获取完整内容并生成简报").where(PaperSurveyRecord.id == survey_id).execute()
 
-        # 检查是否取消
-        if has_canceled(task_id):
-            raise TaskCanceledException("任务已取消")
+        def summary_progress(finished, total):
+            # 更新进度, 从10%到60%的进度范围
+            progress = 0.10 + (finished / total) * 0.50
+            set_progress(task_id, prog=progress, msg=f"已生成 {finished}/{total} 篇文献简报")
+            PaperSurveyRecord.update(progress=progress, progress_msg=f"生成简报 ({finished}/{total})").where(PaperSurveyRecord.id == survey_id).execute()
 
-        # 阶段3: 生成每篇文献的简报 (10% - 60%)
-        set_progress(task_id, prog=0.15, msg="正在生成每篇文献的简报...")
-        PaperSurveyRecord.update(progress=0.15, progress_msg="正在生成简报").where(PaperSurveyRecord.id == survey_id).execute()
-
-        # 生成每篇文献的简报
-        paper_summaries = []
-        total_papers = len(updated_papers)
-        for i, paper in enumerate(updated_papers):
-            # 更新进度
-            progress = 0.15 + (i / total_papers) * 0.45  # 从15%到60%的进度范围
-            set_progress(task_id, prog=progress, msg=f"正在生成第 {i+1}/{total_papers} 篇文献简报...")
-            PaperSurveyRecord.update(progress=progress, progress_msg=f"生成简报 ({i+1}/{total_papers})").where(PaperSurveyRecord.id == survey_id).execute()
-
-            # 检查是否取消
-            if has_canceled(task_id):
-                raise TaskCanceledException("任务已取消")
-
-            # 生成简报
-            summary = PaperSearchService.generate_paper_summary(paper, tenant_id)
-            paper_summaries.append({
-                "title": paper.get("title", "未知标题"),
-                "summary": summary
-            })
+        paper_summaries = await PaperSearchService.summarize_papers(papers, tenant_id, survey_limiter, summary_progress, partial(has_canceled, task_id))
 
         # 检查是否取消
         if has_canceled(task_id):
             raise TaskCanceledException("任务已取消")
 
-        # 阶段4: 构建综述提示词 (60% - 65%)
-        set_progress(task_id, prog=0.65, msg="正在基于简报构建综述提示词...")
-        PaperSurveyRecord.update(progress=0.65, progress_msg="正在构建综述提示词").where(PaperSurveyRecord.id == survey_id).execute()
-
-        # 基于简报构建综述生成提示词
-        survey_prompt = PaperSearchService._build_survey_prompt_from_summaries(paper_summaries)
-
-        # 检查是否取消
-        if has_canceled(task_id):
-            raise TaskCanceledException("任务已取消")
-
-        # 阶段5: 调用 LLM 生成综述 (65% - 90%)
-        set_progress(task_id, prog=0.70, msg="正在调用 LLM 生成综述...")
-
-        # 获取聊天模型
-        chat_mdl = LLMBundle(tenant_id, LLMType.CHAT)
-
-        # 准备消息
-        history = [{"role": "user", "content": survey_prompt}]
-        chat_params = {"temperature": 0.7, "max_tokens": 2048, "extra_body": {"enable_thinking": False}}
+        # 阶段3: 调用 LLM 生成综述 (60% - 90%)
+        # 论文较多时按主题聚类分章节并行生成，再合并为完整综述
+        set_progress(task_id, prog=0.65, msg="正在调用 LLM 生成综述...")
+        PaperSurveyRecord.update(progress=0.65, progress_msg="正在生成综述").where(PaperSurveyRecord.id == survey_id).execute()
 
         # 启动进度更新协程
         stop_progress_update = trio.Event()
@@ -882,8 +1112,7 @@ async def handle_survey_task(task):
             # 启动进度更新协程
             nursery.start_soon(update_llm_progress)
 
-            # 实际调用 LLM（在线程中执行以避免阻塞）
-            survey_content = await trio.to_thread.run_sync(lambda: chat_mdl.chat("", history, chat_params))
+            survey_content = await PaperSearchService.compose_survey(paper_summaries, tenant_id, survey_limiter, lambda msg: set_progress(task_id, msg=msg))
 
             # 停止进度更新
             stop_progress_update.set()
@@ -892,7 +1121,7 @@ async def handle_survey_task(task):
         if has_canceled(task_id):
             raise TaskCanceledException("任务已取消")
 
-        # 阶段6: 保存结果 (95% - 100%)
+        # 阶段4: 保存结果 (95% - 100%)
         set_progress(task_id, prog=0.95, msg="正在保存综述结果...")
 
         # 计算处理耗时
@@ -962,7 +1191,6 @@ async def do_handle_task(task):
     task_dataset_id = task["kb_id"]
     task_doc_id = task["doc_id"]
     task_document_name = task["name"]
-    task_parser_config = task["parser_config"]
     task_start_ts = timer()
     toc_thread = None
     executor = concurrent.futures.ThreadPoolExecutor()
@@ -985,8 +1213,7 @@ async def do_handle_task(task):
     try:
         # bind embedding model
         embedding_model = LLMBundle(task_tenant_id, LLMType.EMBEDDING, llm_name=task_embedding_id, lang=task_language)
-        vts, _ = embedding_model.encode(["ok"])
-        vector_size = len(vts[0])
+        vector_size = embedding_vector_size(embedding_model)
     except Exception as e:
         error_message = f"Fail to bind embedding model: {str(e)}"
         progress_callback(-1, msg=error_message)
@@ -1036,6 +1263,14 @@ async def do_handle_task(task):
                 callback=progress_callback,
                 doc_ids=task.get("doc_ids", []),
             )
+        chunk_count = len(set([chunk["id"] for chunk in chunks]))
+        start_ts = timer()
+        e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback)
+        if not e:
+            return
+        logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page, task_to_page, len(chunks), timer() - start_ts))
+        DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, chunk_count, 0)
+        progress_callback(msg="Indexing done ({:.2f}s).".format(timer() - start_ts))
     # Either using graphrag or Standard chunking methods
     elif task_type == "graphrag":
         ok, kb = KnowledgebaseService.get_by_id(task_dataset_id)
@@ -1089,53 +1324,54 @@ async def do_handle_task(task):
         progress_callback(1, "place holder")
         pass
         return
+    elif task_type == "toc":
+        # Every page range of the document is indexed, build its TOC over all of their chunks.
+        start_ts = timer()
+        chunk_ids, chunk_count, token_count = [], 0, 0
+        fields = ["content_with_weight", "doc_id", "kb_id", "docnm_kwd", "title_tks", "title_sm_tks", "page_num_int", "position_int", "top_int", "q_%d_vec" % vector_size]
+        # 10000 is the largest result window of the doc stores. Chunks are paged in position order,
+        # so a longer document gets the TOC of its leading part rather than of an arbitrary subset.
+        max_count = 10000
+        docs = await trio.to_thread.run_sync(lambda: list(settings.retriever.iter_chunks(task_doc_id, task_tenant_id, [task_dataset_id], max_count=max_count, fields=fields, sort_by_position=True, page_size=1000)))
+        logging.info("Load {} chunks of doc({}) for the TOC: {:.2f}s".format(len(docs), task_document_name, timer() - start_ts))
+        if len(docs) >= max_count:
+            logging.warning("Doc({}) has more than {} chunks, its TOC only covers the first {} of them".format(task_document_name, max_count, max_count))
+            progress_callback(msg="Too many chunks, the table of content only covers the first {}.".format(max_count))
+        if docs:
+            toc_thread = executor.submit(build_TOC, task, docs, progress_callback)
     else:
         # Standard chunking methods
         start_ts = timer()
-        chunks = await build_chunks(task, progress_callback)
-        logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
-        if not chunks:
+        cks = await chunk_document(task, progress_callback)
+        logging.info("Chunk document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
+        if not cks:
             progress_callback(1.0, msg=f"No chunk built from {task_document_name}")
             return
-        progress_callback(msg="Generate {} chunks".format(len(chunks)))
+        progress_callback(msg="Generate {} chunks".format(len(cks)))
         start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
-        if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
-            toc_thread = executor.submit(build_TOC, task, chunks, progress_callback)
-
-    chunk_count = len(set([chunk["id"] for chunk in chunks]))
-    start_ts = timer()
-    e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback)
-    if not e:
-        return
-
-    logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page, task_to_page, len(chunks), timer() - start_ts))
-
-    DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, chunk_count, 0)
+        # Chunks are built, enriched, embedded and indexed as they stream through the pipeline.
+        res = await run_chunk_pipeline(task, cks, embedding_model, progress_callback)
+        if res is None:
+            return
+        chunk_ids, token_count, toc_docs = res
+        chunk_count = len(set(chunk_ids))
+        logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page, task_to_page, len(chunk_ids), timer() - start_ts))
+        DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, chunk_count, 0)
+        progress_callback(msg="Indexing done ({:.2f}s).".format(timer() - start_ts))
+        if toc_docs:
+            toc_thread = executor.submit(build_TOC, task, toc_docs, progress_callback)
 
-    time_cost = timer() - start_ts
-    progress_callback(msg="Indexing done ({:.2f}s).".format(time_cost))
     if toc_thread:
         d = toc_thread.result()
         if d:
-            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback)
+            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback, chunk_ids=chunk_ids)
             if not e:
                 return
             DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, 1, 0)
 
     task_time_cost = timer() - task_start_ts
     progress_callback(prog=1.0, msg="Task done ({:.2f}s)".format(task_time_cost))
-    logging.info("Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page, task_to_page, len(chunks), token_count, task_time_cost))
+    logging.info("Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page, task_to_page, chunk_count, token_count, task_time_cost))
 
 
 async def handle_task():
@@ -1184,10 +1420,10 @@ async def report_status():
     while True:
         try:
             now = datetime.now()
-            group_info = REDIS_CONN.queue_info(get_svr_queue_name(0), SVR_CONSUMER_GROUP_NAME)
-            if group_info is not None:
-                PENDING_TASKS = int(group_info.get("pending", 0))
-                LAG_TASKS = int(group_info.get("lag", 0))
+            queue_stats = svr_queue_stats()
+            PENDING_TASKS = queue_stats["priorities"].get(0, {}).get("pending", 0)
+            LAG_TASKS = queue_stats["priorities"].get(0, {}).get("lag", 0)
+            tenant_lag = {tenant_id: t["lag"] for tenant_id, t in queue_stats["tenants"].items() if t["lag"]}
 
             current = copy.deepcopy(CURRENT_TASKS)
             heartbeat = json.dumps(
@@ -1197,6 +1433,8 @@ async def report_status():
                     "boot_at": BOOT_AT,
                     "pending": PENDING_TASKS,
                     "lag": LAG_TASKS,
+                    "tenant_lag": tenant_lag,
+                    "buffered": TASK_SCHEDULER.buffered(),
                     "done": DONE_TASKS,
                     "failed": FAILED_TASKS,
                     "current": current,
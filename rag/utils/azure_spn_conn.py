@@ -86,6 +86,37 @@ class RAGFlowAzureSpnBlob:
                 time.sleep(1)
         return
 
+    def open_stream(self, bucket, fnm, chunk_size=1024 * 1024):
+        """Iterate over the file in chunks instead of reading it whole."""
+        try:
+            return self.conn.get_file_client(fnm).download_file(max_concurrency=1).chunks()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm}")
+        return None
+
+    def get_range(self, bucket, fnm, start, end=None):
+        """Bytes [start, end) of the file, up to its end when `end` is None."""
+        try:
+            client = self.conn.get_file_client(fnm)
+            return client.download_file(offset=start, length=end - start if end is not None else None).readall()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} [{start}, {end})")
+        return None
+
+    def size(self, bucket, fnm):
+        try:
+            return self.conn.get_file_client(fnm).get_file_properties().size
+        except Exception as e:
+            logging.warning(f"fail stat {bucket}/{fnm}: {e}")
+        return None
+
+    def etag(self, bucket, fnm):
+        try:
+            return self.conn.get_file_client(fnm).get_file_properties().etag
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+        return None
+
     def obj_exist(self, bucket, fnm):
         try:
             client = self.conn.get_file_client(fnm)
@@ -0,0 +1,133 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import xxhash
+
+from rag.settings import CHUNK_EMBED_CACHE_PATH, CHUNK_EMBED_CACHE_MAX_BYTES
+from rag.utils.query_embed_cache import QueryEmbeddingCache
+
+
+class ChunkEmbeddingCache:
+    """
+    Node-local, content-addressed cache of chunk embeddings kept in a SQLite file.
+
+    Entries are keyed by (`QueryEmbeddingCache.model_id`, the exact text sent to the
+    model), which scopes them per tenant, model and endpoint, so re-parsing a
+    document with another chunking config or page range only encodes the chunks
+    whose text changed. Vectors are stored as little-endian float32 and
+    the least recently used entries are evicted once the file holds more than
+    `max_bytes` of vectors. Several task executors on a node can share the file.
+    """
+
+    EVICT_CHECK_EVERY = 1024
+
+    def __init__(self, path=CHUNK_EMBED_CACHE_PATH, max_bytes=CHUNK_EMBED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+        self._puts_since_check = 0
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embd (k TEXT PRIMARY KEY, v BLOB NOT NULL, atime REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS embd_atime ON embd (atime)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(model_id, txt):
+        hasher = xxhash.xxh128()
+        hasher.update(model_id.encode("utf-8"))
+        hasher.update(b"\0")
+        hasher.update(txt.encode("utf-8", "surrogatepass"))
+        return hasher.hexdigest()
+
+    def get_many(self, emb_mdl, txts: list[str]) -> list:
+        """Return the cached vector of every text, or None where it is not cached."""
+        if not self.enabled or not txts:
+            return [None] * len(txts)
+        model_id = QueryEmbeddingCache.model_id(emb_mdl)
+        keys = [self._key(model_id, t) for t in txts]
+        found = {}
+        try:
+            with self._lock:
+                conn = self._connect()
+                for i in range(0, len(keys), 500):
+                    part = list(set(keys[i: i + 500]))
+                    marks = ",".join("?" * len(part))
+                    for k, v in conn.execute(f"SELECT k, v FROM embd WHERE k IN ({marks})", part):
+                        found[k] = np.frombuffer(v, dtype="<f4").astype(np.float32)
+                    conn.execute(f"UPDATE embd SET atime=? WHERE k IN ({marks})", [time.time()] + part)
+        except Exception:
+            logging.exception("ChunkEmbeddingCache.get_many failed to read {}".format(self.path))
+        res = [found.get(k) for k in keys]
+        hits = sum(1 for v in res if v is not None)
+        with self._lock:
+            self._stats["hits"] += hits
+            self._stats["misses"] += len(res) - hits
+        return res
+
+    def put_many(self, emb_mdl, txts: list[str], vectors):
+        if not self.enabled or not txts:
+            return
+        model_id = QueryEmbeddingCache.model_id(emb_mdl)
+        now = time.time()
+        rows = [(self._key(model_id, t), np.asarray(v, dtype="<f4").tobytes(), now) for t, v in zip(txts, vectors)]
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.executemany("INSERT OR REPLACE INTO embd (k, v, atime) VALUES (?, ?, ?)", rows)
+                self._puts_since_check += len(rows)
+                if self._puts_since_check >= self.EVICT_CHECK_EVERY:
+                    self._puts_since_check = 0
+                    self._evict(conn)
+        except Exception:
+            logging.exception("ChunkEmbeddingCache.put_many failed to write {}".format(self.path))
+
+    def _evict(self, conn):
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(v)), 0) FROM embd").fetchone()
+        if total <= self.max_bytes or not count:
+            return
+        # Drop the least recently used entries down to 90% of the budget.
+        n = int(count * (1 - 0.9 * self.max_bytes / total)) + 1
+        conn.execute("DELETE FROM embd WHERE k IN (SELECT k FROM embd ORDER BY atime LIMIT ?)", (n,))
+        logging.info("ChunkEmbeddingCache evicted {} of {} entries from {}".format(n, count, self.path))
+
+    def stats(self) -> dict:
+        with self._lock:
+            res = dict(self._stats)
+        lookups = res["hits"] + res["misses"]
+        res["hit_ratio"] = round(res["hits"] / lookups, 4) if lookups else 0.0
+        return res
+
+
+CHUNK_EMBED_CACHE = ChunkEmbeddingCache()
@@ -0,0 +1,166 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+import re
+
+import trio
+
+from rag.settings import EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS, EMBEDDING_INITIAL_CONCURRENCY, EMBEDDING_MAX_CONCURRENCY
+from rag.utils import num_tokens_from_string
+from rag.utils.query_embed_cache import QueryEmbeddingCache
+
+# Models running inside this process, they are bound by local compute rather than by round trips.
+LOCAL_EMBEDDING_MODELS = {"DefaultEmbedding", "FastEmbed", "YoudaoEmbed"}
+THROTTLED_STATUS = {429, 503, 504}
+# Status codes only count where the error text names them as such, a bare 503 may be part of anything.
+THROTTLED = re.compile(
+    r"(rate.?limit|too many requests|overloaded|service unavailable|timed? ?out|timeout"
+    r"|(status|error)[ _]?code\W{0,3}(429|503|504)\b|\bhttp(/[0-9.]+)? (429|503|504)\b)",
+    re.IGNORECASE,
+)
+# Out of quota or credit: retrying can't help, and it must not shrink the window of requests in flight.
+PERMANENT = re.compile(r"(insufficient.?quota|exceeded your current quota|billing|payment required|arrearage|account (is )?(suspended|deactivated|disabled))", re.IGNORECASE)
+
+
+def is_throttled(e: Exception) -> bool:
+    """Whether `e` is a transient throttling error, worth retrying with fewer requests in flight."""
+    txt = f"{type(e).__name__} {e}"
+    if PERMANENT.search(txt):
+        return False
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in THROTTLED_STATUS
+    return bool(THROTTLED.search(txt))
+
+
+class _ProviderSlots:
+    """
+    Requests in flight to one provider, sized by additive increase / multiplicative decrease:
+    one more slot after a full round of successes, half of them on a throttling response.
+    Growth stops one below the size that got throttled, that ceiling is probed again
+    after a quiet period.
+    """
+
+    PROBE_AFTER = 30
+
+    def __init__(self, initial, maximum):
+        self.limiter = trio.CapacityLimiter(initial)
+        self.ceiling = maximum
+        self.maximum = maximum
+        self.successes = 0
+        self.last_decrease = None
+
+    def on_success(self):
+        self.successes += 1
+        if self.successes < self.limiter.total_tokens:
+            return
+        self.successes = 0
+        if self.ceiling < self.maximum and self.last_decrease is not None and trio.current_time() - self.last_decrease > self.PROBE_AFTER:
+            self.ceiling += 1
+            self.last_decrease = trio.current_time()
+        if self.limiter.total_tokens < self.ceiling:
+            self.limiter.total_tokens += 1
+
+    def on_throttled(self):
+        self.successes = 0
+        # Requests that were already in flight fail together, shrink once for all of them.
+        now = trio.current_time()
+        if self.last_decrease is not None and now - self.last_decrease < 1:
+            return
+        self.last_decrease = now
+        self.ceiling = max(1, self.limiter.total_tokens - 1)
+        self.limiter.total_tokens = max(1, self.limiter.total_tokens // 2)
+
+
+class EmbeddingDispatcher:
+    """
+    Spread the texts of a document over several concurrent `encode` calls.
+
+    Remote providers are latency bound, so their texts are cut into batches of about
+    EMBEDDING_BATCH_TOKENS tokens and up to EMBEDDING_MAX_CONCURRENCY batches per
+    (tenant, model) are kept in flight, adapting to 429s and timeouts. Local models
+    keep sending EMBEDDING_BATCH_SIZE texts at a time under `local_limiter`.
+    """
+
+    def __init__(self, local_limiter, max_retries=5):
+        self.local_limiter = local_limiter
+        self.max_retries = max_retries
+        self._providers = {}
+
+    @staticmethod
+    def is_local(mdl) -> bool:
+        return type(getattr(mdl, "mdl", mdl)).__name__ in LOCAL_EMBEDDING_MODELS
+
+    def _slots(self, mdl):
+        k = (getattr(mdl, "tenant_id", None), QueryEmbeddingCache.model_id(mdl))
+        if k not in self._providers:
+            self._providers[k] = _ProviderSlots(EMBEDDING_INITIAL_CONCURRENCY, EMBEDDING_MAX_CONCURRENCY)
+        return self._providers[k]
+
+    @staticmethod
+    def batches(texts, max_tokens=EMBEDDING_BATCH_TOKENS, max_count=EMBEDDING_BATCH_SIZE):
+        """Yield lists of text positions holding at most max_tokens tokens, or a single longer text."""
+        batch, tokens = [], 0
+        for i, txt in enumerate(texts):
+            n = num_tokens_from_string(txt)
+            if batch and (tokens + n > max_tokens or len(batch) >= max_count):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(i)
+            tokens += n
+        if batch:
+            yield batch
+
+    async def encode(self, mdl, texts, encode_fn, on_batch):
+        """
+        Encode `texts` with `encode_fn(list of texts) -> (vectors, tokens)` run in worker threads.
+        `on_batch(positions, vectors)` is called as each batch completes, in completion order.
+        Returns the number of tokens used.
+        """
+        token_count = 0
+        if self.is_local(mdl):
+            for b in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+                idx = list(range(b, min(b + EMBEDDING_BATCH_SIZE, len(texts))))
+                async with self.local_limiter:
+                    vts, c = await trio.to_thread.run_sync(lambda: encode_fn([texts[i] for i in idx]))
+                token_count += c
+                on_batch(idx, vts)
+            return token_count
+
+        slots = self._slots(mdl)
+
+        async def send(idx):
+            nonlocal token_count
+            for attempt in range(self.max_retries + 1):
+                try:
+                    async with slots.limiter:
+                        vts, c = await trio.to_thread.run_sync(lambda: encode_fn([texts[i] for i in idx]))
+                except Exception as e:
+                    if attempt == self.max_retries or not is_throttled(e):
+                        raise
+                    slots.on_throttled()
+                    logging.warning("EmbeddingDispatcher throttled by {}, {} requests in flight: {}".format(QueryEmbeddingCache.model_id(mdl), slots.limiter.total_tokens, e))
+                    await trio.sleep(min(2 ** attempt, 30))
+                    continue
+                slots.on_success()
+                token_count += c
+                on_batch(idx, vts)
+                return
+
+        async with trio.open_nursery() as nursery:
+            for idx in self.batches(texts):
+                nursery.start_soon(send, idx)
+        return token_count
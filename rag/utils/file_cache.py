@@ -0,0 +1,205 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import xxhash
+
+from rag.settings import FILE_CACHE_PATH, FILE_CACHE_MAX_BYTES
+from rag.utils.storage_factory import STORAGE_IMPL
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LocalFileCache:
+    """
+    Node-local, size-bounded disk cache in front of the storage backend.
+
+    An object is kept as one file named by its (bucket, name) and etag, so an object uploaded
+    again is fetched again and its older copy dropped. Fetches are single-flight: concurrent
+    callers wait for the first one, within a process on a striped lock and across the task
+    executors of a node on a lock file, so the page range tasks of one PDF download it once.
+    The least recently used files are evicted once the directory holds more than `max_bytes`.
+    Objects are streamed to disk, never held whole in memory while fetched. Backends without
+    `etag` or `open_stream` are read through uncached.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, storage, root=FILE_CACHE_PATH, max_bytes=FILE_CACHE_MAX_BYTES):
+        self.storage = storage
+        self.root = root
+        self.max_bytes = max_bytes
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _key(bucket, name):
+        return xxhash.xxh128(f"{bucket}/{name}".encode("utf-8", "surrogatepass")).hexdigest()
+
+    def _count(self, hit):
+        with self._stats_lock:
+            self._stats["hits" if hit else "misses"] += 1
+
+    @staticmethod
+    def _touch(fnm) -> bool:
+        try:
+            os.utime(fnm)
+            return True
+        except OSError:
+            return False
+
+    @contextmanager
+    def _single_flight(self, key):
+        with self._locks[int(key[:8], 16) % self.LOCK_STRIPES]:
+            if fcntl is None:
+                yield
+                return
+            lock_dir = os.path.join(self.root, "locks")
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(os.path.join(lock_dir, key), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def path(self, bucket, name) -> str | None:
+        """Local path of the object, fetched on a miss. None when it can't be cached."""
+        if not self.enabled or not hasattr(self.storage, "etag") or not hasattr(self.storage, "open_stream"):
+            return None
+        etag = self.storage.etag(bucket, name)
+        if not etag:
+            return None
+        key = self._key(bucket, name)
+        obj_dir = os.path.join(self.root, key[:2], key)
+        fnm = os.path.join(obj_dir, xxhash.xxh64(str(etag).encode("utf-8")).hexdigest())
+        if self._touch(fnm):
+            self._count(True)
+            return fnm
+        with self._single_flight(key):
+            if self._touch(fnm):
+                self._count(True)
+                return fnm
+            chunks = self.storage.open_stream(bucket, name)
+            if chunks is None:
+                return None
+            self._count(False)
+            os.makedirs(obj_dir, exist_ok=True)
+            tmp = "{}.{}.{}.tmp".format(fnm, os.getpid(), threading.get_ident())
+            try:
+                with open(tmp, "wb") as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            except Exception:
+                self._remove(tmp)
+                raise
+            os.replace(tmp, fnm)
+            for other in os.listdir(obj_dir):
+                if os.path.join(obj_dir, other) != fnm and not other.endswith(".tmp"):
+                    self._remove(os.path.join(obj_dir, other))
+        self._evict()
+        return fnm
+
+    def get(self, bucket, name):
+        try:
+            fnm = self.path(bucket, name)
+            if fnm:
+                with open(fnm, "rb") as f:
+                    return f.read()
+        except Exception:
+            # Evicted by another executor in between, or the disk is full: read it from the backend.
+            logging.exception("LocalFileCache.get {}/{} fell back to the storage backend".format(bucket, name))
+        return self.storage.get(bucket, name)
+
+    def put(self, bucket, name, binary, **kwargs):
+        self.drop(bucket, name)
+        return self.storage.put(bucket, name, binary, **kwargs)
+
+    def rm(self, bucket, name, **kwargs):
+        self.drop(bucket, name)
+        return self.storage.rm(bucket, name, **kwargs)
+
+    def drop(self, bucket, name):
+        key = self._key(bucket, name)
+        shutil.rmtree(os.path.join(self.root, key[:2], key), ignore_errors=True)
+
+    @staticmethod
+    def _remove(fnm):
+        try:
+            os.remove(fnm)
+        except OSError:
+            pass
+
+    def _evict(self):
+        files, total = [], 0
+        for top, _, names in os.walk(self.root):
+            if os.path.basename(top) == "locks":
+                continue
+            for nm in names:
+                if nm.endswith(".tmp"):
+                    continue
+                fnm = os.path.join(top, nm)
+                try:
+                    st = os.stat(fnm)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, fnm))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        # Drop the least recently used files down to 90% of the budget.
+        files.sort()
+        n = 0
+        for _, size, fnm in files:
+            if total <= 0.9 * self.max_bytes:
+                break
+            self._remove(fnm)
+            try:
+                os.rmdir(os.path.dirname(fnm))
+            except OSError:
+                pass
+            total -= size
+            n += 1
+        logging.info("LocalFileCache evicted {} of {} files from {}".format(n, len(files), self.root))
+        # Lock files of objects no longer cached.
+        lock_dir = os.path.join(self.root, "locks")
+        for nm in os.listdir(lock_dir) if os.path.isdir(lock_dir) else []:
+            fnm = os.path.join(lock_dir, nm)
+            if not os.path.isdir(os.path.join(self.root, nm[:2], nm)) and time.time() - os.path.getmtime(fnm) > 3600:
+                self._remove(fnm)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            res = dict(self._stats)
+        lookups = res["hits"] + res["misses"]
+        res["hit_ratio"] = round(res["hits"] / lookups, 4) if lookups else 0.0
+        return res
+
+
+FILE_CACHE = LocalFileCache(STORAGE_IMPL)
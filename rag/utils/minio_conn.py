@@ -15,7 +15,11 @@
 #
 
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
 from minio import Minio
 from minio.commonconfig import CopySource
 from minio.error import S3Error
@@ -28,6 +32,10 @@ from rag.utils import singleton
 class RAGFlowMinio:
     def __init__(self):
         self.conn = None
+        # Buckets known to exist, so a put doesn't ask MinIO first every time.
+        self.buckets = set()
+        self._put_pool = None
+        self._put_pool_lock = threading.Lock()
         self.__open__()
 
     def __open__(self):
@@ -41,7 +49,12 @@ class RAGFlowMinio:
             self.conn = Minio(settings.MINIO["host"],
                               access_key=settings.MINIO["user"],
                               secret_key=settings.MINIO["password"],
-                              secure=False
+                              secure=False,
+                              http_client=urllib3.PoolManager(
+                                  timeout=urllib3.Timeout(connect=settings.MINIO_CONNECT_TIMEOUT, read=settings.MINIO_READ_TIMEOUT),
+                                  maxsize=settings.MINIO_MAX_CONNECTIONS,
+                                  retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+                              )
                               )
         except Exception:
             logging.exception(
@@ -61,22 +74,52 @@ class RAGFlowMinio:
                                  )
         return r
 
+    def ensure_bucket(self, bucket):
+        if bucket in self.buckets:
+            return
+        if not self.conn.bucket_exists(bucket):
+            try:
+                self.conn.make_bucket(bucket)
+            except S3Error as e:
+                if e.code not in ["BucketAlreadyOwnedByYou", "BucketAlreadyExists"]:
+                    raise
+        self.buckets.add(bucket)
+
     def put(self, bucket, fnm, binary, tenant_id=None):
         for _ in range(3):
             try:
-                if not self.conn.bucket_exists(bucket):
-                    self.conn.make_bucket(bucket)
-
+                self.ensure_bucket(bucket)
+                if len(binary) >= settings.MINIO_MULTIPART_THRESHOLD:
+                    return self.conn.put_object(bucket, fnm,
+                                                BytesIO(binary),
+                                                len(binary),
+                                                part_size=settings.MINIO_PART_SIZE,
+                                                num_parallel_uploads=settings.MINIO_PARALLEL_PARTS
+                                                )
                 r = self.conn.put_object(bucket, fnm,
                                          BytesIO(binary),
                                          len(binary)
                                          )
                 return r
-            except Exception:
+            except Exception as e:
+                if isinstance(e, S3Error) and e.code == "NoSuchBucket":
+                    self.buckets.discard(bucket)
                 logging.exception(f"Fail to put {bucket}/{fnm}:")
                 self.__open__()
                 time.sleep(1)
 
+    def put_many(self, bucket, items, tenant_id=None):
+        """
+        Put [(fnm, binary), ...] into one bucket, up to MINIO_MAX_CONNECTIONS of them at once
+        over the pooled connections. Returns the result of each put, None where it failed.
+        """
+        if not items:
+            return []
+        with self._put_pool_lock:
+            if self._put_pool is None:
+                self._put_pool = ThreadPoolExecutor(max_workers=settings.MINIO_MAX_CONNECTIONS, thread_name_prefix="minio_put")
+        return list(self._put_pool.map(lambda it: self.put(bucket, it[0], it[1], tenant_id), items))
+
     def rm(self, bucket, fnm, tenant_id=None):
         try:
             self.conn.remove_object(bucket, fnm)
@@ -94,9 +137,52 @@ class RAGFlowMinio:
                 time.sleep(1)
         return
 
+    def open_stream(self, bucket, filename, chunk_size=1024 * 1024, tenant_id=None):
+        """Iterate over the object in chunks of up to `chunk_size` bytes instead of reading it whole."""
+        try:
+            r = self.conn.get_object(bucket, filename)
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename}")
+            return None
+
+        def chunks():
+            try:
+                yield from r.stream(chunk_size)
+            finally:
+                r.close()
+                r.release_conn()
+        return chunks()
+
+    def get_range(self, bucket, filename, start, end=None, tenant_id=None):
+        """Bytes [start, end) of the object, up to its end when `end` is None."""
+        try:
+            r = self.conn.get_object(bucket, filename, offset=start, length=end - start if end is not None else 0)
+            try:
+                return r.read()
+            finally:
+                r.close()
+                r.release_conn()
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename} [{start}, {end})")
+        return None
+
+    def size(self, bucket, filename, tenant_id=None):
+        try:
+            return self.conn.stat_object(bucket, filename).size
+        except Exception as e:
+            logging.warning(f"Fail to stat {bucket}/{filename}: {e}")
+        return None
+
+    def etag(self, bucket, filename, tenant_id=None):
+        try:
+            return self.conn.stat_object(bucket, filename).etag
+        except Exception:
+            logging.exception(f"Fail to stat {bucket}/{filename}")
+        return None
+
     def obj_exist(self, bucket, filename, tenant_id=None):
         try:
-            if not self.conn.bucket_exists(bucket):
+            if bucket not in self.buckets and not self.conn.bucket_exists(bucket):
                 return False
             if self.conn.stat_object(bucket, filename):
                 return True
@@ -139,13 +225,13 @@ class RAGFlowMinio:
                 for obj in objects_to_delete:
                     self.conn.remove_object(bucket, obj.object_name)
                 self.conn.remove_bucket(bucket)
+            self.buckets.discard(bucket)
         except Exception:
             logging.exception(f"Fail to remove bucket {bucket}")
 
     def copy(self, src_bucket, src_path, dest_bucket, dest_path):
         try:
-            if not self.conn.bucket_exists(dest_bucket):
-                self.conn.make_bucket(dest_bucket)
+            self.ensure_bucket(dest_bucket)
 
             try:
                 self.conn.stat_object(src_bucket, src_path)
@@ -78,6 +78,41 @@ class OpenDALStorage:
     def scan(self, bucket, fnm):
         return self._operator.scan(f"{bucket}/{fnm}")
 
+    def open_stream(self, bucket, fnm, chunk_size=1024 * 1024):
+        """Iterate over the object in chunks of up to `chunk_size` bytes instead of reading it whole."""
+        f = self._operator.open(f"{bucket}/{fnm}", "rb")
+
+        def chunks():
+            try:
+                while True:
+                    b = f.read(chunk_size)
+                    if not b:
+                        break
+                    yield b
+            finally:
+                f.close()
+        return chunks()
+
+    def get_range(self, bucket, fnm, start, end=None):
+        """Bytes [start, end) of the object, up to its end when `end` is None."""
+        with self._operator.open(f"{bucket}/{fnm}", "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start)
+
+    def size(self, bucket, fnm):
+        try:
+            return self._operator.stat(f"{bucket}/{fnm}").content_length
+        except Exception as e:
+            logging.warning(f"fail stat {bucket}/{fnm}: {e}")
+        return None
+
+    def etag(self, bucket, fnm):
+        try:
+            return self._operator.stat(f"{bucket}/{fnm}").etag
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+        return None
+
     def obj_exist(self, bucket, fnm):
         return self._operator.exists(f"{bucket}/{fnm}")
 
@@ -287,38 +287,48 @@ class OSConnection(DocStoreConnection):
 
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
-        operations = []
+        # Documents are only shallow copied, the bulk body is serialized before anything could mutate them.
+        pending = {}
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
-            meta_id = d_copy.pop("id", "")
-            operations.append(
-                {"index": {"_index": indexName, "_id": meta_id}})
-            operations.append(d_copy)
+            pending[d["id"]] = {k: v for k, v in d.items() if k != "id"}
 
         res = []
-        for _ in range(ATTEMPT_TIME):
+        for attempt in range(ATTEMPT_TIME):
+            if attempt:
+                time.sleep(attempt)
+            operations = []
+            for meta_id, d_copy in pending.items():
+                operations.append({"index": {"_index": indexName, "_id": meta_id}})
+                operations.append(d_copy)
             try:
-                res = []
                 r = self.os.bulk(index=(indexName), body=operations,
                                  refresh=False, timeout=60)
-                if re.search(r"False", str(r["errors"]), re.IGNORECASE):
-                    return res
-
-                for item in r["items"]:
-                    for action in ["create", "delete", "index", "update"]:
-                        if action in item and "error" in item[action]:
-                            res.append(str(item[action]["_id"]) + ":" + str(item[action]["error"]))
-                return res
             except Exception as e:
-                res.append(str(e))
                 logger.warning("OSConnection.insert got exception: " + str(e))
-                res = []
+                res = [str(e)]
                 if re.search(r"(Timeout|time out)", str(e), re.IGNORECASE):
-                    res.append(str(e))
                     time.sleep(3)
-                    continue
+                continue
+            res = []
+            if not r["errors"]:
+                return res
+
+            # Only resend the items rejected for transient reasons, e.g. a full write queue.
+            retry = {}
+            for item in r["items"]:
+                for action in ["create", "delete", "index", "update"]:
+                    if action in item and "error" in item[action]:
+                        meta_id = str(item[action]["_id"])
+                        if item[action].get("status", 0) in (429, 502, 503, 504) and attempt + 1 < ATTEMPT_TIME:
+                            retry[meta_id] = pending[meta_id]
+                        else:
+                            res.append(meta_id + ":" + str(item[action]["error"]))
+            if res or not retry:
+                return res
+            logger.warning(f"OSConnection.insert retrying {len(retry)} of {len(pending)} documents")
+            pending = retry
         return res
 
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
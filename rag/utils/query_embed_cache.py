@@ -0,0 +1,155 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import base64
+import logging
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import xxhash
+
+from rag.settings import QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL, QUERY_EMBED_CACHE_TENANT_TTL
+from rag.utils.redis_conn import REDIS_CONN
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings: an in-process LRU in front of Redis.
+
+    Entries are keyed by (`model_id`, normalized query text), so tenants never share
+    vectors even though the Redis tier is shared by the whole deployment. Redis values
+    hold the token count of the original call followed by the vector packed as
+    little-endian float32, base64 encoded since the shared connection decodes
+    responses. A hit costs no provider tokens, so nothing is billed to the tenant.
+    """
+
+    PREFIX = "qembd"
+
+    def __init__(self, capacity=QUERY_EMBED_CACHE_SIZE):
+        self.capacity = capacity
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "tokens_saved": 0}
+
+    @staticmethod
+    def normalize(txt: str) -> str:
+        return re.sub(r"\s+", " ", str(txt)).strip()
+
+    @staticmethod
+    def model_id(emb_mdl) -> str:
+        """
+        Identity of the vectors `emb_mdl` produces: tenant, factory-qualified model name and endpoint.
+        The tenant is part of it because self-hosted factories (Ollama, LocalAI, OpenAI-API-Compatible...)
+        let two tenants map the same name and even the same base url to different weights.
+        """
+        mdl = getattr(emb_mdl, "mdl", emb_mdl)
+        name = getattr(emb_mdl, "model_key", None)
+        if not name:
+            name = "{}@{}".format(getattr(mdl, "model_name", None) or getattr(mdl, "_model_name", None) or getattr(emb_mdl, "llm_name", ""), type(mdl).__name__)
+        return "{}/{}/{}".format(getattr(emb_mdl, "tenant_id", ""), name, getattr(emb_mdl, "base_url", ""))
+
+    @staticmethod
+    def ttl(tenant_id) -> int:
+        return int(QUERY_EMBED_CACHE_TENANT_TTL.get(tenant_id, QUERY_EMBED_CACHE_TTL))
+
+    def _key(self, model_id, txt):
+        hasher = xxhash.xxh64()
+        hasher.update(model_id.encode("utf-8"))
+        hasher.update(b"\0")
+        hasher.update(txt.encode("utf-8", "surrogatepass"))
+        return f"{self.PREFIX}:{hasher.hexdigest()}"
+
+    @staticmethod
+    def _pack(vector: np.ndarray, used_tokens: int) -> str:
+        return base64.b64encode(struct.pack("<I", int(used_tokens)) + vector.astype("<f4").tobytes()).decode("ascii")
+
+    @staticmethod
+    def _unpack(value: str):
+        raw = base64.b64decode(value)
+        used_tokens = struct.unpack("<I", raw[:4])[0]
+        return np.frombuffer(raw[4:], dtype="<f4").astype(np.float32), used_tokens
+
+    def _get_local(self, k):
+        with self._lock:
+            entry = self._lru.get(k)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._lru[k]
+                return None
+            self._lru.move_to_end(k)
+            return entry
+
+    def _set_local(self, k, vector, used_tokens, ttl):
+        with self._lock:
+            self._lru[k] = (time.time() + ttl, vector, used_tokens)
+            self._lru.move_to_end(k)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def _count(self, stat, used_tokens=0):
+        with self._lock:
+            self._stats[stat] += 1
+            if stat != "misses":
+                self._stats["tokens_saved"] += used_tokens
+
+    def encode_queries(self, emb_mdl, txt: str):
+        """
+        Same contract as `LLMBundle.encode_queries`: returns (vector, used_tokens).
+        `used_tokens` is 0 on a hit since the provider was not called.
+        """
+        txt = self.normalize(txt)
+        ttl = self.ttl(getattr(emb_mdl, "tenant_id", None))
+        if ttl <= 0:
+            return emb_mdl.encode_queries(txt)
+
+        k = self._key(self.model_id(emb_mdl), txt)
+        entry = self._get_local(k)
+        if entry is not None:
+            self._count("local_hits", entry[2])
+            return entry[1], 0
+
+        try:
+            value = REDIS_CONN.get(k)
+            if value:
+                vector, used_tokens = self._unpack(value)
+                self._set_local(k, vector, used_tokens, ttl)
+                self._count("redis_hits", used_tokens)
+                return vector, 0
+        except Exception:
+            logging.exception("QueryEmbeddingCache.encode_queries failed to read {}".format(k))
+
+        self._count("misses")
+        vector, used_tokens = emb_mdl.encode_queries(txt)
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.ndim == 1:
+            self._set_local(k, vector, used_tokens, ttl)
+            REDIS_CONN.set(k, self._pack(vector, used_tokens), ttl)
+        return vector, used_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            res = dict(self._stats)
+            res["size"] = len(self._lru)
+        lookups = res["local_hits"] + res["redis_hits"] + res["misses"]
+        res["hit_ratio"] = round((res["local_hits"] + res["redis_hits"]) / lookups, 4) if lookups else 0.0
+        return res
+
+
+QUERY_EMBED_CACHE = QueryEmbeddingCache()
@@ -16,6 +16,7 @@
 
 import logging
 import json
+import time
 import uuid
 
 import valkey as redis
@@ -46,6 +47,9 @@ class RedisMsg:
     def get_msg_id(self):
         return self.__msg_id
 
+    def get_queue_name(self):
+        return self.__queue_name
+
 
 @singleton
 class RedisDB:
@@ -62,6 +66,8 @@ class RedisDB:
     def __init__(self):
         self.REDIS = None
         self.config = settings.REDIS
+        # (queue, group) pairs known to exist, so reads don't ask XINFO GROUPS every time.
+        self.__groups = set()
         self.__open__()
 
     def register_scripts(self) -> None:
@@ -224,11 +230,29 @@ class RedisDB:
             self.__open__()
         return False
 
-    def queue_product(self, queue, message) -> bool:
+    @staticmethod
+    def sub_queue_name(queue, sub_queue) -> str:
+        return f"{queue}:{sub_queue}" if sub_queue else queue
+
+    @staticmethod
+    def sub_queues_key(queue) -> str:
+        return f"{queue}_subqueues"
+
+    def queue_product(self, queue, message, sub_queue="") -> bool:
+        """
+        Append a message to a stream. With `sub_queue`, e.g. a tenant id, it goes to the stream
+        `queue:sub_queue` instead, registered with the time of its last message in `sub_queues_key(queue)`.
+        """
         for _ in range(3):
             try:
                 payload = {"message": json.dumps(message)}
-                self.REDIS.xadd(queue, payload)
+                if not sub_queue:
+                    self.REDIS.xadd(queue, payload)
+                    return True
+                pipe = self.REDIS.pipeline(transaction=False)
+                pipe.xadd(self.sub_queue_name(queue, sub_queue), payload)
+                pipe.zadd(self.sub_queues_key(queue), {sub_queue: time.time()})
+                pipe.execute()
                 return True
             except Exception as e:
                 logging.exception(
@@ -237,52 +261,104 @@ class RedisDB:
                 self.__open__()
         return False
 
+    def sub_queues(self, queue, max_idle, group_name) -> list[str]:
+        """
+        Sub-queues of `queue` that got or handed out a message within the last `max_idle` seconds,
+        or that still hold messages `group_name` has not read or acked. Idle and drained ones are unregistered.
+        """
+        try:
+            key = self.sub_queues_key(queue)
+            now = time.time()
+            res = self.REDIS.zrangebyscore(key, now - max_idle, "+inf")
+            idle = self.REDIS.zrangebyscore(key, "-inf", now - max_idle)
+            if not idle:
+                return res
+            pipe = self.REDIS.pipeline(transaction=False)
+            for sub_queue in idle:
+                pipe.xlen(self.sub_queue_name(queue, sub_queue))
+                pipe.xinfo_groups(self.sub_queue_name(queue, sub_queue))
+            replies = pipe.execute(raise_on_error=False)
+            backlog, drained = [], []
+            for sub_queue, length, groups in zip(idle, replies[::2], replies[1::2]):
+                if isinstance(length, Exception) or not length:
+                    drained.append(sub_queue)
+                    continue
+                group = None if isinstance(groups, Exception) else next((g for g in groups if g["name"] == group_name), None)
+                # Without the group nothing was read yet; a None lag means Redis can't tell, keep it then.
+                if group is None or group.get("lag") is None or int(group["lag"]) > 0 or int(group.get("pending", 0) or 0) > 0:
+                    backlog.append(sub_queue)
+                else:
+                    drained.append(sub_queue)
+            if drained:
+                self.REDIS.zrem(key, *drained)
+            return res + backlog
+        except Exception as e:
+            logging.warning("RedisDB.sub_queues " + str(queue) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
+    def touch_sub_queues(self, queue, sub_queues):
+        if not sub_queues:
+            return
+        try:
+            now = time.time()
+            self.REDIS.zadd(self.sub_queues_key(queue), {s: now for s in sub_queues}, xx=True)
+        except Exception as e:
+            logging.warning("RedisDB.touch_sub_queues " + str(queue) + " got exception: " + str(e))
+            self.__open__()
+
+    def ensure_group(self, queue_name, group_name):
+        if (queue_name, group_name) in self.__groups:
+            return
+        try:
+            self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "busygroup" not in str(e).lower():
+                raise
+        self.__groups.add((queue_name, group_name))
+
     def queue_consumer(self, queue_name, group_name, consumer_name, msg_id=b">") -> RedisMsg:
         """https://redis.io/docs/latest/commands/xreadgroup/"""
+        res = self.queue_consumer_batch([queue_name], group_name, consumer_name, 1, msg_id)
+        return res[0] if res else None
+
+    def queue_consumer_batch(self, queue_names, group_name, consumer_name, count, msg_id=b">") -> list[RedisMsg]:
+        """Read up to `count` messages from each of the streams with a single XREADGROUP."""
+        if not queue_names:
+            return []
         for _ in range(3):
             try:
-
-                try:
-                    group_info = self.REDIS.xinfo_groups(queue_name)
-                    if not any(gi["name"] == group_name for gi in group_info):
-                        self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
-                except redis.exceptions.ResponseError as e:
-                    if "no such key" in str(e).lower():
-                        self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
-                    elif "busygroup" in str(e).lower():
-                        logging.warning("Group already exists, continue.")
-                        pass
-                    else:
-                        raise
-
+                for queue_name in queue_names:
+                    self.ensure_group(queue_name, group_name)
                 args = {
                     "groupname": group_name,
                     "consumername": consumer_name,
-                    "count": 1,
+                    "count": count,
                     "block": 5,
-                    "streams": {queue_name: msg_id},
+                    "streams": {queue_name: msg_id for queue_name in queue_names},
                 }
                 messages = self.REDIS.xreadgroup(**args)
-                if not messages:
-                    return None
-                stream, element_list = messages[0]
-                if not element_list:
-                    return None
-                msg_id, payload = element_list[0]
-                res = RedisMsg(self.REDIS, queue_name, group_name, msg_id, payload)
+                res = []
+                for stream, element_list in messages or []:
+                    for mid, payload in element_list or []:
+                        res.append(RedisMsg(self.REDIS, stream, group_name, mid, payload))
                 return res
             except Exception as e:
+                if "nogroup" in str(e).lower():
+                    # The stream or its group was deleted behind our back, create them again.
+                    self.__groups = {g for g in self.__groups if g[0] not in queue_names}
+                    continue
                 if str(e) == 'no such key':
                     pass
                 else:
                     logging.exception(
                         "RedisDB.queue_consumer "
-                        + str(queue_name)
+                        + str(queue_names)
                         + " got exception: "
                         + str(e)
                     )
                     self.__open__()
-        return None
+        return []
 
     def get_unacked_iterator(self, queue_names: list[str], group_name, consumer_name):
         try:
@@ -348,6 +424,28 @@ class RedisDB:
                 self.__open__()
         return None
 
+    def queue_infos(self, queues, group_name) -> dict:
+        """Group info of `group_name` on every stream, fetched in one round trip. Streams without the group are left out."""
+        for _ in range(3):
+            try:
+                pipe = self.REDIS.pipeline(transaction=False)
+                for queue in queues:
+                    pipe.xinfo_groups(queue)
+                res = {}
+                for queue, groups in zip(queues, pipe.execute(raise_on_error=False)):
+                    if isinstance(groups, Exception):
+                        continue
+                    for group in groups:
+                        if group["name"] == group_name:
+                            res[queue] = group
+                return res
+            except Exception as e:
+                logging.warning(
+                    "RedisDB.queue_infos " + str(queues) + " got exception: " + str(e)
+                )
+                self.__open__()
+        return {}
+
     def delete_if_equal(self, key: str, expected_value: str) -> bool:
         """
         Do following atomically:
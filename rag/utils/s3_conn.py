@@ -165,6 +165,52 @@ class RAGFlowS3:
                 time.sleep(1)
         return
 
+    @use_prefix_path
+    @use_default_bucket
+    def open_stream(self, bucket, fnm, chunk_size=1024 * 1024, *args, **kwargs):
+        """Iterate over the object in chunks of up to `chunk_size` bytes instead of reading it whole."""
+        try:
+            body = self.conn[0].get_object(Bucket=bucket, Key=fnm)['Body']
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm}")
+            return None
+
+        def chunks():
+            try:
+                yield from body.iter_chunks(chunk_size)
+            finally:
+                body.close()
+        return chunks()
+
+    @use_prefix_path
+    @use_default_bucket
+    def get_range(self, bucket, fnm, start, end=None, *args, **kwargs):
+        """Bytes [start, end) of the object, up to its end when `end` is None."""
+        try:
+            rng = f"bytes={start}-" if end is None else f"bytes={start}-{end - 1}"
+            return self.conn[0].get_object(Bucket=bucket, Key=fnm, Range=rng)['Body'].read()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} [{start}, {end})")
+        return None
+
+    @use_prefix_path
+    @use_default_bucket
+    def size(self, bucket, fnm, *args, **kwargs):
+        try:
+            return self.conn[0].head_object(Bucket=bucket, Key=fnm)['ContentLength']
+        except Exception as e:
+            logging.warning(f"fail stat {bucket}/{fnm}: {e}")
+        return None
+
+    @use_prefix_path
+    @use_default_bucket
+    def etag(self, bucket, fnm, *args, **kwargs):
+        try:
+            return self.conn[0].head_object(Bucket=bucket, Key=fnm)['ETag'].strip('"')
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+        return None
+
     @use_prefix_path
     @use_default_bucket
     def obj_exist(self, bucket, fnm, *args, **kwargs):
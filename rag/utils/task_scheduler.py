@@ -0,0 +1,168 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+import time
+from collections import deque
+
+from rag.settings import SVR_CONSUMER_GROUP_NAME, TASK_PRIORITY_WEIGHTS, TASK_QUEUE_TENANT_TTL, get_svr_queue_name
+from rag.utils.redis_conn import REDIS_CONN
+
+
+def svr_queue_flows(priorities=(1, 0)) -> list[tuple]:
+    """(priority, tenant_id, stream) of every task stream, tenant_id is "" for the tasks queued without one."""
+    flows = []
+    for priority in priorities:
+        queue = get_svr_queue_name(priority)
+        flows.append((priority, "", queue))
+        for tenant_id in REDIS_CONN.sub_queues(queue, TASK_QUEUE_TENANT_TTL, SVR_CONSUMER_GROUP_NAME):
+            flows.append((priority, tenant_id, REDIS_CONN.sub_queue_name(queue, tenant_id)))
+    return flows
+
+
+def svr_queue_stats(priorities=(1, 0), flows=None) -> dict:
+    """Pending and lag of the task streams, in total, per priority and per tenant."""
+    flows = flows if flows is not None else svr_queue_flows(priorities)
+    infos = REDIS_CONN.queue_infos([q for _, _, q in flows], SVR_CONSUMER_GROUP_NAME)
+    res = {"pending": 0, "lag": 0, "priorities": {}, "tenants": {}, "streams": {}}
+    for priority, tenant_id, queue in flows:
+        info = infos.get(queue)
+        if info is None:
+            continue
+        pending, lag = int(info.get("pending", 0) or 0), info.get("lag")
+        res["streams"][queue] = lag
+        lag = int(lag or 0)
+        res["pending"] += pending
+        res["lag"] += lag
+        p = res["priorities"].setdefault(priority, {"pending": 0, "lag": 0})
+        p["pending"] += pending
+        p["lag"] += lag
+        if tenant_id:
+            t = res["tenants"].setdefault(tenant_id, {"pending": 0, "lag": 0})
+            t["pending"] += pending
+            t["lag"] += lag
+    return res
+
+
+class FairTaskScheduler:
+    """
+    Hand out the tasks of the priority queues in weighted fair turns over (priority, tenant) flows.
+
+    Producers queue the tasks of a tenant in its own sub-stream of the priority queue, tasks
+    queued without a tenant stay in the priority queue itself as one more flow. A refill is a
+    single XREADGROUP over the flows with queued tasks that were served the least, claiming about
+    as many tasks as there are free slots. Tasks are handed out in start-time fair order: a flow
+    advances by 1/weight of its priority for each task, so a tenant with thousands of queued
+    files takes turns with the others instead of going first.
+    """
+
+    REFRESH_INTERVAL = 5
+
+    def __init__(self, consumer_name, priorities=(1, 0), weights=TASK_PRIORITY_WEIGHTS):
+        self.consumer_name = consumer_name
+        self.priorities = priorities
+        self.weights = weights
+        self._flows = []
+        self._lags = {}
+        self._refreshed_at = 0
+        self._clock = 0.0
+        self._finish = {}
+        self._buffer = {}
+
+    def _weight(self, priority):
+        return max(1, self.weights.get(priority, 1))
+
+    def _start(self, flow):
+        return max(self._finish.get(flow, 0.0), self._clock)
+
+    def _order(self, flow):
+        # Ties go to the higher priority.
+        return self._start(flow), -flow[0]
+
+    def refresh(self, force=False):
+        if not force and time.time() - self._refreshed_at < self.REFRESH_INTERVAL:
+            return
+        self._refreshed_at = time.time()
+        self._flows = svr_queue_flows(self.priorities)
+        self._lags = svr_queue_stats(flows=self._flows)["streams"]
+        live = {(p, t) for p, t, _ in self._flows}
+        for flow in list(self._finish.keys()):
+            if flow not in live and not self._buffer.get(flow):
+                del self._finish[flow]
+
+    def _allocate(self, flows, free) -> dict:
+        """Share `free` claims among the flows in the order their tasks would be handed out."""
+        finish = {f: self._finish.get(f[:2], 0.0) for f in flows}
+        clock, alloc = self._clock, {}
+        for _ in range(max(1, free)):
+            # An unknown lag (no group yet, or Redis before 7.0) may hide any number of queued tasks.
+            candidates = [f for f in flows if self._lags.get(f[2]) is None or alloc.get(f, 0) < self._lags[f[2]]]
+            if not candidates:
+                break
+            f = min(candidates, key=lambda f: (max(finish[f], clock), -f[0]))
+            clock = max(finish[f], clock)
+            finish[f] = clock + 1.0 / self._weight(f[0])
+            alloc[f] = alloc.get(f, 0) + 1
+        return alloc
+
+    def fetch(self, free):
+        """Claim up to `free` tasks from the flows whose turns come first."""
+        self.refresh()
+        alloc = self._allocate([f for f in self._flows if self._lags.get(f[2]) != 0], free)
+        # One XREADGROUP per distinct share, usually one or two of them.
+        by_count = {}
+        for f, count in alloc.items():
+            by_count.setdefault(count, []).append(f)
+        total, touched = 0, {}
+        for count, flows in by_count.items():
+            msgs = REDIS_CONN.queue_consumer_batch([q for _, _, q in flows], SVR_CONSUMER_GROUP_NAME, self.consumer_name, count)
+            got = {}
+            for msg in msgs:
+                got.setdefault(msg.get_queue_name(), []).append(msg)
+            for priority, tenant_id, queue in flows:
+                n = len(got.get(queue, []))
+                lag = self._lags.get(queue)
+                # A stream that gave less than asked is drained until the next refresh.
+                self._lags[queue] = 0 if n < count else (max(0, lag - n) if lag is not None else None)
+                if not n:
+                    continue
+                total += n
+                self._buffer.setdefault((priority, tenant_id), deque()).extend(got[queue])
+                if tenant_id:
+                    touched.setdefault(get_svr_queue_name(priority), []).append(tenant_id)
+        for queue, tenant_ids in touched.items():
+            REDIS_CONN.touch_sub_queues(queue, tenant_ids)
+        logging.debug("FairTaskScheduler claimed {} tasks from {} streams".format(total, len(alloc)))
+        return total
+
+    def pop(self):
+        flows = [f for f, msgs in self._buffer.items() if msgs]
+        if not flows:
+            return None
+        flow = min(flows, key=self._order)
+        start = self._start(flow)
+        self._clock = start
+        self._finish[flow] = start + 1.0 / self._weight(flow[0])
+        return self._buffer[flow].popleft()
+
+    def next(self, free):
+        """The next task message to handle, refilling from Redis when none is claimed yet."""
+        msg = self.pop()
+        if msg is None and self.fetch(free):
+            msg = self.pop()
+        return msg
+
+    def buffered(self) -> int:
+        return sum(len(msgs) for msgs in self._buffer.values())
@@ -88,11 +88,11 @@ def upload_documents(auth, dataset_id, files_path=None):
             f.close()
 
 
-def download_document(auth, dataset_id, document_id, save_path):
+def download_document(auth, dataset_id, document_id, save_path, headers=None):
     url = f"{HOST_ADDRESS}{FILE_API_URL}/{document_id}".format(dataset_id=dataset_id)
-    res = requests.get(url=url, auth=auth, stream=True)
+    res = requests.get(url=url, auth=auth, headers=headers, stream=True)
     try:
-        if res.status_code == 200:
+        if res.status_code in (200, 206):
             with open(save_path, "wb") as f:
                 for chunk in res.iter_content(chunk_size=8192):
                     f.write(chunk)
@@ -152,6 +152,63 @@ class TestDocumentDownload:
                 tmp_path / f"ragflow_test_download_{i}.txt",
             )
 
+    @pytest.mark.p2
+    @pytest.mark.parametrize(
+        "range_header, start, stop",
+        [
+            ("bytes=0-9", 0, 10),
+            ("bytes=5-", 5, None),
+            ("bytes=-7", -7, None),
+        ],
+    )
+    def test_range(self, HttpApiAuth, add_documents, tmp_path, ragflow_tmp_dir, range_header, start, stop):
+        dataset_id, document_ids = add_documents
+        content = (ragflow_tmp_dir / "ragflow_test_upload_0.txt").read_bytes()
+        expected = content[start:stop]
+        res = download_document(
+            HttpApiAuth,
+            dataset_id,
+            document_ids[0],
+            tmp_path / "ragflow_test_download_range.txt",
+            headers={"Range": range_header},
+        )
+        assert res.status_code == codes.partial_content
+        first = start if start >= 0 else len(content) + start
+        assert res.headers["Content-Range"] == f"bytes {first}-{first + len(expected) - 1}/{len(content)}"
+        assert (tmp_path / "ragflow_test_download_range.txt").read_bytes() == expected
+
+    @pytest.mark.p2
+    def test_unsatisfiable_range(self, HttpApiAuth, add_documents, tmp_path, ragflow_tmp_dir):
+        dataset_id, document_ids = add_documents
+        size = (ragflow_tmp_dir / "ragflow_test_upload_0.txt").stat().st_size
+        res = download_document(
+            HttpApiAuth,
+            dataset_id,
+            document_ids[0],
+            tmp_path / "ragflow_test_download_range.txt",
+            headers={"Range": f"bytes={size}-"},
+        )
+        assert res.status_code == codes.requested_range_not_satisfiable
+        assert res.headers["Content-Range"] == f"bytes */{size}"
+        assert not (tmp_path / "ragflow_test_download_range.txt").exists()
+
+    @pytest.mark.p2
+    def test_streamed(self, HttpApiAuth, add_documents, tmp_path, ragflow_tmp_dir):
+        dataset_id, document_ids = add_documents
+        res = download_document(
+            HttpApiAuth,
+            dataset_id,
+            document_ids[0],
+            tmp_path / "ragflow_test_download_stream.txt",
+        )
+        assert res.status_code == codes.ok
+        assert res.headers["Accept-Ranges"] == "bytes"
+        assert int(res.headers["Content-Length"]) == (ragflow_tmp_dir / "ragflow_test_upload_0.txt").stat().st_size
+        assert compare_by_hash(
+            ragflow_tmp_dir / "ragflow_test_upload_0.txt",
+            tmp_path / "ragflow_test_download_stream.txt",
+        )
+
 
 @pytest.mark.p3
 def test_concurrent_download(HttpApiAuth, add_dataset, tmp_path):